@@ -23,6 +23,7 @@ from six.moves import filter, map, range, zip
 import koji
 from koji.util import base64encode, md5_constructor, to_list
 from koji_cli.lib import (
+    DownloadManager,
     TimeOption,
     DatetimeJSONEncoder,
     _list_tasks,
@@ -30,9 +31,6 @@ from koji_cli.lib import (
     _running_in_bg,
     activate_session,
     arg_filter,
-    download_archive,
-    download_file,
-    download_rpm,
     ensure_connection,
     error,
     format_inheritance_flags,
@@ -2687,9 +2685,9 @@ def anon_handle_list_tagged(goptions, session, args):
         parser.error("No such tag: %s" % tag)
 
     if options.rpms:
-        rpms, builds = session.listTaggedRPMS(tag, **opts)
-        data = rpms
         if options.paths:
+            # the builds come after the rpms, so we need the whole list
+            data, builds = session.listTaggedRPMS(tag, **opts)
             build_idx = dict([(b['id'], b) for b in builds])
             for rinfo in data:
                 build = build_idx[rinfo['build_id']]
@@ -2704,6 +2702,9 @@ def anon_handle_list_tagged(goptions, session, args):
             fmt = "%(path)s"
             data = [x for x in data if 'path' in x]
         else:
+            # only keep the formatted lines
+            data = (rinfo for path, rinfo in session.iterMethod('listTaggedRPMS', tag, **opts)
+                    if path == (0,))
             fmt = "%(name)s-%(version)s-%(release)s.%(arch)s"
             if options.sigs:
                 fmt = "%(sigkey)s " + fmt
@@ -4774,7 +4775,6 @@ def anon_handle_list_history(goptions, session, args):
             kwargs['afterEvent'] = session.getLastEvent()['id']
 
     while True:
-        histdata = session.queryHistory(tables=tables, **kwargs)
         timeline = []
 
         def distinguish_match(x, name):
@@ -4787,15 +4787,15 @@ def anon_handle_list_history(goptions, session, args):
                 if key.startswith(name):
                     ret = ret and x[key]
             return ret
-        for table in histdata:
-            hist = histdata[table]
-            for x in hist:
-                if x['revoke_event'] is not None:
-                    if distinguish_match(x, 'revoked'):
-                        timeline.append((x['revoke_event'], table, 0, x.copy()))
-                    # pprint.pprint(timeline[-1])
-                if distinguish_match(x, 'created'):
-                    timeline.append((x['create_event'], table, 1, x))
+        # entries are processed as they arrive
+        for path, x in session.iterMethod('queryHistory', tables=tables, **kwargs):
+            table = path[0]
+            if x['revoke_event'] is not None:
+                if distinguish_match(x, 'revoked'):
+                    timeline.append((x['revoke_event'], table, 0, x.copy()))
+                # pprint.pprint(timeline[-1])
+            if distinguish_match(x, 'created'):
+                timeline.append((x['create_event'], table, 1, x))
         timeline.sort(key=lambda entry: entry[:3])
         # group edits together
         new_timeline = []
@@ -6997,6 +6997,8 @@ def anon_handle_download_build(options, session, args):
     parser.add_option("--topurl", metavar="URL", default=options.topurl,
                       help="URL under which Koji files are accessible")
     parser.add_option("--noprogress", action="store_true", help="Do not display progress meter")
+    parser.add_option("--parallel", type="int", default=1, metavar="N",
+                      help="Download up to N files at the same time")
     parser.add_option("-q", "--quiet", action="store_true",
                       help="Suppress output", default=options.quiet)
     (suboptions, args) = parser.parse_args(args)
@@ -7004,6 +7006,8 @@ def anon_handle_download_build(options, session, args):
         parser.error("Please specify a package N-V-R or build ID")
     elif len(args) > 1:
         parser.error("Only a single package N-V-R or build ID may be specified")
+    if suboptions.parallel < 1:
+        parser.error("--parallel must be at least 1")
 
     ensure_connection(session, options)
     build = args[0]
@@ -7085,12 +7089,15 @@ def anon_handle_download_build(options, session, args):
                 rpms.remove(rpm)
 
     # run the download
+    manager = DownloadManager(parallel=suboptions.parallel, quiet=suboptions.quiet,
+                              noprogress=suboptions.noprogress)
     for rpm in rpms:
-        download_rpm(info, rpm, suboptions.topurl, sigkey=suboptions.key,
-                     quiet=suboptions.quiet, noprogress=suboptions.noprogress)
+        manager.add_rpm(info, rpm, suboptions.topurl, sigkey=suboptions.key)
     for archive in archives:
-        download_archive(info, archive, suboptions.topurl,
-                         quiet=suboptions.quiet, noprogress=suboptions.noprogress)
+        manager.add_archive(info, archive, suboptions.topurl)
+    failed = manager.run()
+    if failed:
+        error("%d of %d downloads failed" % (len(failed), len(manager.downloads)))
 
 
 def anon_handle_download_logs(options, session, args):
@@ -7145,7 +7152,6 @@ def anon_handle_download_logs(options, session, args):
         else:
             full_filename = os.path.normpath(os.path.join(task_log_dir, filename))
         koji.ensuredir(os.path.dirname(full_filename))
-        contents = 'IGNORE ME!'
         if suboptions.cont and os.path.exists(full_filename):
             sys.stdout.write("Continuing: %s\n" % full_filename)
             fd = open(full_filename, 'ab')
@@ -7155,12 +7161,9 @@ def anon_handle_download_logs(options, session, args):
             fd = open(full_filename, 'wb')
             offset = 0
         try:
-            while contents:
-                contents = session.downloadTaskOutput(task_id, filename, offset=offset,
-                                                      size=blocksize, volume=volume)
-                offset += len(contents)
-                if contents:
-                    fd.write(contents)
+            for contents in session.iterTaskOutput(task_id, filename, offset=offset,
+                                                   volume=volume, blocksize=blocksize):
+                fd.write(contents)
         finally:
             fd.close()
 
@@ -7235,6 +7238,8 @@ def anon_handle_download_task(options, session, args):
                       help="Wait for running tasks to finish, even if running in the background")
     parser.add_option("--nowait", action="store_false", dest="wait",
                       help="Do not wait for running tasks to finish")
+    parser.add_option("--parallel", type="int", default=1, metavar="N",
+                      help="Download up to N files at the same time")
     parser.add_option("-q", "--quiet", action="store_true",
                       help="Suppress output", default=options.quiet)
 
@@ -7243,6 +7248,8 @@ def anon_handle_download_task(options, session, args):
         parser.error("Please specify a task ID")
     elif len(args) > 1:
         parser.error("Only one task ID may be specified")
+    if suboptions.parallel < 1:
+        parser.error("--parallel must be at least 1")
 
     base_task_id = int(args.pop())
     if len(suboptions.arches) > 0:
@@ -7279,24 +7286,27 @@ def anon_handle_download_task(options, session, args):
     downloads = []
 
     for task in downloadable_tasks:
-        files = list_task_output_all_volumes(session, task["id"])
+        # the sizes let us resume and check the downloads
+        files = list_task_output_all_volumes(session, task["id"], stat=True)
         for filename in files:
             if filename.endswith(".rpm"):
                 for volume in files[filename]:
                     filearch = filename.split(".")[-2]
                     if len(suboptions.arches) == 0 or filearch in suboptions.arches:
-                        downloads.append((task, filename, volume, filename))
+                        downloads.append((task, filename, volume, filename,
+                                          files[filename][volume]))
             elif filename.endswith(".log") and suboptions.logs:
                 for volume in files[filename]:
                     # rename logs, they would conflict
                     new_filename = "%s.%s.log" % (filename.rstrip(".log"), task["arch"])
-                    downloads.append((task, filename, volume, new_filename))
+                    downloads.append((task, filename, volume, new_filename,
+                                      files[filename][volume]))
 
     if len(downloads) == 0:
         error("No files for download found.")
 
     required_tasks = {}
-    for (task, nop, nop, nop) in downloads:
+    for (task, nop, nop, nop, nop) in downloads:
         if task["id"] not in required_tasks:
             required_tasks[task["id"]] = task
 
@@ -7308,18 +7318,20 @@ def anon_handle_download_task(options, session, args):
                 error("Child task %d has not finished yet." % task_id)
 
     # perform the download
-    number = 0
+    manager = DownloadManager(parallel=suboptions.parallel, quiet=suboptions.quiet,
+                              noprogress=suboptions.noprogress)
     pathinfo = koji.PathInfo(topdir=suboptions.topurl)
-    for (task, filename, volume, new_filename) in downloads:
-        number += 1
+    for (task, filename, volume, new_filename, stat_info) in downloads:
         if volume not in (None, 'DEFAULT'):
             koji.ensuredir(volume)
             new_filename = os.path.join(volume, new_filename)
         if '..' in filename:
             error('Invalid file name: %s' % filename)
         url = '%s/%s/%s' % (pathinfo.work(volume), pathinfo.taskrelpath(task["id"]), filename)
-        download_file(url, new_filename, quiet=suboptions.quiet, noprogress=suboptions.noprogress,
-                      size=len(downloads), num=number)
+        manager.add(url, new_filename, size=int(stat_info['st_size']))
+    failed = manager.run()
+    if failed:
+        error("%d of %d downloads failed" % (len(failed), len(downloads)))
 
 
 def anon_handle_wait_repo(options, session, args):
@@ -8,6 +8,7 @@ import random
 import socket
 import string
 import sys
+import threading
 import time
 import json
 from contextlib import closing
@@ -212,13 +213,20 @@ class TaskWatcher(object):
         else:
             return '%s: %s' % (error.__class__.__name__, str(error).strip())
 
-    def update(self):
-        """Update info and log if needed.  Returns True on state change."""
+    def update(self, info=None):
+        """Update info and log if needed.  Returns True on state change.
+
+        The current task info is fetched, unless given in info (as returned
+        by watchTasks, where the request may be left out)"""
         if self.is_done():
             # Already done, nothing else to report
             return False
         last = self.info
-        self.info = self.session.getTaskInfo(self.id, request=True)
+        if info is None:
+            info = self.session.getTaskInfo(self.id, request=True)
+        elif 'request' not in info and last:
+            info['request'] = last['request']
+        self.info = info
         if self.info is None:
             if not self.quiet:
                 print("No such task id: %i" % self.id)
@@ -320,6 +328,37 @@ def display_task_results(tasks):
             print('%s has not completed' % task_label)
 
 
+class TaskTreeWatcher(object):
+    """Wait for task changes using the watchTasks hub call
+
+    Falls back to polling (watch returns None) when the hub does not support
+    it.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.supported = True
+        self.token = None
+
+    def watch(self, task_ids, timeout):
+        """Wait (at most timeout seconds) for changes of the given tasks
+
+        The first call returns right away. Returns the current info of the
+        tasks and their children by id, or None if not supported.
+        """
+        if not self.supported:
+            return None
+        try:
+            result = self.session.watchTasks(task_ids, self.token, timeout)
+        except koji.GenericError as e:
+            if isinstance(e, koji.ActionNotAllowed) or 'Invalid method' in str(e):
+                self.supported = False
+                return None
+            raise
+        self.token = result['token']
+        return dict((task['id'], task) for task in result['tasks'])
+
+
 def watch_tasks(session, tasklist, quiet=False, poll_interval=60, ki_handler=None, topurl=None):
     if not tasklist:
         return
@@ -336,14 +375,20 @@ def watch_tasks(session, tasklist, quiet=False, poll_interval=60, ki_handler=Non
                     "Running Tasks:\n%s" % (progname, '\n'.join(tlist)))
     sys.stdout.flush()
     rv = 0
+    watcher = TaskTreeWatcher(session)
     try:
         tasks = {}
         for task_id in tasklist:
             tasks[task_id] = TaskWatcher(task_id, session, quiet=quiet, topurl=topurl)
         while True:
             all_done = True
+            # with hub support, this waits for changes instead of sleeping
+            current = watcher.watch(list(tasks.keys()), poll_interval)
             for task_id, task in list(tasks.items()):
-                changed = task.update()
+                if current is None:
+                    changed = task.update()
+                else:
+                    changed = task.update(current.get(task_id))
                 if not task.is_done():
                     all_done = False
                 else:
@@ -353,12 +398,16 @@ def watch_tasks(session, tasklist, quiet=False, poll_interval=60, ki_handler=Non
                             display_tasklist_status(tasks)
                     if task.level == 0 and not task.is_success():
                         rv = 1
-                for child in session.getTaskChildren(task_id):
+                if current is None:
+                    children = session.getTaskChildren(task_id)
+                else:
+                    children = [t for t in current.values() if t['parent'] == task_id]
+                for child in children:
                     child_id = child['id']
                     if child_id not in tasks.keys():
                         tasks[child_id] = TaskWatcher(child_id, session, task.level + 1,
                                                       quiet=quiet, topurl=topurl)
-                        tasks[child_id].update()
+                        tasks[child_id].update(None if current is None else child)
                         # If we found new children, go through the list again,
                         # in case they have children also
                         all_done = False
@@ -369,7 +418,8 @@ def watch_tasks(session, tasklist, quiet=False, poll_interval=60, ki_handler=Non
                 break
 
             sys.stdout.flush()
-            time.sleep(poll_interval)
+            if current is None:
+                time.sleep(poll_interval)
     except KeyboardInterrupt:
         if tasks:
             progname = os.path.basename(sys.argv[0]) or 'koji'
@@ -403,9 +453,20 @@ def watch_logs(session, tasklist, opts, poll_interval):
         offsets[task_id] = {}
 
     lastlog = None
+    watcher = TaskTreeWatcher(session)
     while True:
+        # with hub support, this returns early when the tasks change
+        current = watcher.watch(tasklist, poll_interval)
         for task_id in tasklist[:]:
-            if _isDone(session, task_id):
+            if current is None:
+                done = _isDone(session, task_id)
+            elif task_id not in current:
+                print("No such task id: %i" % task_id)
+                sys.exit(1)
+            else:
+                state = koji.TASK_STATES[current[task_id]['state']]
+                done = state in ['CLOSED', 'CANCELED', 'FAILED']
+            if done:
                 tasklist.remove(task_id)
 
             output = list_task_output_all_volumes(session, task_id)
@@ -421,25 +482,26 @@ def watch_logs(session, tasklist, opts, poll_interval):
 
             taskoffsets = offsets[task_id]
             for log, volume in logs:
-                contents = 'placeholder'
-                while contents:
-                    if (log, volume) not in taskoffsets:
-                        taskoffsets[(log, volume)] = 0
-
-                    contents = session.downloadTaskOutput(task_id, log, taskoffsets[(log, volume)],
-                                                          16384, volume=volume)
+                if (log, volume) not in taskoffsets:
+                    taskoffsets[(log, volume)] = 0
+                # the rest of the log in one request, if the hub supports it
+                for contents in session.iterTaskOutput(task_id, log, taskoffsets[(log, volume)],
+                                                       volume=volume, blocksize=16384):
                     taskoffsets[(log, volume)] += len(contents)
-                    if contents:
-                        currlog = "%d:%s:%s:" % (task_id, volume, log)
-                        if currlog != lastlog:
-                            if lastlog:
-                                sys.stdout.write("\n")
-                            sys.stdout.write("==> %s <==\n" % currlog)
-                            lastlog = currlog
-                        bytes_to_stdout(contents)
+                    currlog = "%d:%s:%s:" % (task_id, volume, log)
+                    if currlog != lastlog:
+                        if lastlog:
+                            sys.stdout.write("\n")
+                        sys.stdout.write("==> %s <==\n" % currlog)
+                        lastlog = currlog
+                    bytes_to_stdout(contents)
 
             if opts.follow:
-                for child in session.getTaskChildren(task_id):
+                if current is None:
+                    children = session.getTaskChildren(task_id)
+                else:
+                    children = [t for t in current.values() if t['parent'] == task_id]
+                for child in children:
                     if child['id'] not in tasklist:
                         tasklist.append(child['id'])
                         offsets[child['id']] = {}
@@ -447,17 +509,26 @@ def watch_logs(session, tasklist, opts, poll_interval):
         if not tasklist:
             break
 
-        time.sleep(poll_interval)
+        if current is None:
+            time.sleep(poll_interval)
+
 
+def list_task_output_all_volumes(session, task_id, stat=False):
+    """List task output with all volumes, or fake it
 
-def list_task_output_all_volumes(session, task_id):
-    """List task output with all volumes, or fake it"""
+    With stat, the volumes of each file map to the stat info of the file.
+    """
     try:
+        if stat:
+            return session.listTaskOutput(task_id, stat=True, all_volumes=True)
         return session.listTaskOutput(task_id, all_volumes=True)
     except koji.ParameterError as e:
         if 'got an unexpected keyword argument' not in str(e):
             raise
     # otherwise leave off the option and fake it
+    if stat:
+        output = session.listTaskOutput(task_id, stat=True)
+        return dict([fn, {'DEFAULT': output[fn]}] for fn in output)
     output = session.listTaskOutput(task_id)
     return dict([fn, ['DEFAULT']] for fn in output)
 
@@ -607,46 +678,18 @@ def download_file(url, relpath, quiet=False, noprogress=False, size=None,
         print('')
 
 
-def download_rpm(build, rpm, topurl, sigkey=None, quiet=False, noprogress=False):
-    "Wrapper around download_file, do additional checks for rpm files"
+def _rpm_download_url(build, rpm, topurl, sigkey=None):
+    """Return the url of an rpm and the relative path to save it to"""
     pi = koji.PathInfo(topdir=topurl)
     if sigkey:
         fname = pi.signed(rpm, sigkey)
-        filesize = None
     else:
         fname = pi.rpm(rpm)
-        filesize = rpm['size']
-    url = os.path.join(pi.build(build), fname)
-    path = os.path.basename(fname)
-
-    download_file(url, path, quiet=quiet, noprogress=noprogress, filesize=filesize)
+    return os.path.join(pi.build(build), fname), os.path.basename(fname)
 
-    # size - we have stored size only for unsigned copies
-    if not sigkey:
-        size = os.path.getsize(path)
-        if size != rpm['size']:
-            os.unlink(path)
-            error("Downloaded rpm %s size %d does not match db size %d, deleting" %
-                  (path, size, rpm['size']))
-
-    # basic sanity
-    try:
-        koji.check_rpm_file(path)
-    except koji.GenericError as ex:
-        os.unlink(path)
-        warn(str(ex))
-        error("Downloaded rpm %s is not valid rpm file, deleting" % path)
-
-    # payload hash
-    sigmd5 = koji.get_header_fields(path, ['sigmd5'])['sigmd5']
-    if rpm['payloadhash'] != koji.hex_string(sigmd5):
-        os.unlink(path)
-        error("Downloaded rpm %s doesn't match db, deleting" % path)
-
-
-def download_archive(build, archive, topurl, quiet=False, noprogress=False):
-    "Wrapper around download_file, do additional checks for archive files"
 
+def _archive_download_url(build, archive, topurl):
+    """Return the url of an archive and the relative path to save it to"""
     pi = koji.PathInfo(topdir=topurl)
     if archive['btype'] == 'maven':
         url = os.path.join(pi.mavenbuild(build), pi.mavenfile(archive))
@@ -662,13 +705,42 @@ def download_archive(build, archive, topurl, quiet=False, noprogress=False):
         directory = pi.typedir(build, archive['btype'])
         url = os.path.join(directory, archive['filename'])
         path = archive['filename']
+    return url, path
 
-    download_file(url, path, quiet=quiet, noprogress=noprogress, filesize=archive['size'])
 
+def check_rpm_download(path, rpm, sigkey=None):
+    """Check a downloaded rpm against the rpm info of the hub
+
+    :returns: an error message if the file is not valid, else None
+    """
+    # size - we have stored size only for unsigned copies
+    if not sigkey:
+        size = os.path.getsize(path)
+        if size != rpm['size']:
+            return ("Downloaded rpm %s size %d does not match db size %d, deleting" %
+                    (path, size, rpm['size']))
+
+    # basic sanity
+    try:
+        koji.check_rpm_file(path)
+    except koji.GenericError as ex:
+        return "%s\nDownloaded rpm %s is not valid rpm file, deleting" % (ex, path)
+
+    # payload hash
+    sigmd5 = koji.get_header_fields(path, ['sigmd5'])['sigmd5']
+    if rpm['payloadhash'] != koji.hex_string(sigmd5):
+        return "Downloaded rpm %s doesn't match db, deleting" % path
+    return None
+
+
+def check_archive_download(path, archive):
+    """Check a downloaded archive against the archive info of the hub
+
+    :returns: an error message if the file is not valid, else None
+    """
     # check size
     if os.path.getsize(path) != archive['size']:
-        os.unlink(path)
-        error("Downloaded rpm %s size does not match db size, deleting" % path)
+        return "Downloaded rpm %s size does not match db size, deleting" % path
 
     # check checksum/checksum_type
     if archive['checksum_type'] == koji.CHECKSUM_TYPES['md5']:
@@ -679,7 +751,7 @@ def download_archive(build, archive, topurl, quiet=False, noprogress=False):
         hash = hashlib.sha256()
     else:
         # shouldn't happen
-        error("Unknown checksum type: %s" % archive['checksum_type'])
+        return "Unknown checksum type: %s" % archive['checksum_type']
     with open(path, "rb") as f:
         while True:
             chunk = f.read(1024**2)
@@ -687,8 +759,274 @@ def download_archive(build, archive, topurl, quiet=False, noprogress=False):
             if not chunk:
                 break
     if hash.hexdigest() != archive['checksum']:
+        return "Downloaded archive %s doesn't match checksum, deleting" % path
+    return None
+
+
+def download_rpm(build, rpm, topurl, sigkey=None, quiet=False, noprogress=False):
+    "Wrapper around download_file, do additional checks for rpm files"
+    url, path = _rpm_download_url(build, rpm, topurl, sigkey)
+    if sigkey:
+        filesize = None
+    else:
+        filesize = rpm['size']
+
+    download_file(url, path, quiet=quiet, noprogress=noprogress, filesize=filesize)
+
+    msg = check_rpm_download(path, rpm, sigkey)
+    if msg:
         os.unlink(path)
-        error("Downloaded archive %s doesn't match checksum, deleting" % path)
+        error(msg)
+
+
+def download_archive(build, archive, topurl, quiet=False, noprogress=False):
+    "Wrapper around download_file, do additional checks for archive files"
+    url, path = _archive_download_url(build, archive, topurl)
+
+    download_file(url, path, quiet=quiet, noprogress=noprogress, filesize=archive['size'])
+
+    msg = check_archive_download(path, archive)
+    if msg:
+        os.unlink(path)
+        error(msg)
+
+
+class DownloadManager(object):
+    """Download files, several at the same time
+
+    Each worker uses its own requests session, so its connection is kept
+    alive for the next files. Existing partial files are resumed with Range
+    requests if their size is known or they can be checked, e.g. rpms
+    against their payload hash. Downloaded files are checked against their
+    size and check, a resumed file which fails is downloaded again and
+    other bad files are deleted. A single progress line covers all files.
+
+    Usage:
+
+        manager = DownloadManager(parallel=4)
+        manager.add_rpm(build, rpm, topurl)
+        manager.add(url, 'build.log')
+        failed = manager.run()
+    """
+
+    def __init__(self, parallel=1, quiet=False, noprogress=False, retries=2,
+                 blocksize=1048576):
+        self.parallel = parallel
+        self.quiet = quiet
+        self.progress = not (quiet or noprogress)
+        self.retries = retries
+        self.blocksize = blocksize
+        self.downloads = []
+        self.lock = threading.Lock()
+        self.failed = []
+
+    def add(self, url, relpath, size=None, check=None):
+        """Add a file to download
+
+        :param str url: URL to be downloaded
+        :param str relpath: where to save it
+        :param int size: expected file size, if known
+        :param check: function called with the path of the downloaded file,
+                      returning an error message if the file is not valid
+        """
+        self.downloads.append({'url': url, 'path': relpath, 'size': size, 'check': check})
+
+    def add_rpm(self, build, rpm, topurl, sigkey=None):
+        """Add an rpm, checked against the rpm info of the hub"""
+        url, path = _rpm_download_url(build, rpm, topurl, sigkey)
+        size = None if sigkey else rpm['size']
+        self.add(url, path, size=size, check=lambda p: check_rpm_download(p, rpm, sigkey))
+
+    def add_archive(self, build, archive, topurl):
+        """Add an archive, checked against its checksum"""
+        url, path = _archive_download_url(build, archive, topurl)
+        self.add(url, path, size=archive['size'],
+                 check=lambda p: check_archive_download(p, archive))
+
+    def run(self):
+        """Download the added files
+
+        :returns: a list of (path, error message) of the failed downloads
+        """
+        self.total = sum([dl['size'] or 0 for dl in self.downloads])
+        # bytes on disk and bytes received
+        self.done = 0
+        self.received = 0
+        self.finished = 0
+        self.start = time.time()
+        self.shown = 0
+        self.width = 0
+        queue = six.moves.queue.Queue()
+        for num, dl in enumerate(self.downloads):
+            queue.put((num + 1, dl))
+        workers = min(self.parallel, len(self.downloads))
+        if workers <= 1:
+            self._worker(queue)
+        else:
+            threads = [threading.Thread(target=self._worker, args=(queue,))
+                       for i in range(workers)]
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            for thread in threads:
+                thread.join()
+        if self.progress and self.downloads:
+            with self.lock:
+                self._show()
+            print('')
+        return self.failed
+
+    def _worker(self, queue):
+        rsession = requests.Session()
+        try:
+            while True:
+                try:
+                    num, dl = queue.get_nowait()
+                except six.moves.queue.Empty:
+                    return
+                try:
+                    msg = self._download(rsession, num, dl)
+                    if msg and os.path.isfile(dl['path']):
+                        os.unlink(dl['path'])
+                except (IOError, OSError, requests.exceptions.RequestException) as e:
+                    # partial files are kept for the next try
+                    msg = "Download of %s failed: %s" % (dl['path'], e)
+                if msg:
+                    with self.lock:
+                        self.failed.append((dl['path'], msg))
+                        self._clear()
+                        warn(msg)
+                with self.lock:
+                    self.finished += 1
+        finally:
+            rsession.close()
+
+    def _download(self, rsession, num, dl):
+        """Download a file, returns an error message if it failed"""
+        path = dl['path']
+        if '/' in path:
+            koji.ensuredir(os.path.dirname(path))
+        self._message("Downloading [%d/%d]: %s" % (num, len(self.downloads), path))
+        size = dl['size']
+        pos = 0
+        if (size is not None or dl['check']) and os.path.isfile(path):
+            pos = os.path.getsize(path)
+            if size is not None and pos > size:
+                pos = 0
+        resumed = pos > 0
+        if resumed:
+            self._count(pos, 0)
+        if resumed and pos == size:
+            self._message("File %s already downloaded, skipping" % path)
+        else:
+            if resumed:
+                self._message("Appending to existing file %s" % path)
+            pos = self._fetch(rsession, dl, pos)
+        msg = self._check(dl, pos)
+        if msg and resumed:
+            # the existing data may be bad, start over
+            self._message("Downloading %s again: %s" % (path, msg))
+            self._count(-pos, 0)
+            pos = self._fetch(rsession, dl, 0)
+            msg = self._check(dl, pos)
+        return msg
+
+    def _check(self, dl, pos):
+        if dl['size'] is not None and pos != dl['size']:
+            return ("Downloaded file %s size %d does not match expected size %d, deleting" %
+                    (dl['path'], pos, dl['size']))
+        if dl['check']:
+            return dl['check'](dl['path'])
+        return None
+
+    def _fetch(self, rsession, dl, pos):
+        """Download the file from pos, retrying after connection errors
+
+        :returns: the size of the file
+        """
+        tries = 0
+        while True:
+            try:
+                return self._get(rsession, dl, pos)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout) as e:
+                if tries >= self.retries:
+                    raise
+                tries += 1
+                self._message("Retrying download of %s: %s" % (dl['path'], e))
+                if os.path.isfile(dl['path']):
+                    # continue where the connection broke
+                    done = os.path.getsize(dl['path'])
+                    self._count(done - pos, 0)
+                    pos = done
+
+    def _get(self, rsession, dl, pos):
+        headers = {}
+        if pos:
+            headers['Range'] = 'bytes=%d-' % pos
+        # closing needs to be used for requests < 2.18.0
+        with closing(rsession.get(dl['url'], headers=headers, stream=True)) as response:
+            if pos and response.status_code == 416:
+                # nothing behind pos, the checks tell if the file is complete
+                return pos
+            response.raise_for_status()
+            if pos and response.status_code != 206:
+                # full content provided, rewrite
+                self._count(-pos, 0)
+                pos = 0
+            length = response.headers.get('Content-Length')
+            if dl['size'] is None and length and 'length' not in dl:
+                dl['length'] = pos + int(length)
+                with self.lock:
+                    self.total += dl['length']
+            with open(dl['path'], 'ab' if pos else 'wb') as fo:
+                for chunk in response.iter_content(chunk_size=self.blocksize):
+                    fo.write(chunk)
+                    pos += len(chunk)
+                    self._count(len(chunk), len(chunk))
+        return pos
+
+    def _count(self, done, received):
+        with self.lock:
+            self.done += done
+            self.received += received
+            if self.progress and time.time() - self.shown >= 0.2:
+                self._show()
+
+    def _message(self, msg):
+        if self.quiet:
+            return
+        with self.lock:
+            self._clear()
+            print(msg)
+            if self.progress:
+                self._show()
+
+    def _clear(self):
+        if self.width:
+            sys.stdout.write('\r%s\r' % (' ' * self.width))
+            self.width = 0
+
+    def _show(self):
+        """Show the progress of all downloads, the lock must be held"""
+        self.shown = time.time()
+        if self.total:
+            percent_done = min(float(self.done) / self.total, 1.0)
+            percent_done_str = "%3d%%" % (percent_done * 100)
+        else:
+            percent_done = 0.0
+            percent_done_str = "???%"
+        elapsed = self.shown - self.start
+        speed = "- B/sec"
+        if elapsed > 0:
+            speed = _format_size(self.received / elapsed) + "/sec"
+        line = "[% -36s] % 4s %d/%d files % 10s / %s % 14s" % (
+            '=' * (int(percent_done * 36)), percent_done_str, self.finished,
+            len(self.downloads), _format_size(self.done), _format_size(self.total), speed)
+        sys.stdout.write(line + '\r')
+        sys.stdout.flush()
+        self.width = len(line)
 
 
 def _download_progress(download_t, download_d, size=None):
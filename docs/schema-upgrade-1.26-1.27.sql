@@ -0,0 +1,10 @@
+-- upgrade script to migrate the Koji database schema
+-- from version 1.26 to 1.27
+
+
+BEGIN;
+
+-- used to claim tasks (FREE = 0, ASSIGNED = 4)
+CREATE INDEX task_by_claim_order ON task(priority, create_time) WHERE state IN (0, 4);
+
+COMMIT;
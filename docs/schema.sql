@@ -242,6 +242,8 @@ CREATE INDEX task_by_state ON task (state);
 -- CREATE INDEX task_by_parent ON task (parent);   (unique condition creates similar index)
 CREATE INDEX task_by_host ON task (host_id);
 CREATE INDEX task_by_no_parent_state_method ON task(parent, state, method) WHERE parent IS NULL;
+-- used to claim tasks (FREE = 0, ASSIGNED = 4)
+CREATE INDEX task_by_claim_order ON task(priority, create_time) WHERE state IN (0, 4);
 
 
 -- by package, we mean srpm
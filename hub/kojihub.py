@@ -26,6 +26,7 @@ from __future__ import absolute_import
 
 import base64
 import calendar
+import collections
 import datetime
 import fcntl
 import fnmatch
@@ -41,6 +42,7 @@ import stat
 import sys
 import tarfile
 import tempfile
+import threading
 import time
 import types
 import traceback
@@ -55,8 +57,10 @@ import koji
 import koji.auth
 import koji.db
 import koji.plugin
+from koji.plugin import readonly
 import koji.policy
 import koji.rpmdiff
+import koji.scheduler
 import koji.tasks
 from koji.tasks import parse_task_params
 import koji.xmlrpcplus
@@ -66,6 +70,7 @@ from koji.util import (
     base64encode,
     decode_bytes,
     dslice,
+    dslice_ex,
     joinpath,
     md5_constructor,
     move_and_symlink,
@@ -79,6 +84,13 @@ logger = logging.getLogger('koji.hub')
 
 NUMERIC_TYPES = (int, float)
 
+# advisory lock key held during a scheduler pass
+SCHEDULER_LOCK = 0x6b6f6a69
+
+# NOTIFY channel of task state changes, see Task.notify
+TASK_EVENTS_CHANNEL = 'koji_task_events'
+_task_listener = koji.db.NotifyListener(TASK_EVENTS_CHANNEL)
+
 
 def log_error(msg):
     logger.error(msg)
@@ -181,10 +193,14 @@ class Task(object):
         # note the SELECT...FOR UPDATE
         task_id = self.id
         if not force:
-            q = """SELECT state,host_id FROM task WHERE id=%(task_id)i FOR UPDATE"""
+            # don't wait for other hosts claiming the same task
+            q = """SELECT state,host_id FROM task WHERE id=%(task_id)i FOR UPDATE SKIP LOCKED"""
             r = _fetchSingle(q, locals())
             if not r:
-                raise koji.GenericError("No such task: %i" % task_id)
+                if not _fetchSingle("SELECT id FROM task WHERE id=%(task_id)i", locals()):
+                    raise koji.GenericError("No such task: %i" % task_id)
+                # someone else holds the lock
+                return False
             state, otherhost = r
             if state == koji.TASK_STATES['FREE']:
                 if otherhost is not None:
@@ -228,10 +244,25 @@ class Task(object):
         if state == koji.TASK_STATES['OPEN']:
             update.rawset(start_time='NOW()')
         update.execute()
+        self.notify()
         self.runCallbacks('postTaskStateChange', info, 'state', koji.TASK_STATES[newstate])
         self.runCallbacks('postTaskStateChange', info, 'host_id', host_id)
         return True
 
+    def notify(self):
+        """Send a task event for hosts waiting in waitForTaskEvents
+
+        The message is delivered when the transaction commits.
+        """
+        if not context.opts.get('TaskEvents'):
+            return
+        query = """SELECT pg_notify(%(channel)s, json_build_object(
+            'id', task.id, 'state', task.state, 'host_id', task.host_id,
+            'parent', task.parent, 'parent_host', parent.host_id)::text)
+        FROM task LEFT JOIN task AS parent ON task.parent = parent.id
+        WHERE task.id = %(id)i"""
+        _dml(query, {'channel': TASK_EVENTS_CHANNEL, 'id': self.id})
+
     def assign(self, host_id, force=False):
         """Attempt to assign the task to host.
 
@@ -277,6 +308,7 @@ class Task(object):
         q = """UPDATE task SET state=%(newstate)s,host_id=%(newhost)s
         WHERE id=%(task_id)s"""
         _dml(q, locals())
+        self.notify()
         self.runCallbacks('postTaskStateChange', info, 'state', koji.TASK_STATES['FREE'])
         self.runCallbacks('postTaskStateChange', info, 'host_id', None)
         return True
@@ -327,6 +359,7 @@ class Task(object):
         """
         # get the result from the info dict, so callbacks have a chance to modify it
         _dml(update, {'result': info['result'], 'state': state, 'task_id': task_id})
+        self.notify()
         self.runCallbacks('postTaskStateChange', info, 'state', state)
         self.runCallbacks('postTaskStateChange', info, 'completion_ts', now)
 
@@ -376,6 +409,7 @@ class Task(object):
         update = """UPDATE task SET state = %(st_canceled)i, completion_time = NOW()
         WHERE id = %(task_id)i"""
         _dml(update, locals())
+        self.notify()
         self.runCallbacks('postTaskStateChange', info, 'state', koji.TASK_STATES['CANCELED'])
         self.runCallbacks('postTaskStateChange', info, 'completion_ts', now)
         # cancel associated builds (only if state is 'BUILDING')
@@ -650,6 +684,9 @@ def make_task(method, arglist, **opts):
     insert.execute()
     task_id = _singleValue("SELECT currval('task_id_seq')", strict=True)
     opts['id'] = task_id
+    if opts.get('assign') or opts.get('parent'):
+        # let the host or task watchers know
+        Task(task_id).notify()
     koji.plugin.run_callbacks(
         'postTaskStateChange', attribute='state', old=None, new='FREE', info=opts)
     return task_id
@@ -670,6 +707,130 @@ def eventCondition(event, table=None):
         raise koji.GenericError("Invalid event: %r" % event)
 
 
+class InheritanceCache(object):
+    """Memoize tag inheritance and package list data
+
+    Data read at an explicit event can not change anymore, so it is kept in a
+    bounded LRU shared by all requests handled by this process. Such entries
+    still expire after max_age seconds, because tag and user names are not
+    versioned. Current data (event=None) is only kept for the duration of a
+    request and it is dropped as soon as the request changes any tag in its
+    inheritance chain.
+
+    Values are copied both on the way in and on the way out, so callers are
+    free to modify what they get.
+    """
+
+    def __init__(self, size=64, max_age=3600):
+        self.size = size
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.stats = dict.fromkeys(['event_hits', 'event_misses', 'current_hits',
+                                    'current_misses', 'invalidations'], 0)
+
+    def configure(self, size, max_age):
+        with self.lock:
+            self.size = size
+            self.max_age = max_age
+            while self.entries and len(self.entries) > size:
+                self.entries.popitem(last=False)
+
+    def _request_entries(self):
+        entries = getattr(context, 'inheritance_cache', None)
+        if not isinstance(entries, dict):
+            entries = {}
+            context.inheritance_cache = entries
+        return entries
+
+    def _pinned(self, event):
+        """Is data read at this event immutable?"""
+        # not if this request is making changes at that event
+        return event is not None and event != getattr(context, 'event_id', None)
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def get(self, key, event, copier):
+        """Return a copy of the cached value, or None if not cached"""
+        value = None
+        if self._pinned(event):
+            prefix = 'event'
+            with self.lock:
+                entry = self.entries.pop(key, None)
+                if entry is not None and time.time() - entry[0] < self.max_age:
+                    # keep it as most recently used
+                    self.entries[key] = entry
+                    value = entry[1]
+        else:
+            prefix = 'current'
+            entry = self._request_entries().get(key)
+            if entry is not None:
+                value = entry[1]
+        if value is None:
+            self._count(prefix + '_misses')
+            return None
+        self._count(prefix + '_hits')
+        return copier(value)
+
+    def set(self, key, event, value, tags, copier):
+        """Store a copy of value
+
+        :param tags: ids of all the tags the value depends on
+        """
+        value = copier(value)
+        if self._pinned(event):
+            with self.lock:
+                if self.size < 1:
+                    return
+                self.entries.pop(key, None)
+                self.entries[key] = (time.time(), value)
+                while len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+        else:
+            self._request_entries()[key] = (frozenset(tags), value)
+
+    def invalidate(self, tags):
+        """Drop current data depending on any of the given tags"""
+        entries = self._request_entries()
+        tags = set(tags)
+        for key, (deps, value) in list(entries.items()):
+            if not deps.isdisjoint(tags):
+                del entries[key]
+                self._count('invalidations')
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        self._request_entries().clear()
+
+    def get_stats(self):
+        with self.lock:
+            stats = self.stats.copy()
+            stats['entries'] = len(self.entries)
+            stats['size'] = self.size
+        return stats
+
+
+inheritance_cache = InheritanceCache()
+
+
+def _copy_inheritance(order):
+    return [dict(link, filter=list(link['filter'])) for link in order]
+
+
+def _copy_package_list(packages):
+    ret = {}
+    for pkgid, entry in packages.items():
+        if isinstance(entry, list):
+            # with_dups
+            ret[pkgid] = [p.copy() for p in entry]
+        else:
+            ret[pkgid] = entry.copy()
+    return ret
+
+
 def readInheritanceData(tag_id, event=None):
     c = context.cnx.cursor()
     fields = ('parent_id', 'name', 'priority', 'maxdepth', 'intransitive', 'noconfig',
@@ -753,6 +914,8 @@ def _writeInheritanceData(tag_id, changes, clear=False):
         # nothing to do
         log_error("No inheritance changes")
         return
+    # old and new parents are affected too (reverse inheritance)
+    inheritance_cache.invalidate([tag_id] + list(data))
     # check for duplicate priorities
     pri_index = {}
     for link in data.values():
@@ -789,15 +952,80 @@ def _writeInheritanceData(tag_id, changes, clear=False):
         insert.execute()
 
 
+def readInheritanceGraph(tag_id, event=None, reverse=False):
+    """Read all inheritance links reachable from a tag with a single query
+
+    Returns a dictionary mapping tag ids to the list of their inheritance links,
+    in the same format (and order) as readInheritanceData returns them. If
+    reverse is true, links are followed downwards and the lists have the format
+    of readDescendantsData instead.
+
+    No pruning is done here (maxdepth, intransitive, etc), so the result may
+    contain more links than the full inheritance actually uses.
+    """
+    if reverse:
+        follow, key = 'parent_id', 'tag_id'
+        fields = [('tag_inheritance.tag_id', 'tag_id')]
+    else:
+        follow, key = 'tag_id', 'parent_id'
+        fields = []
+    fields += [('tag_inheritance.parent_id', 'parent_id'), ('tag.name', 'name'),
+               ('tag_inheritance.priority', 'priority'), ('tag_inheritance.maxdepth', 'maxdepth'),
+               ('tag_inheritance.intransitive', 'intransitive'),
+               ('tag_inheritance.noconfig', 'noconfig'),
+               ('tag_inheritance.pkg_filter', 'pkg_filter'),
+               ('tag_inheritance.%s' % follow, 'node_id')]
+    # UNION (rather than UNION ALL) discards already visited tags, so loops terminate
+    q = """WITH RECURSIVE inheritance_nodes(node_id) AS (
+        SELECT %%(tag_id)i
+      UNION
+        SELECT tag_inheritance.%(key)s FROM tag_inheritance
+        JOIN inheritance_nodes ON tag_inheritance.%(follow)s = inheritance_nodes.node_id
+        WHERE %(event_cond)s
+    )
+    SELECT %(columns)s FROM tag_inheritance JOIN tag ON tag_inheritance.%(key)s = tag.id
+    WHERE %(event_cond)s
+        AND tag_inheritance.%(follow)s IN (SELECT node_id FROM inheritance_nodes)
+    ORDER BY tag_inheritance.priority
+    """ % {'key': key,
+           'follow': follow,
+           'columns': ", ".join([f[0] for f in fields]),
+           'event_cond': eventCondition(event, 'tag_inheritance')}
+    graph = {}
+    for link in _multiRow(q, {'tag_id': tag_id}, [f[1] for f in fields]):
+        node_id = link.pop('node_id')
+        if not reverse:
+            # same as readInheritanceData
+            link['child_id'] = node_id
+        graph.setdefault(node_id, []).append(link)
+    return graph
+
+
 def readFullInheritance(tag_id, event=None, reverse=False):
     """Returns a list representing the full, ordered inheritance from tag"""
+    key = ('inheritance', tag_id, event, reverse)
+    order = inheritance_cache.get(key, event, _copy_inheritance)
+    if order is not None:
+        return order
     order = []
-    readFullInheritanceRecurse(tag_id, event, order, {}, {}, 0, None, False, [], reverse)
+    graph = readInheritanceGraph(tag_id, event, reverse)
+    readFullInheritanceRecurse(tag_id, event, order, {}, {}, 0, None, False, [], reverse,
+                               graph=graph)
+    if reverse:
+        tags = [tag_id] + [link['tag_id'] for link in order]
+    else:
+        tags = [tag_id] + [link['parent_id'] for link in order]
+    inheritance_cache.set(key, event, order, tags, _copy_inheritance)
     return order
 
 
 def readFullInheritanceRecurse(tag_id, event, order, top, hist, currdepth, maxdepth, noconfig,
-                               pfilter, reverse):
+                               pfilter, reverse, graph=None):
+    """Walk the inheritance from tag_id, appending the links to order
+
+    If graph (as returned by readInheritanceGraph) is given, links are read
+    from it instead of being queried for each visited tag.
+    """
     if maxdepth is not None and maxdepth < 1:
         return
     # note: maxdepth is relative to where we are, but currdepth is absolute from
@@ -805,7 +1033,10 @@ def readFullInheritanceRecurse(tag_id, event, order, top, hist, currdepth, maxde
     currdepth += 1
     top = top.copy()
     top[tag_id] = 1
-    if reverse:
+    if graph is not None:
+        # the links get annotated below, so each visit needs fresh copies
+        node = [link.copy() for link in graph.get(tag_id, [])]
+    elif reverse:
         node = readDescendantsData(tag_id, event)
     else:
         node = readInheritanceData(tag_id, event)
@@ -881,7 +1112,7 @@ def readFullInheritanceRecurse(tag_id, event, order, top, hist, currdepth, maxde
             # add link, but don't follow it
             continue
         readFullInheritanceRecurse(id, event, order, top, hist, currdepth, nextdepth, noconfig,
-                                   filter, reverse)
+                                   filter, reverse, graph=graph)
 
 # tag-package operations
 #       add
@@ -893,6 +1124,7 @@ def readFullInheritanceRecurse(tag_id, event, order, top, hist, currdepth, maxde
 
 
 def _pkglist_remove(tag_id, pkg_id):
+    inheritance_cache.invalidate([tag_id])
     clauses = ('package_id=%(pkg_id)i', 'tag_id=%(tag_id)i')
     update = UpdateProcessor('tag_packages', values=locals(), clauses=clauses)
     update.make_revoke()  # XXX user_id?
@@ -900,6 +1132,7 @@ def _pkglist_remove(tag_id, pkg_id):
 
 
 def _pkglist_owner_remove(tag_id, pkg_id):
+    inheritance_cache.invalidate([tag_id])
     clauses = ('package_id=%(pkg_id)i', 'tag_id=%(tag_id)i')
     update = UpdateProcessor('tag_package_owners', values=locals(), clauses=clauses)
     update.make_revoke()  # XXX user_id?
@@ -1144,6 +1377,13 @@ def readPackageList(tagID=None, userID=None, pkgID=None, event=None, inherit=Fal
     if userID is not None and not with_owners:
         raise koji.GenericError("userID and with_owners=False can't be used together")
 
+    key = None
+    if tagID is not None and userID is None:
+        key = ('packages', tagID, pkgID, event, inherit, with_dups, with_owners)
+        packages = inheritance_cache.get(key, event, _copy_package_list)
+        if packages is not None:
+            return packages
+
     tables = ['tag_packages']
     fields = [
         ('package.id', 'package_id'),
@@ -1187,9 +1427,12 @@ def readPackageList(tagID=None, userID=None, pkgID=None, event=None, inherit=Fal
             packages[pkgid] = p
 
     if tagID is None or (not inherit):
+        if key:
+            inheritance_cache.set(key, event, packages, [tagID], _copy_package_list)
         return packages
 
     order = readFullInheritance(tagID, event)
+    tags = [tagID] + [link['parent_id'] for link in order]
 
     re_cache = {}
     for link in order:
@@ -1224,9 +1467,12 @@ def readPackageList(tagID=None, userID=None, pkgID=None, event=None, inherit=Fal
                 packages.setdefault(pkgid, []).append(p)
             else:
                 packages[pkgid] = p
+    if key:
+        inheritance_cache.set(key, event, packages, tags, _copy_package_list)
     return packages
 
 
+@readonly
 def list_tags(build=None, package=None, perms=True, queryOpts=None, pattern=None):
     """List tags according to filters
 
@@ -1320,14 +1566,13 @@ def readTaggedBuilds(tag, event=None, inherit=False, latest=False, package=None,
     if not isinstance(latest, NUMERIC_TYPES):
         latest = bool(latest)
 
-    taglist = [tag]
-    if inherit:
-        taglist += [link['parent_id'] for link in readFullInheritance(tag, event)]
-
     # regardless of inherit setting, we need to use inheritance to read the
     # package list
-    packages = readPackageList(tagID=tag, event=event, inherit=True, pkgID=package,
-                               with_owners=False)
+    order = readFullInheritance(tag, event)
+    pkg_taglist = [tag] + [link['parent_id'] for link in order]
+    taglist = [tag]
+    if inherit:
+        taglist = pkg_taglist
 
     st_complete = koji.BUILD_STATES['COMPLETE']
     tables = ['tag_listing']
@@ -1376,13 +1621,24 @@ def readTaggedBuilds(tag, event=None, inherit=False, latest=False, package=None,
 
     clauses = [
         eventCondition(event, 'tag_listing'),
-        'tag_id = %(tagid)s',
         'build.state = %(st_complete)i'
     ]
     if package:
         clauses.append('package.name = %(package)s')
     if owner:
         clauses.append('users.name = %(owner)s')
+
+    if not [link for link in order if link['filter']]:
+        # let the database walk the inheritance, apply the package list and pick the
+        # latest builds, so that only the resulting builds are returned
+        return _readTaggedBuildsQuery(taglist, pkg_taglist, event, latest, fields, tables,
+                                      joins, clauses, locals())
+
+    # package filters are python regexes, which can't be applied in the query,
+    # so handle the package list here and query each tag separately
+    packages = readPackageList(tagID=tag, event=event, inherit=True, pkgID=package,
+                               with_owners=False)
+    clauses.append('tag_id = %(tagid)s')
     queryOpts = {'order': '-create_event'}  # latest first
     query = QueryProcessor(columns=[x[0] for x in fields], aliases=[x[1] for x in fields],
                            tables=tables, joins=joins, clauses=clauses, values=locals(),
@@ -1413,6 +1669,62 @@ def readTaggedBuilds(tag, event=None, inherit=False, latest=False, package=None,
     return builds
 
 
+def _readTaggedBuildsQuery(taglist, pkg_taglist, event, latest, fields, tables, joins, clauses,
+                           values):
+    """Select the tagged builds for readTaggedBuilds with a single query
+
+    Equivalent to the per tag loop in readTaggedBuilds: builds come in
+    inheritance order (latest first within each tag), the package list (read
+    through pkg_taglist) must list the package unblocked, and if latest is set
+    only the first N builds of each package are kept.
+    """
+    # tag ids come from the database, so they are safe to include directly
+    tag_values = ', '.join(['(%i, %i)' % (tag_id, n) for n, tag_id in enumerate(taglist)])
+    pkg_tag_values = ', '.join(['(%i, %i)' % (tag_id, n)
+                                for n, tag_id in enumerate(pkg_taglist)])
+    fields = fields + [('taglist.inh_order', 'inh_order')]
+    joins = [
+        '(VALUES %s) AS taglist(tag_id, inh_order) ON taglist.tag_id = tag_listing.tag_id'
+        % tag_values,
+    ] + joins + [
+        # first entry for each package in inheritance order, like readPackageList
+        """JOIN (SELECT DISTINCT ON (tag_packages.package_id)
+                   tag_packages.package_id, tag_packages.blocked
+               FROM tag_packages
+               JOIN (VALUES %s) AS pkg_taglist(tag_id, inh_order)
+                   ON pkg_taglist.tag_id = tag_packages.tag_id
+               WHERE %s
+               ORDER BY tag_packages.package_id, pkg_taglist.inh_order
+               ) AS pkglist ON pkglist.package_id = build.pkg_id"""
+        % (pkg_tag_values, eventCondition(event, 'tag_packages')),
+    ]
+    clauses = clauses + ['NOT pkglist.blocked']
+    if not latest:
+        query = QueryProcessor(columns=[x[0] for x in fields], aliases=[x[1] for x in fields],
+                               tables=tables, joins=joins, clauses=clauses, values=values,
+                               opts={'order': 'inh_order,-create_event'})
+        builds = query.execute()
+    else:
+        fields.append(('row_number() OVER (PARTITION BY build.pkg_id '
+                       'ORDER BY taglist.inh_order, tag_listing.create_event DESC)',
+                       'latest_rank'))
+        # the outer query refers to the columns by their aliases
+        query = QueryProcessor(columns=['%s AS %s' % x for x in fields],
+                               aliases=[x[1] for x in fields],
+                               tables=tables, joins=joins, clauses=clauses, values=values)
+        # the ranking has to be done before it can be filtered on
+        q = """SELECT * FROM (%s) AS ranked
+        WHERE latest_rank <= %%(latest_n)i
+        ORDER BY inh_order, create_event DESC
+        """ % query
+        values = dict(values, latest_n=int(latest))
+        builds = _multiRow(q, values, query.aliases)
+    for build in builds:
+        del build['inh_order']
+        build.pop('latest_rank', None)
+    return builds
+
+
 def readTaggedRPMS(tag, package=None, arch=None, event=None, inherit=False, latest=True,
                    rpmsigs=False, owner=None, type=None):
     """Returns a list of rpms and builds for specified tag
@@ -1438,8 +1750,6 @@ def readTaggedRPMS(tag, package=None, arch=None, event=None, inherit=False, late
     """
     taglist = [tag]
     if inherit:
-        # XXX really should cache this - it gets called several places
-        #   (however, it is fairly quick)
         taglist += [link['parent_id'] for link in readFullInheritance(tag, event)]
 
     builds = readTaggedBuilds(tag, event=event, inherit=inherit, latest=latest, package=package,
@@ -1533,8 +1843,6 @@ def readTaggedArchives(tag, package=None, event=None, inherit=False, latest=True
     """
     taglist = [tag]
     if inherit:
-        # XXX really should cache this - it gets called several places
-        #   (however, it is fairly quick)
         taglist += [link['parent_id'] for link in readFullInheritance(tag, event)]
 
     # If type == 'maven', we require that both the build *and* the archive have Maven metadata
@@ -2473,12 +2781,19 @@ def get_ready_hosts():
     # XXX - magic number in query
     c.execute(q)
     hosts = [dict(zip(aliases, row)) for row in c.fetchall()]
+    if not hosts:
+        return hosts
+    # channels of all the hosts in one query
+    channels = {}
+    q = """SELECT host_id, channel_id FROM host_channels
+        JOIN channels ON host_channels.channel_id = channels.id
+        WHERE host_id IN %(host_ids)s AND active IS TRUE AND enabled IS TRUE
+        ORDER BY host_id, channel_id"""
+    c.execute(q, {'host_ids': [host['id'] for host in hosts]})
+    for host_id, channel_id in c.fetchall():
+        channels.setdefault(host_id, []).append(channel_id)
     for host in hosts:
-        q = """SELECT channel_id FROM host_channels
-            JOIN channels ON host_channels.channel_id = channels.id
-            WHERE host_id=%(id)s AND active IS TRUE AND enabled IS TRUE"""
-        c.execute(q, host)
-        host['channels'] = [row[0] for row in c.fetchall()]
+        host['channels'] = channels.get(host['id'], [])
     return hosts
 
 
@@ -2495,8 +2810,12 @@ def get_all_arches():
     return list(ret.keys())
 
 
-def get_active_tasks(host=None):
-    """Return data on tasks that are yet to be run"""
+def get_active_tasks(host=None, assigned_only=False):
+    """Return data on tasks that are yet to be run
+
+    If host is given, only tasks that host could take are returned, with
+    assigned_only just the tasks assigned to it.
+    """
     fields = ['id', 'state', 'channel_id', 'host_id', 'arch', 'method', 'priority', 'create_time']
     values = dslice(koji.TASK_STATES, ('FREE', 'ASSIGNED'))
     if host:
@@ -2504,7 +2823,7 @@ def get_active_tasks(host=None):
         values['channels'] = host['channels']
         values['host_id'] = host['id']
         clause = '(state = %(ASSIGNED)i AND host_id = %(host_id)i)'
-        if values['channels']:
+        if values['channels'] and not assigned_only:
             clause += ''' OR (state = %(FREE)i AND arch IN %(arches)s \
 AND channel_id IN %(channels)s)'''
         clauses = [clause]
@@ -2516,6 +2835,174 @@ AND channel_id IN %(channels)s)'''
     return query.execute()
 
 
+# per process time of the last scheduler pass
+_schedule_ts = [0]
+
+
+def maybe_schedule_tasks():
+    """Run a scheduler pass unless this process ran one recently"""
+    now = time.time()
+    if now - _schedule_ts[0] >= context.opts['TaskSchedulerInterval']:
+        _schedule_ts[0] = now
+        schedule_tasks()
+
+
+def schedule_tasks():
+    """Assign free tasks to the ready hosts
+
+    Used instead of letting the builders compete for tasks when the
+    TaskScheduler option is on. Only one hub process at a time runs a pass,
+    others return right away.
+
+    Tasks assigned to hosts which are disabled or did not check in for five
+    minutes are freed again.
+
+    :returns: list of the (task_id, host_id) assignments made
+    """
+    # released at the end of the transaction
+    if not _singleValue("SELECT pg_try_advisory_xact_lock(%(key)i)", {'key': SCHEDULER_LOCK}):
+        return []
+    values = dslice(koji.TASK_STATES, ('FREE', 'ASSIGNED'))
+    query = """SELECT task.id FROM task
+    WHERE state = %(ASSIGNED)i AND host_id NOT IN (
+        SELECT host.id FROM host
+            JOIN sessions USING (user_id)
+            JOIN host_config ON host.id = host_config.host_id
+        WHERE enabled = TRUE AND expired = FALSE AND master IS NULL
+            AND update_time > NOW() - '5 minutes'::interval
+            AND active IS TRUE)
+    ORDER BY task.id"""
+    for (task_id,) in _fetchMulti(query, values):
+        logger.info("Freeing task %i assigned to an unavailable host", task_id)
+        Task(task_id).free()
+
+    hosts = get_ready_hosts()
+    if not hosts:
+        return []
+    # tasks assigned, but not opened yet, also count
+    query = """SELECT host_id, SUM(weight) FROM task WHERE state = %(ASSIGNED)i
+    GROUP BY host_id"""
+    pending = dict(_fetchMulti(query, values))
+    for host in hosts:
+        host['task_load'] += pending.get(host['id'], 0.0)
+    query = QueryProcessor(columns=['id', 'channel_id', 'arch', 'weight', 'priority',
+                                    'create_time'],
+                           tables=['task'], clauses=['state = %(FREE)i'], values=values,
+                           opts={'order': 'priority,create_time,id',
+                                 'limit': context.opts['TaskSchedulerBatch']})
+    ret = []
+    for task_id, host_id in koji.scheduler.assign_tasks(hosts, query.execute()):
+        if Task(task_id).assign(host_id):
+            ret.append((task_id, host_id))
+    return ret
+
+
+def wait_for_task_events(host_id, timeout):
+    """Wait for changes of tasks that are relevant to a host
+
+    These are changes of the host's own tasks (except for opening them) and
+    subtasks of its tasks being finished. Changes before the call are not
+    reported, the caller is expected to check the current state first.
+
+    :param int host_id: the host
+    :param float timeout: how long to wait (seconds)
+    :returns: list of task events (id, state, host_id, parent, parent_host),
+              empty if nothing happened
+    """
+    if not context.opts.get('TaskEvents'):
+        raise koji.ActionNotAllowed('Task events are not enabled on this hub')
+    timeout = min(float(timeout), context.opts['TaskEventsMaxWait'])
+    _task_listener.start()
+    position = _task_listener.position()
+    finished = [koji.TASK_STATES[s] for s in ('CLOSED', 'CANCELED', 'FAILED')]
+
+    def match(payload):
+        event = json.loads(payload)
+        if event['host_id'] == host_id:
+            return event['state'] != koji.TASK_STATES['OPEN']
+        return event['parent_host'] == host_id and event['state'] in finished
+    events = _wait_disconnected(_task_listener.wait, position, timeout, match)
+    return [json.loads(payload) for payload in events if payload is not None]
+
+
+def _wait_disconnected(wait, *args):
+    """Call wait with the database connection closed meanwhile
+
+    The transaction is committed first. Otherwise a long poll would keep the
+    connection, which may be one of the pool, from other requests. A new one
+    is opened for the rest of the request once the wait is over.
+    """
+    context.cnx.commit()
+    context.commit_pending = False
+    context.cnx.close()
+    try:
+        return wait(*args)
+    finally:
+        context.cnx = koji.db.connect()
+
+
+def _get_watched_tasks(task_ids, request=False):
+    """Return info of the given tasks and their children, and a state token
+
+    The token changes whenever one of the tasks changes state or gets a new
+    child. Requests are only included for tasks not in task_ids, unless
+    request is True.
+    """
+    columns = [f[0] for f in Task.fields]
+    aliases = [f[1] for f in Task.fields]
+    query = QueryProcessor(columns=columns, aliases=aliases, tables=['task'],
+                           clauses=['id IN %(task_ids)s OR parent IN %(task_ids)s'],
+                           values={'task_ids': task_ids}, opts={'order': 'id'})
+    tasks = query.execute()
+    known = set(task_ids)
+    new_ids = [task['id'] for task in tasks if request or task['id'] not in known]
+    if new_ids:
+        query = QueryProcessor(columns=['id', 'request'], tables=['task'],
+                               clauses=['id IN %(new_ids)s'], values={'new_ids': new_ids})
+        requests = {}
+        for row in query.execute():
+            xml_request = row['request']
+            if xml_request.find('<?xml', 0, 10) == -1:
+                # handle older base64 encoded data
+                xml_request = base64.b64decode(xml_request)
+            requests[row['id']] = xmlrpc.client.loads(xml_request)[0]
+        for task in tasks:
+            if task['id'] in requests:
+                task['request'] = requests[task['id']]
+    states = [[task['id'], task['state']] for task in tasks]
+    token = hashlib.sha256(json.dumps(states).encode()).hexdigest()
+    return tasks, token
+
+
+def watch_tasks(task_ids, since=None, timeout=60):
+    """Wait for changes in task trees
+
+    :param list task_ids: ids of the watched tasks
+    :param str since: token returned by the previous call, None to return
+                      the current state right away
+    :param float timeout: how long to wait (seconds)
+    :returns: dict with the token and info of the tasks and their children
+    """
+    if not context.opts.get('TaskEvents'):
+        raise koji.ActionNotAllowed('Task events are not enabled on this hub')
+    task_ids = [int(task_id) for task_id in task_ids]
+    if not task_ids:
+        raise koji.ParameterError('No tasks to watch')
+    timeout = min(float(timeout), context.opts['TaskEventsMaxWait'])
+    _task_listener.start()
+    position = _task_listener.position()
+    tasks, token = _get_watched_tasks(task_ids, request=since is None)
+    if token == since and timeout > 0:
+        known = set(task_ids)
+
+        def match(payload):
+            event = json.loads(payload)
+            return event['id'] in known or event['parent'] in known
+        if _wait_disconnected(_task_listener.wait, position, timeout, match):
+            tasks, token = _get_watched_tasks(task_ids)
+    return {'token': token, 'tasks': tasks}
+
+
 def get_task_descendents(task, childMap=None, request=False):
     if childMap is None:
         childMap = {}
@@ -2997,6 +3484,20 @@ def get_active_repos():
     return query.execute()
 
 
+# versioned tables holding tag data, see tag_changed_since_event()
+TAG_VERSIONED_TABLES = (
+    'tag_listing',
+    'tag_inheritance',
+    'tag_config',
+    'tag_extra',
+    'tag_packages',
+    'tag_external_repos',
+    'group_package_listing',
+    'group_req_listing',
+    'group_config',
+)
+
+
 def tag_changed_since_event(event, taglist):
     """Report whether any changes since event affect any of the tags in list
 
@@ -3017,20 +3518,9 @@ def tag_changed_since_event(event, taglist):
     if query.execute():
         return True
     # also check these versioned tables
-    tables = (
-        'tag_listing',
-        'tag_inheritance',
-        'tag_config',
-        'tag_extra',
-        'tag_packages',
-        'tag_external_repos',
-        'group_package_listing',
-        'group_req_listing',
-        'group_config',
-    )
     clauses = ['create_event > %(event)i OR revoke_event > %(event)i',
                'tag_id IN %(taglist)s']
-    for table in tables:
+    for table in TAG_VERSIONED_TABLES:
         query = QueryProcessor(tables=[table], columns=['tag_id'], clauses=clauses,
                                values=data, opts={'limit': 1})
         if query.execute():
@@ -3038,6 +3528,46 @@ def tag_changed_since_event(event, taglist):
     return False
 
 
+def tags_changed_since_events(checks):
+    """Report which of many taglists changed since their event
+
+    This is the batch version of tag_changed_since_event(), used by the repo
+    daemon to check all of its repos at once. The last change of each tag is
+    found with a single query, no matter how many checks are given.
+
+    :param list checks: list of (key, event, taglist) items, where key is
+                        any value identifying the check (e.g. a repo id)
+    :returns: list of the keys of the checks with changes
+    """
+    if not checks:
+        return []
+    tags = set()
+    for key, event, taglist in checks:
+        if not isinstance(event, int):
+            raise koji.ParameterError("Invalid event: %r" % event)
+        tags.update(taglist)
+    if not tags:
+        return []
+    min_event = min([check[1] for check in checks])
+    parts = ["""SELECT tag_id, update_event AS event FROM tag_updates
+    WHERE update_event > %(event)i AND tag_id IN %(tags)s"""]
+    for table in TAG_VERSIONED_TABLES:
+        parts.append("""SELECT tag_id, GREATEST(create_event, revoke_event) FROM %s
+    WHERE (create_event > %%(event)i OR revoke_event > %%(event)i)
+    AND tag_id IN %%(tags)s""" % table)
+    query = """SELECT tag_id, MAX(event) FROM (
+    %s
+    ) AS changes GROUP BY tag_id""" % '\n    UNION ALL\n    '.join(parts)
+    last_change = dict(_fetchMulti(query, {'event': min_event, 'tags': list(tags)}))
+    ret = []
+    for key, event, taglist in checks:
+        for tag_id in taglist:
+            if last_change.get(tag_id, event) > event:
+                ret.append(key)
+                break
+    return ret
+
+
 def set_tag_update(tag_id, utype, event_id=None, user_id=None):
     """Record a non-versioned tag update"""
     utype_id = koji.TAG_UPDATE_TYPES.getnum(utype)
@@ -3052,6 +3582,7 @@ def set_tag_update(tag_id, utype, event_id=None, user_id=None):
             'updater_id': user_id}
     insert = InsertProcessor('tag_updates', data=data)
     insert.execute()
+    inheritance_cache.invalidate([tag_id])
 
 
 def _validate_build_target_name(name):
@@ -3396,6 +3927,7 @@ def _create_tag(name, parent=None, arches=None, perm=None, locked=False, maven_s
     return tag_id
 
 
+@readonly
 def get_tag(tagInfo, strict=False, event=None, blocked=False):
     """Get tag information based on the tagInfo.  tagInfo may be either
     a string (the tag name) or an int (the tag ID).
@@ -3564,6 +4096,8 @@ def _edit_tag(tagInfo, **kwargs):
 SET name = %(name)s
 WHERE id = %(tagID)i"""
         _dml(update, values)
+        # cached entries carry the tag name, even for past events
+        inheritance_cache.clear()
 
     # sanitize architecture names (space-separated string)
     arches = kwargs.get('arches')
@@ -3678,6 +4212,7 @@ def _delete_tag(tagInfo):
 
     tag = get_tag(tagInfo, strict=True)
     tagID = tag['id']
+    inheritance_cache.invalidate([tagID])
 
     _tagDelete('tag_config', tagID)
     # technically, to 'delete' the tag we only have to revoke the tag_config entry
@@ -4021,6 +4556,7 @@ def get_external_repo_list(tag_info, event=None):
     return repos
 
 
+@readonly
 def get_user(userInfo=None, strict=False, krb_princs=True):
     """Return information about a user.
 
@@ -4257,6 +4793,7 @@ def find_build_id(X, strict=False):
     return r[0]
 
 
+@readonly
 def get_build(buildInfo, strict=False):
     """Return information about a build.
 
@@ -4448,6 +4985,7 @@ def _fix_rpm_row(row):
 _fix_archive_row = _fix_rpm_row
 
 
+@readonly
 def get_rpm(rpminfo, strict=False, multi=False):
     """Get information about the specified RPM
 
@@ -4548,6 +5086,7 @@ def get_rpm(rpminfo, strict=False, multi=False):
     return ret
 
 
+@readonly
 def list_rpms(buildID=None, buildrootID=None, imageID=None, componentBuildrootID=None, hostID=None,
               arches=None, queryOpts=None):
     """List RPMS.  If buildID, imageID and/or buildrootID are specified,
@@ -4627,8 +5166,7 @@ def list_rpms(buildID=None, buildrootID=None, imageID=None, componentBuildrootID
     query = QueryProcessor(columns=fields, aliases=aliases,
                            tables=['rpminfo'], joins=joins, clauses=clauses,
                            values=locals(), transform=_fix_rpm_row, opts=queryOpts)
-    data = query.execute()
-    return data
+    return query.iterate()
 
 
 def get_maven_build(buildInfo, strict=False):
@@ -4742,6 +5280,7 @@ def get_build_type(buildInfo, strict=False):
     return ret
 
 
+@readonly
 def list_btypes(query=None, queryOpts=None):
     """List btypes matching query
 
@@ -5283,6 +5822,38 @@ def list_task_output(taskID, stat=False, all_volumes=False, strict=False):
     return result
 
 
+def get_task_output_path(taskID, fileName, volume=None):
+    """Return the path of a file generated by the task with the given ID
+
+    Raises GenericError for invalid file names. The file may not exist.
+    """
+    if '..' in fileName:
+        raise koji.GenericError('Invalid file name: %s' % fileName)
+    filePath = '%s/%s/%s' % (koji.pathinfo.work(volume),
+                             koji.pathinfo.taskrelpath(taskID),
+                             fileName)
+    return os.path.normpath(filePath)
+
+
+def open_task_output(environ):
+    """Open a task output file for a download request
+
+    The file is named by the taskID, filename and (optional) volume fields
+    of the query string.
+    """
+    args = parse_qs(environ.get('QUERY_STRING', ''), strict_parsing=True)
+    try:
+        taskID = int(args['taskID'][0])
+        fileName = args['filename'][0]
+    except (KeyError, ValueError):
+        raise koji.ParameterError('taskID and filename are required')
+    volume = args.get('volume', (None,))[0]
+    filePath = get_task_output_path(taskID, fileName, volume)
+    if not os.path.isfile(filePath):
+        raise koji.GenericError('no file "%s" output by task %i' % (fileName, taskID))
+    return open(filePath, 'rb')
+
+
 def _fetchMulti(query, values):
     """Run the query and return all rows"""
     c = context.cnx.cursor()
@@ -5363,6 +5934,7 @@ def _dml(operation, values):
     return ret
 
 
+@readonly
 def get_host(hostInfo, strict=False, event=None):
     """Get information about the given host.  hostInfo may be
     either a string (hostname) or int (host id).  A map will be returned
@@ -6966,23 +7538,111 @@ class CG_Importer(object):
             insert.execute()
 
 
-def add_external_rpm(rpminfo, external_repo, strict=True):
-    """Add an external rpm entry to the rpminfo table
+def get_rpm_ids(rpmlist):
+    """Look up the ids of many rpms at once, adding missing external rpms
 
-    Differences from import_rpm:
-        - entry will have non-zero external_repo_id
-        - entry will not reference a build
-        - rpm not available to us -- the necessary data is passed in
-
-    The rpminfo arg should contain the following fields:
-        - name, version, release, epoch, arch, payloadhash, size, buildtime
+    This gives the same results as calling get_rpm(rpminfo, strict=True) for
+    each internal rpm and add_external_rpm(rpminfo, location, strict=False)
+    for each rpm with a location, but with a constant number of queries.
 
-    Returns info as get_rpm
+    :param list rpmlist: rpm info maps (name, version, release, arch, ...),
+                         external rpms also need location and the fields
+                         required by add_external_rpm
+    :returns: list of rpm ids in the order of rpmlist
     """
+    nvra_fields = ('name', 'version', 'release', 'arch')
+    # resolve requested rpms to (nvra, external repo id or None)
+    keys = []
+    repo_ids = {}
+    for an_rpm in rpmlist:
+        location = an_rpm.get('location')
+        if location:
+            an_rpm = _check_external_rpminfo(an_rpm)
+            if location not in repo_ids:
+                repo_ids[location] = get_external_repo_id(location, strict=True)
+            repo_id = repo_ids[location]
+        elif 'id' in an_rpm or [f for f in nvra_fields if f not in an_rpm]:
+            # not something we can look up by nvra
+            keys.append(None)
+            continue
+        else:
+            repo_id = None
+        keys.append((tuple([an_rpm[f] for f in nvra_fields]), repo_id))
 
-    # [!] Calling function should perform access checks
+    # one query for all the nvras
+    found = {}
+    nvras = sorted(set([key[0] for key in keys if key]))
+    if nvras:
+        values = {}
+        rows = []
+        for i, nvra in enumerate(nvras):
+            rows.append('(%%(name%i)s, %%(version%i)s, %%(release%i)s, %%(arch%i)s)'
+                        % (i, i, i, i))
+            for field, value in zip(nvra_fields, nvra):
+                values['%s%i' % (field, i)] = value
+        clauses = ['(rpminfo.name, version, release, arch) IN (VALUES %s)' % ', '.join(rows)]
+        fields = ['id', 'name', 'version', 'release', 'arch', 'external_repo_id',
+                  'payloadhash']
+        query = QueryProcessor(columns=['rpminfo.%s' % f for f in fields], aliases=fields,
+                               tables=['rpminfo'], clauses=clauses, values=values,
+                               opts={'order': 'id'})
+        for row in query.execute():
+            nvra = tuple([row[f] for f in nvra_fields])
+            found.setdefault(nvra, {}).setdefault(row['external_repo_id'], row)
 
-    # sanity check rpminfo
+    ret = []
+    missing = {}
+    for an_rpm, key in zip(rpmlist, keys):
+        if key is None:
+            ret.append(get_rpm(an_rpm, strict=True)['id'])
+            continue
+        nvra, repo_id = key
+        matches = found.get(nvra, {})
+        if repo_id is None:
+            # internal rpms first, otherwise the first matching external one
+            if not matches:
+                raise koji.GenericError("No such rpm: %r" % an_rpm)
+            ret.append(matches.get(0, min(matches.values(), key=lambda r: r['id']))['id'])
+            continue
+        previous = matches.get(repo_id) or missing.get(key)
+        if previous:
+            if an_rpm['payloadhash'] != previous['payloadhash']:
+                disp = "%s-%s-%s.%s@%s" % (nvra + (an_rpm['location'],))
+                raise koji.GenericError("hash changed for external rpm: %s (%s -> %s)"
+                                        % (disp, previous['payloadhash'], an_rpm['payloadhash']))
+            ret.append(key in missing and key or previous['id'])
+        else:
+            data = _check_external_rpminfo(an_rpm)
+            data['external_repo_id'] = repo_id
+            data['build_id'] = None
+            data['buildroot_id'] = None
+            data['location'] = an_rpm['location']
+            missing[key] = data
+            ret.append(key)
+
+    if missing:
+        # add the missing external rpms in bulk
+        new = list(missing.values())
+        query = """SELECT nextval('rpminfo_id_seq') FROM generate_series(1, %(count)i)"""
+        for data, row in zip(new, _fetchMulti(query, {'count': len(new)})):
+            data['id'] = row[0]
+        insert = BulkInsertProcessor('rpminfo')
+        for data in new:
+            insert.add_record(**dslice_ex(data, ['location']))
+        savepoint = Savepoint('pre_bulk_insert')
+        try:
+            insert.execute()
+        except Exception:
+            # likely added concurrently, fall back to adding them one by one
+            savepoint.rollback()
+            for data in new:
+                data['id'] = add_external_rpm(data, data['location'], strict=False)['id']
+        ret = [missing[r]['id'] if isinstance(r, tuple) else r for r in ret]
+    return ret
+
+
+def _check_external_rpminfo(rpminfo):
+    """Sanity check the data of an external rpm and strip extra fields"""
     dtypes = (
         ('name', str),
         ('version', str),
@@ -6999,8 +7659,27 @@ def add_external_rpm(rpminfo, external_repo, strict=True):
             # this will catch unwanted NULLs
             raise koji.GenericError("Invalid value for %s: %r" % (field, rpminfo[field]))
     # strip extra fields
-    rpminfo = dslice(rpminfo, [x[0] for x in dtypes])
     # TODO: more sanity checks for payloadhash
+    return dslice(rpminfo, [x[0] for x in dtypes])
+
+
+def add_external_rpm(rpminfo, external_repo, strict=True):
+    """Add an external rpm entry to the rpminfo table
+
+    Differences from import_rpm:
+        - entry will have non-zero external_repo_id
+        - entry will not reference a build
+        - rpm not available to us -- the necessary data is passed in
+
+    The rpminfo arg should contain the following fields:
+        - name, version, release, epoch, arch, payloadhash, size, buildtime
+
+    Returns info as get_rpm
+    """
+
+    # [!] Calling function should perform access checks
+
+    rpminfo = _check_external_rpminfo(rpminfo)
 
     def check_dup():
         # Check to see if we have it
@@ -9238,7 +9917,8 @@ class QueryProcessor(object):
         limit: an integer to use in the 'LIMIT' clause
         asList: if True, return results as a list of lists, where each list contains the
                 column values in query order, rather than the usual list of maps
-        rowlock: if True, use "FOR UPDATE" to lock the queried rows
+        rowlock: if True, use "FOR UPDATE" to lock the queried rows, if 'skip', also
+                 skip rows locked by others ("FOR UPDATE SKIP LOCKED")
         group: a column or alias name to use in the 'GROUP BY' clause
                (controlled by enable_group)
     - enable_group: if True, opts.group will be enabled
@@ -9333,6 +10013,8 @@ SELECT %(col_str)s
             query = 'SELECT count(*)\nFROM (' + query + ') numrows'
         if self.opts.get('rowlock'):
             query += '\n FOR UPDATE'
+            if self.opts['rowlock'] == 'skip':
+                query += ' SKIP LOCKED'
         return query
 
     def __repr__(self):
@@ -9443,31 +10125,38 @@ SELECT %(col_str)s
             cname = "qp_cursor_%s_%i_%i" % (id(self), os.getpid(), self.cursors)
             self.cursors += 1
             logger.debug('Setting up query iterator. cname=%r', cname)
-            return self._iterate(cname, str(self), self.values.copy(), fields,
-                                 self.iterchunksize, self.opts.get('asList'))
+            # The cursor is declared now rather than on the first read, so the
+            # rows come from the connection and snapshot of the call, even if
+            # they are only read while the response is sent.
+            cnx = context.cnx
+            c = cnx.cursor()
+            c.execute("DECLARE %s NO SCROLL CURSOR FOR %s" % (cname, str(self)),
+                      self.values.copy())
+            c.close()
+            return self._iterate(cnx, cname, fields, self.iterchunksize,
+                                 self.opts.get('asList'))
 
-    def _iterate(self, cname, query, values, fields, chunksize, as_list=False):
+    def _iterate(self, cnx, cname, fields, chunksize, as_list=False):
         # We pass all this data into the generator so that the iterator works
         # from the snapshot when it was generated. Otherwise reuse of the processor
         # for similar queries could have unpredictable results.
-        query = "DECLARE %s NO SCROLL CURSOR FOR %s" % (cname, query)
-        c = context.cnx.cursor()
-        c.execute(query, values)
-        c.close()
         try:
             query = "FETCH %i FROM %s" % (chunksize, cname)
             while True:
+                c = cnx.cursor()
+                c.execute(query, {})
+                rows = c.fetchall()
+                c.close()
                 if as_list:
                     if self.transform is None:
-                        buf = _fetchMulti(query, {})
+                        buf = rows
                     else:
                         # if we're transforming, generate the dicts so the transform can modify
-                        buf = _multiRow(query, self.values, fields)
-                        buf = [self.transform(row) for row in buf]
+                        buf = [self.transform(dict(zip(fields, row))) for row in rows]
                         # and then convert back to lists
                         buf = [[row[f] for f in fields] for row in buf]
                 else:
-                    buf = _multiRow(query, {}, fields)
+                    buf = [dict(zip(fields, row)) for row in rows]
                     if self.transform is not None:
                         buf = [self.transform(row) for row in buf]
                 if not buf:
@@ -9475,7 +10164,7 @@ SELECT %(col_str)s
                 for row in buf:
                     yield row
         finally:
-            c = context.cnx.cursor()
+            c = cnx.cursor()
             c.execute("CLOSE %s" % cname)
             c.close()
 
@@ -10485,7 +11174,8 @@ class RootExports(object):
             opts = {}
 
         build = self.getBuild(build, strict=True)
-        if list_rpms(build['id']) and not (opts.get('scratch') or opts.get('create_build')):
+        if list_rpms(build['id'], queryOpts={'limit': 1}) and \
+                not (opts.get('scratch') or opts.get('create_build')):
             raise koji.PreBuildError('wrapper rpms for %s have already been built' %
                                      koji.buildLabel(build))
         build_target = self.getBuildTarget(target)
@@ -10696,6 +11386,30 @@ class RootExports(object):
                 WHERE id = %(id)i"""
         return _singleRow(q, values, fields, strict=True)
 
+    def getInheritanceCacheStats(self):
+        """Return the inheritance cache statistics of the serving hub process
+
+        The counters (hits, misses and invalidations) are kept separately by
+        each hub process, so consecutive calls may be served by different
+        processes.
+
+        :returns: dict with the counters, the number of entries and the size
+                  of the cache for data read at explicit events
+        """
+        return inheritance_cache.get_stats()
+
+    def getDBPoolStats(self):
+        """Return the database connection pool statistics of the serving hub process
+
+        Counters are kept separately by each hub process, so consecutive calls
+        may be served by different processes.
+
+        :returns: dict with the counters (checkouts, waits, timeouts, created,
+                  closed, failed_checks), the number of idle and busy connections
+                  and the pool size limits, or None if the pool is not enabled
+        """
+        return koji.db.getPoolStats()
+
     def getLastEvent(self, before=None):
         """
         Get the id and timestamp of the last event recorded in the system.
@@ -10793,6 +11507,7 @@ class RootExports(object):
                     # but we allow .log files to be uploaded multiple times to support
                     # realtime log-file viewing
                     raise koji.GenericError("file already exists: %s" % fn)
+        unshare_upload(fn, copy=offset != 0)
         fd = os.open(fn, os.O_RDWR | os.O_CREAT, 0o666)
         # log_error("fd=%r" %fd)
         try:
@@ -10881,15 +11596,130 @@ class RootExports(object):
             # this will also free our lock
             os.close(fd)
 
+    def checkUploadBlocks(self, path, name, blocksize, verify='sha256', volume=None):
+        """Return the checksums of the blocks of an uploaded file
+
+        Clients use this to resume an interrupted upload, only the blocks
+        that are missing or differ have to be sent again.
+
+        :param str path: upload directory
+        :param str name: file name
+        :param int blocksize: size of the blocks, at least 64 KiB
+        :param str verify: checksum type (md5, adler32 or sha256)
+        :param str volume: volume of the upload
+        :returns: None if the file does not exist, otherwise a dict with the
+                  size, mtime, blocksize and verify of the file and a list
+                  of hexdigests of its blocks (the last one may be short)
+        """
+        if not isinstance(blocksize, int) or blocksize < 65536:
+            raise koji.GenericError("Invalid blocksize: %r" % blocksize)
+        chksum_class = get_verify_class(verify)
+        if chksum_class is None:
+            raise koji.GenericError("Invalid verify type: %r" % verify)
+        fn = get_upload_path(path, name, volume=volume)
+        try:
+            fd = os.open(fn, os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+        try:
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except IOError as e:
+                raise koji.LockError(e)
+            st = os.fstat(fd)
+            if not stat.S_ISREG(st.st_mode):
+                raise koji.GenericError("Not a regular file: %s" % fn)
+            blocks = []
+            while True:
+                chksum = chksum_class()
+                length = 0
+                while length < blocksize:
+                    chunk = os.read(fd, min(blocksize - length, 65536))
+                    if not chunk:
+                        break
+                    length += len(chunk)
+                    chksum.update(chunk)
+                if not length:
+                    break
+                blocks.append(chksum.hexdigest())
+                if length < blocksize:
+                    break
+            return {
+                'size': st.st_size,
+                'mtime': st.st_mtime,
+                'blocksize': blocksize,
+                'verify': verify,
+                'blocks': blocks,
+            }
+        finally:
+            # this will also free our lock
+            os.close(fd)
+
+    def linkUpload(self, path, name, size, sha256, overwrite=False, volume=None):
+        """Provide an upload from content the hub already has
+
+        Clients can call this before uploading a file. If the hub has stored
+        content with this size and sha256 on the volume (see storeUpload),
+        it is linked into place and the file does not have to be sent.
+
+        :param str path: upload directory
+        :param str name: file name
+        :param int size: size of the file
+        :param str sha256: sha256 hexdigest of the file
+        :param bool overwrite: replace an existing upload
+        :param str volume: volume of the upload
+        :returns: True if the file is in place, False if it has to be uploaded
+        """
+        context.session.assertLogin()
+        if not context.opts.get('UploadDedup'):
+            return False
+        size = koji.decode_int(size)
+        fn = get_upload_path(path, name, create=True, volume=volume)
+        if os.path.lexists(fn):
+            if not os.path.isfile(fn):
+                raise koji.GenericError("destination not a file: %s" % fn)
+            if not overwrite:
+                raise koji.GenericError("upload path exists: %s" % fn)
+        return upload_store.link(fn, size, sha256, volume=volume)
+
+    def storeUpload(self, path, name, sha256, volume=None):
+        """Keep a completed upload for linkUpload
+
+        The hub checks the sha256 of the uploaded file itself.
+
+        :param str path: upload directory
+        :param str name: file name
+        :param str sha256: sha256 hexdigest of the file
+        :param str volume: volume of the upload
+        :returns: True if the upload was stored, False if the hub does not
+                  store uploads
+        """
+        context.session.assertLogin()
+        if not context.opts.get('UploadDedup'):
+            return False
+        # only the uploader's own files
+        fn = get_upload_path(path, name, volume=volume, verify=True)
+        upload_store.store(fn, sha256, volume=volume)
+        return True
+
+    def getUploadStoreStats(self):
+        """Return the upload store statistics of the serving hub process
+
+        Counters are kept separately by each hub process, so consecutive calls
+        may be served by different processes.
+
+        :returns: dict with the counters (links, misses, stored and
+                  bytes_avoided, the size of the linked uploads)
+        """
+        return upload_store.get_stats()
+
     def downloadTaskOutput(self, taskID, fileName, offset=0, size=-1, volume=None):
         """Download the file with the given name, generated by the task with the
-        given ID."""
-        if '..' in fileName:
-            raise koji.GenericError('Invalid file name: %s' % fileName)
-        filePath = '%s/%s/%s' % (koji.pathinfo.work(volume),
-                                 koji.pathinfo.taskrelpath(taskID),
-                                 fileName)
-        filePath = os.path.normpath(filePath)
+        given ID.
+
+        The contents are returned base64 encoded. Clients should rather use a
+        GET request, see handle_download in kojixmlrpc."""
+        filePath = get_task_output_path(taskID, fileName, volume)
         if not os.path.isfile(filePath):
             raise koji.GenericError('no file "%s" output by task %i' % (fileName, taskID))
         # Let the caller handler any IO or permission errors
@@ -11426,7 +12256,7 @@ class RootExports(object):
                 if strict:
                     raise koji.GenericError("No such build: %s" % buildID)
                 return _applyQueryOpts([], queryOpts)
-            srpms = self.listRPMs(buildID=build_info['id'], arches='src')
+            srpms = list(self.listRPMs(buildID=build_info['id'], arches='src'))
             if not srpms:
                 if strict:
                     raise koji.GenericError("Build %s doesn't have srpms" % buildID)
@@ -11560,6 +12390,7 @@ class RootExports(object):
             raise koji.GenericError("Finished task's priority can't be updated")
         task.setPriority(priority, recurse=recurse)
 
+    @readonly
     def listTagged(self, tag, event=None, inherit=False, prefix=None, latest=False, package=None,
                    owner=None, type=None):
         """List builds tagged with tag"""
@@ -11573,6 +12404,7 @@ class RootExports(object):
                        if build['package_name'].lower().startswith(prefix)]
         return results
 
+    @readonly
     def listTaggedRPMS(self, tag, event=None, inherit=False, latest=False, package=None, arch=None,
                        rpmsigs=False, owner=None, type=None):
         """List rpms and builds within tag"""
@@ -11581,6 +12413,7 @@ class RootExports(object):
         return readTaggedRPMS(tag, event=event, inherit=inherit, latest=latest, package=package,
                               arch=arch, rpmsigs=rpmsigs, owner=owner, type=type)
 
+    @readonly
     def listTaggedArchives(self, tag, event=None, inherit=False, latest=False, package=None,
                            type=None):
         """List archives and builds within a tag"""
@@ -11589,6 +12422,7 @@ class RootExports(object):
         return readTaggedArchives(tag, event=event, inherit=inherit, latest=latest,
                                   package=package, type=type)
 
+    @readonly
     def listBuilds(self, packageID=None, userID=None, taskID=None, prefix=None, state=None,
                    volumeID=None, source=None,
                    createdBefore=None, createdAfter=None,
@@ -11785,6 +12619,7 @@ class RootExports(object):
 
         return query.iterate()
 
+    @readonly
     def getLatestBuilds(self, tag, event=None, package=None, type=None):
         """List latest builds for tag (inheritance enabled)"""
         if not isinstance(tag, int):
@@ -11792,6 +12627,7 @@ class RootExports(object):
             tag = get_tag_id(tag, strict=True)
         return readTaggedBuilds(tag, event, inherit=True, latest=True, package=package, type=type)
 
+    @readonly
     def getLatestRPMS(self, tag, package=None, arch=None, event=None, rpmsigs=False, type=None):
         """List latest RPMS for tag (inheritance enabled)"""
         if not isinstance(tag, int):
@@ -11857,6 +12693,7 @@ class RootExports(object):
 
     checkTagAccess = staticmethod(check_tag_access)
 
+    @readonly
     def getInheritanceData(self, tag, event=None):
         """Return inheritance data for tag"""
         tag = get_tag_id(tag, strict=True)
@@ -11884,6 +12721,7 @@ class RootExports(object):
         context.session.assertPerm('tag')
         return writeInheritanceData(tag, data, clear=clear)
 
+    @readonly
     def getFullInheritance(self, tag, event=None, reverse=False, **kwargs):
         """
         :param int|str tag: tag ID | name
@@ -12175,6 +13013,7 @@ class RootExports(object):
 
     getPackage = staticmethod(lookup_package)
 
+    @readonly
     def listPackages(self, tagID=None, userID=None, pkgID=None, prefix=None, inherited=False,
                      with_dups=False, event=None, queryOpts=None, with_owners=True):
         """
@@ -12416,6 +13255,7 @@ class RootExports(object):
                                enable_group=True, transform=xform_user_krb)
         return query.execute()
 
+    @readonly
     def getBuildConfig(self, tag, event=None):
         """Return build configuration associated with a tag"""
         taginfo = get_tag(tag, strict=True, event=event, blocked=True)
@@ -12441,6 +13281,7 @@ class RootExports(object):
                 taginfo['extra'][k] = v[1]
         return taginfo
 
+    @readonly
     def getRepo(self, tag, state=None, event=None, dist=False):
         """Get individual repository data based on tag and additional filters.
         If more repos fits, most recent is returned.
@@ -12545,6 +13386,7 @@ class RootExports(object):
         repo_problem(repo_id)
 
     tagChangedSinceEvent = staticmethod(tag_changed_since_event)
+    tagsChangedSinceEvents = staticmethod(tags_changed_since_events)
     createBuildTarget = staticmethod(create_build_target)
     editBuildTarget = staticmethod(edit_build_target)
     deleteBuildTarget = staticmethod(delete_build_target)
@@ -12561,6 +13403,7 @@ class RootExports(object):
         task = Task(taskId)
         return task.isFinished()
 
+    @readonly
     def getTaskRequest(self, taskId):
         """Return original task request as a list. Content depends on task type
 
@@ -12571,6 +13414,7 @@ class RootExports(object):
         task = Task(taskId)
         return task.getRequest()
 
+    @readonly
     def getTaskResult(self, taskId, raise_fault=True):
         """Returns task results depending on task type. For buildArch it is a dict with build info,
         for newRepo list with two items, etc.
@@ -12583,6 +13427,7 @@ class RootExports(object):
         task = Task(taskId)
         return task.getResult(raise_fault=raise_fault)
 
+    @readonly
     def getTaskInfo(self, task_id, request=False, strict=False):
         """Get information about a task
 
@@ -12602,6 +13447,7 @@ class RootExports(object):
         else:
             return ret
 
+    @readonly
     def getTaskChildren(self, task_id, request=False, strict=False):
         """Return a list of the children
         of the Task with the given ID."""
@@ -12611,6 +13457,8 @@ class RootExports(object):
             task.getInfo(strict=True)
         return task.getChildren(request=request)
 
+    watchTasks = staticmethod(watch_tasks)
+
     def getTaskDescendents(self, task_id, request=False):
         """Get all descendents of the task with the given ID.
         Return a map of task_id -> list of child tasks.  If the given
@@ -12622,6 +13470,7 @@ class RootExports(object):
         task = Task(task_id)
         return get_task_descendents(task, request=request)
 
+    @readonly
     def listTasks(self, opts=None, queryOpts=None):
         """Return list of tasks filtered by options
 
@@ -13700,7 +14549,7 @@ class BuildRoot(object):
                                       "external_repo ON external_repo_id = external_repo.id"],
                                clauses=["buildroot_listing.buildroot_id = %(brootid)i"],
                                values=locals())
-        return query.execute()
+        return query.iterate()
 
     def _setList(self, rpmlist, update=False):
         """Set or update the list of rpms in a buildroot"""
@@ -13708,21 +14557,12 @@ class BuildRoot(object):
         update = bool(update)
         if self.id is None:
             raise koji.GenericError("buildroot not specified")
+        # external rpms are added if missing, compared if not
+        rpm_ids = get_rpm_ids(rpmlist)
         if update:
+            # ignore duplicate packages for updates
             current = set([r['rpm_id'] for r in self.getList()])
-        rpm_ids = []
-        for an_rpm in rpmlist:
-            location = an_rpm.get('location')
-            if location:
-                data = add_external_rpm(an_rpm, location, strict=False)
-                # will add if missing, compare if not
-            else:
-                data = get_rpm(an_rpm, strict=True)
-            rpm_id = data['id']
-            if update and rpm_id in current:
-                # ignore duplicate packages for updates
-                continue
-            rpm_ids.append(rpm_id)
+            rpm_ids = [r for r in rpm_ids if r not in current]
         # we sort to try to avoid deadlock issues
         rpm_ids.sort()
 
@@ -13970,6 +14810,8 @@ class Host(object):
 
         This data is relatively small and the necessary load analysis is
         relatively complex, so we let the host machines crunch it."""
+        if context.opts.get('TaskScheduler'):
+            maybe_schedule_tasks()
         hosts = get_ready_hosts()
         for host in hosts:
             if host['id'] == self.id:
@@ -13978,54 +14820,74 @@ class Host(object):
             # this host not in ready list
             return [[], []]
         # host is the host making the call
+        if context.opts.get('TaskScheduler'):
+            # the hub hands out the tasks, so the host only needs to know
+            # about itself and the tasks assigned to it
+            return [[host], get_active_tasks(host, assigned_only=True)]
         tasks = get_active_tasks(host)
         return [hosts, tasks]
 
-    def getTask(self):
-        """Open next available task and return it"""
-        c = context.cnx.cursor()
-        id = self.id
-        # get arch and channel info for host
-        q = """
-        SELECT arches FROM host_config WHERE host_id = %(id)s AND active IS TRUE
-        """
-        c.execute(q, locals())
-        arches = c.fetchone()[0].split()
-        q = """
-        SELECT channel_id FROM host_channels WHERE host_id = %(id)s AND active is TRUE
-        """
-        c.execute(q, locals())
-        channels = [x[0] for x in c.fetchall()]
+    def getTask(self, methods=None, limit=10, exclude=None):
+        """Open next available task and return it
 
-        # query tasks
-        fields = ['id', 'state', 'method', 'request', 'channel_id', 'arch', 'parent']
-        st_free = koji.TASK_STATES['FREE']
-        st_assigned = koji.TASK_STATES['ASSIGNED']
-        q = """
-        SELECT %s FROM task
-        WHERE (state = %%(st_free)s)
-            OR (state = %%(st_assigned)s AND host_id = %%(id)s)
-        ORDER BY priority,create_time
-        """ % (",".join(fields))
-        c.execute(q, locals())
-        for data in c.fetchall():
-            data = dict(zip(fields, data))
-            # XXX - we should do some pruning here, but for now...
-            # check arch
-            if data['arch'] not in arches:
-                continue
-            # NOTE: channels ignored for explicit assignments
-            if data['state'] != st_assigned and data['channel_id'] not in channels:
-                continue
-            task = Task(data['id'])
-            ret = task.open(self.id)
-            if ret is None:
-                # someone else got it while we were looking
-                # log_error("task %s seems to be locked" % task['id'])
-                continue
-            return ret
-        # else no appropriate tasks
-        return None
+        The tasks this host can take are filtered by the query and locked
+        with SKIP LOCKED, so concurrent callers neither wait for nor compete
+        over the same tasks.
+
+        :param list methods: only consider tasks with these methods
+        :param int limit: how many candidate tasks to lock at once
+        :param list exclude: ids of tasks not to consider
+
+        With the TaskScheduler option, the hub hands out the tasks, so only
+        the tasks assigned to this host are considered.
+        """
+        scheduler = context.opts.get('TaskScheduler')
+        if scheduler:
+            maybe_schedule_tasks()
+        # get arch and channel info for host
+        query = """SELECT arches FROM host_config WHERE host_id = %(id)s AND active IS TRUE"""
+        arches = _singleValue(query, {'id': self.id}).split()
+        if not arches:
+            return None
+        if 'noarch' not in arches:
+            # like the builder, every host can take noarch tasks
+            arches.append('noarch')
+        query = """SELECT channel_id FROM host_channels
+        WHERE host_id = %(id)s AND active IS TRUE"""
+        channels = [row[0] for row in _fetchMulti(query, {'id': self.id})]
+
+        values = dslice(koji.TASK_STATES, ('FREE', 'ASSIGNED'))
+        values.update({'host_id': self.id, 'arches': arches, 'channels': channels,
+                       'methods': methods, 'skipped': list(exclude or [])})
+        # NOTE: channels and arches ignored for explicit assignments
+        clause = '(state = %(ASSIGNED)i AND host_id = %(host_id)i)'
+        if channels and not scheduler:
+            clause += (' OR (state = %(FREE)i AND channel_id IN %(channels)s'
+                       ' AND arch IN %(arches)s)')
+        clauses = ['state IN (%(FREE)i, %(ASSIGNED)i)', clause]
+        if methods is not None:
+            if not methods:
+                return None
+            clauses.append('method IN %(methods)s')
+        if values['skipped']:
+            clauses.append('id NOT IN %(skipped)s')
+        while True:
+            query = QueryProcessor(columns=['id', 'priority', 'create_time'], tables=['task'],
+                                   clauses=clauses, values=values,
+                                   opts={'order': 'priority,create_time', 'limit': limit,
+                                         'rowlock': 'skip'})
+            rows = query.execute()
+            for row in rows:
+                ret = Task(row['id']).open(self.id)
+                if ret is not None:
+                    return ret
+            if len(rows) < limit:
+                # else no appropriate tasks
+                return None
+            # we still hold the locks of the tasks we could not open
+            if not values['skipped']:
+                clauses.append('id NOT IN %(skipped)s')
+            values['skipped'].extend([row['id'] for row in rows])
 
     def isEnabled(self):
         """Return whether this host is enabled or not."""
@@ -14063,6 +14925,32 @@ class HostExports(object):
         task = Task(task_id)
         return task.open(host.id)
 
+    def waitForTaskEvents(self, timeout=60):
+        """Wait until tasks relevant to this host change
+
+        Waits (at most timeout seconds, limited by the TaskEventsMaxWait hub
+        option) for one of these:
+        - a task of this host changes state (other than being opened)
+        - a subtask of one of its tasks is finished
+
+        :param float timeout: how long to wait (seconds)
+        :returns: list of task events, empty on timeout
+        """
+        host = Host()
+        host.verify()
+        return wait_for_task_events(host.id, timeout)
+
+    def getTask(self, methods=None, exclude=None):
+        """Open the next task this host can take and return it
+
+        :param list methods: only consider tasks with these methods
+        :param list exclude: ids of tasks not to consider
+        :returns: the task data as returned by openTask, or None
+        """
+        host = Host()
+        host.verify()
+        return host.getTask(methods=methods, exclude=exclude)
+
     def closeTask(self, task_id, response):
         host = Host()
         host.verify()
@@ -14511,7 +15399,7 @@ class HostExports(object):
                 'cannot import wrapper rpms for %s: build state is %s, not complete' %
                 (koji.buildLabel(build_info), koji.BUILD_STATES[build_info['state']].lower()))
 
-        if list_rpms(buildID=build_info['id']):
+        if list_rpms(buildID=build_info['id'], queryOpts={'limit': 1}):
             # don't allow overwriting of already-imported wrapper RPMs
             raise koji.GenericError('wrapper rpms for %s have already been imported' %
                                     koji.buildLabel(build_info))
@@ -15144,7 +16032,13 @@ class HostExports(object):
         return write_signed_rpm(an_rpm, sigkey, force)
 
 
-def get_upload_path(reldir, name, create=False, volume=None):
+def get_upload_path(reldir, name, create=False, volume=None, verify=False):
+    """Return the path of an upload
+
+    With create, the upload directory is created (or checked) for the caller.
+    With verify, the caller must own an existing upload directory (or run the
+    task of a task directory) without it being created.
+    """
     orig_reldir = reldir
     orig_name = name
     # lots of sanity checks
@@ -15158,8 +16052,11 @@ def get_upload_path(reldir, name, create=False, volume=None):
         # make sure the volume is valid
         lookup_name('volume', volume, strict=True)
     parts = reldir.split('/')
+    if parts[0] == 'upload-store':
+        # only written by UploadStore
+        raise koji.GenericError("Invalid upload directory: %s" % orig_reldir)
     check_user = True
-    if create and parts[0] == "tasks":
+    if (create or verify) and parts[0] == "tasks":
         if len(parts) < 3:
             raise koji.GenericError("Invalid task upload directory: %s" % orig_reldir)
         try:
@@ -15185,6 +16082,11 @@ def get_upload_path(reldir, name, create=False, volume=None):
             else:
                 with open(u_fn, 'wt') as fo:
                     fo.write(str(context.session.user_id))
+    elif verify and check_user:
+        u_fn = joinpath(udir, '.user')
+        if not os.path.exists(u_fn) or \
+                context.session.user_id != int(open(u_fn, 'rt').read()):
+            raise koji.GenericError("Invalid upload directory, not owner: %s" % orig_reldir)
     return joinpath(udir, name)
 
 
@@ -15201,8 +16103,187 @@ def get_verify_class(verify):
         return None
 
 
+class UploadStore(object):
+    """Content addressed store of uploads
+
+    Uploads registered with storeUpload are hardlinked by their sha256 into
+    the upload-store directory of their volume. Later uploads of the same
+    content are linked into place by linkUpload instead of being sent again.
+    Uploads that share their data this way must not be changed in place, see
+    unshare_upload.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = dict.fromkeys(['links', 'misses', 'stored', 'bytes_avoided'], 0)
+
+    def _count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def path(self, sha256, volume=None):
+        if not isinstance(sha256, str) or not re.match(r'^[0-9a-f]{64}$', sha256):
+            raise koji.GenericError("Invalid sha256 digest: %r" % sha256)
+        return joinpath(koji.pathinfo.work(volume=volume), 'upload-store', sha256[:2], sha256)
+
+    @staticmethod
+    def _replace_link(src, dst):
+        """Atomically make dst a hardlink of src"""
+        tmp = joinpath(os.path.dirname(dst),
+                       '.%s.%s.tmp' % (os.path.basename(dst), secrets.token_hex(4)))
+        os.link(src, tmp)
+        try:
+            os.rename(tmp, dst)
+        except Exception:
+            os.unlink(tmp)
+            raise
+
+    def link(self, fn, size, sha256, volume=None):
+        """Link stored content to fn
+
+        :returns: True if the content was found, False otherwise
+        """
+        logger = logging.getLogger('koji.upload')
+        src = self.path(sha256, volume=volume)
+        try:
+            st = os.stat(src)
+        except FileNotFoundError:
+            self._count('misses')
+            return False
+        if st.st_nlink < 2:
+            # all other copies are gone, nobody needs this one anymore
+            try:
+                os.unlink(src)
+            except FileNotFoundError:
+                pass
+            self._count('misses')
+            return False
+        if st.st_size != size:
+            self._count('misses')
+            return False
+        try:
+            self._replace_link(src, fn)
+        except OSError as e:
+            # e.g. removed in the meantime or too many links
+            logger.warning("Cannot link %s to %s: %s", src, fn, e)
+            self._count('misses')
+            return False
+        self._count('links')
+        self._count('bytes_avoided', size)
+        logger.info("Linked %s from the upload store, %i bytes not uploaded", fn, size)
+        return True
+
+    def store(self, fn, sha256, volume=None):
+        """Add an upload to the store, after checking its sha256"""
+        dst = self.path(sha256, volume=volume)
+        try:
+            fd = os.open(fn, os.O_RDONLY)
+        except FileNotFoundError:
+            raise koji.GenericError("No such upload: %s" % fn)
+        try:
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except IOError as e:
+                raise koji.LockError(e)
+            st = os.fstat(fd)
+            if not stat.S_ISREG(st.st_mode):
+                raise koji.GenericError("Not a regular file: %s" % fn)
+            chksum = hashlib.sha256()
+            while True:
+                chunk = os.read(fd, 1048576)
+                if not chunk:
+                    break
+                chksum.update(chunk)
+            if chksum.hexdigest() != sha256:
+                raise koji.GenericError("Upload has wrong sha256: %s, %s != %s"
+                                        % (fn, chksum.hexdigest(), sha256))
+            koji.ensuredir(os.path.dirname(dst))
+            self._replace_link(fn, dst)
+        finally:
+            # this will also free our lock
+            os.close(fd)
+        self._count('stored')
+
+    def get_stats(self):
+        with self.lock:
+            return self.stats.copy()
+
+
+upload_store = UploadStore()
+
+
+def unshare_upload(fn, copy=True):
+    """Make sure that an upload does not share its data with other files
+
+    Uploads can be hardlinks of stored content (see UploadStore), which must
+    not change. Such an upload is replaced by a copy of itself, or just
+    removed if copy is False.
+    """
+    try:
+        st = os.lstat(fn)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISREG(st.st_mode) or st.st_nlink < 2:
+        return
+    if not copy:
+        os.unlink(fn)
+        return
+    tmp = joinpath(os.path.dirname(fn),
+                   '.%s.%s.tmp' % (os.path.basename(fn), secrets.token_hex(4)))
+    try:
+        shutil.copyfile(fn, tmp)
+        os.rename(tmp, fn)
+    except Exception:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def copy_upload(inf, fd, chksum, chunksize):
+    """Write the data of an upload request to a file
+
+    If the input supports it, the data is read into a single preallocated
+    buffer, which is checksummed and written in place.
+
+    :param inf: the request input
+    :param int fd: the file descriptor to write to
+    :param chksum: checksum object to update or None
+    :param int chunksize: size of the reads
+    :returns: the number of bytes written
+    """
+    size = 0
+    readinto = getattr(inf, 'readinto', None)
+    if readinto is not None:
+        buf = bytearray(chunksize)
+        view = memoryview(buf)
+    while True:
+        if readinto is not None:
+            length = readinto(buf)
+            if not length:
+                break
+            chunk = view[:length]
+        else:
+            chunk = inf.read(chunksize)
+            if not chunk:
+                break
+            length = len(chunk)
+            chunk = memoryview(chunk)
+        size += length
+        if chksum is not None:
+            chksum.update(chunk)
+        while chunk:
+            chunk = chunk[os.write(fd, chunk):]
+    return size
+
+
 def handle_upload(environ):
-    """Handle file upload via POST request"""
+    """Handle file upload via POST request
+
+    With the parallel option, the chunks of an upload may be written at the
+    same time. The first chunk (offset 0) must be complete before the others
+    are sent. The other chunks only lock the range they write and do not
+    truncate the file.
+    """
     logger = logging.getLogger('koji.upload')
     start = time.time()
     if not context.session.logged_in:
@@ -15215,6 +16296,9 @@ def handle_upload(environ):
     overwrite = args.get('overwrite', ('',))[0]
     offset = args.get('offset', ('0',))[0]
     offset = int(offset)
+    parallel = args.get('parallel', ('',))[0]
+    if parallel and offset < 0:
+        raise koji.GenericError("parallel uploads require an offset")
     volume = args.get('volume', ('DEFAULT',))[0]
     fn = get_upload_path(path, name, create=True, volume=volume)
     if os.path.exists(fn):
@@ -15222,28 +16306,43 @@ def handle_upload(environ):
             raise koji.GenericError("destination not a file: %s" % fn)
         if offset == 0 and not overwrite:
             raise koji.GenericError("upload path exists: %s" % fn)
-    chksum = get_verify_class(verify)()
-    size = 0
+    chksum = None
+    if verify:
+        chksum = get_verify_class(verify)()
+    length = int(environ.get('CONTENT_LENGTH') or 0)
     inf = environ['wsgi.input']
+    # a new upload of the file does not need the old data
+    unshare_upload(fn, copy=offset != 0)
     fd = os.open(fn, os.O_RDWR | os.O_CREAT, 0o666)
     try:
-        try:
-            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
-        except IOError as e:
-            raise koji.LockError(e)
-        if offset == -1:
-            offset = os.lseek(fd, 0, 2)
-        else:
-            os.ftruncate(fd, offset)
+        if parallel and offset > 0:
+            if length:
+                try:
+                    fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB, length, offset, 0)
+                except IOError as e:
+                    raise koji.LockError(e)
             os.lseek(fd, offset, 0)
-        while True:
-            chunk = inf.read(65536)
-            if not chunk:
-                break
-            size += len(chunk)
-            if verify:
-                chksum.update(chunk)
-            os.write(fd, chunk)
+        else:
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError as e:
+                raise koji.LockError(e)
+            if offset == -1:
+                offset = os.lseek(fd, 0, 2)
+            else:
+                os.ftruncate(fd, offset)
+                os.lseek(fd, offset, 0)
+        preallocated = False
+        if length and context.opts.get('UploadPreallocate'):
+            try:
+                os.posix_fallocate(fd, offset, length)
+                preallocated = True
+            except OSError as e:
+                logger.debug("Cannot preallocate %s: %s", fn, e)
+        size = copy_upload(inf, fd, chksum, context.opts.get('UploadChunkSize', 262144))
+        if preallocated and size < length and not parallel:
+            # the request was cut short, drop the rest of the allocation
+            os.ftruncate(fd, offset + size)
     finally:
         # this will also remove our lock
         os.close(fd)
@@ -15252,6 +16351,9 @@ def handle_upload(environ):
         'fileverify': verify,
         'offset': offset,
     }
+    if parallel:
+        # tells the client that the chunks can be sent in parallel
+        ret['parallel'] = True
     if verify:
         # unsigned 32bit - could be too big for xmlrpc
         ret['hexdigest'] = chksum.hexdigest()
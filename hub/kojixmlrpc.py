@@ -19,7 +19,9 @@
 #       Mike McLean <mikem@redhat.com>
 
 import datetime
+import email.utils
 import inspect
+import itertools
 import logging
 import os
 import pprint
@@ -28,16 +30,19 @@ import sys
 import threading
 import time
 import traceback
+import types
 
 import koji
 import koji.auth
+import koji.compression
 import koji.db
+import koji.jsonplus
 import koji.plugin
 import koji.policy
 import koji.util
 from koji.context import context
 # import xmlrpclib functions from koji to use tweaked Marshaller
-from koji.xmlrpcplus import ExtendedMarshaller, Fault, dumps, getparser
+from koji.xmlrpcplus import ExtendedMarshaller, Fault, dumps, getparser, iterdumps
 
 
 class Marshaller(ExtendedMarshaller):
@@ -51,6 +56,13 @@ class Marshaller(ExtendedMarshaller):
     dispatch[datetime.datetime] = dump_datetime
 
 
+def json_default(value):
+    # For backwards compatibility, we return datetime objects as strings
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(' ')
+    return NotImplemented
+
+
 class HandlerRegistry(object):
     """Track handlers for RPC calls"""
 
@@ -198,6 +210,10 @@ class ModXMLRPCRequestHandler(object):
         self.traceback = False
         self.handlers = handlers  # expecting HandlerRegistry instance
         self.logger = logging.getLogger('koji.xmlrpc')
+        # respond in json instead of xmlrpc
+        self.use_json = False
+        # position of the event arg by handler
+        self._event_args = {}
 
     def _get_handler(self, name):
         # just a wrapper so we can handle multicall ourselves
@@ -207,8 +223,7 @@ class ModXMLRPCRequestHandler(object):
         else:
             return self.handlers.get(name)
 
-    def _read_request(self, stream):
-        parser, unmarshaller = getparser()
+    def _iter_request(self, stream):
         rlen = 0
         maxlen = opts.get('MaxRequestLength', None)
         while True:
@@ -218,10 +233,42 @@ class ModXMLRPCRequestHandler(object):
             rlen += len(chunk)
             if maxlen and rlen > maxlen:
                 raise koji.GenericError('Request too long')
+            yield chunk
+
+    def _read_request(self, stream):
+        parser, unmarshaller = getparser()
+        for chunk in self._iter_request(stream):
             parser.feed(chunk)
         parser.close()
         return unmarshaller.close(), unmarshaller.getmethodname()
 
+    def _read_json_request(self, stream):
+        data = b''.join(self._iter_request(stream))
+        try:
+            return koji.jsonplus.loads_request(data)
+        except (ValueError, KeyError) as e:
+            raise koji.GenericError('Invalid json request: %s' % e)
+
+    @property
+    def content_type(self):
+        if self.use_json:
+            return koji.jsonplus.CONTENT_TYPE
+        return "text/xml"
+
+    def _dumps(self, response):
+        """Encode a response tuple or a Fault"""
+        if self.use_json:
+            if not isinstance(response, Fault):
+                response = response[0]
+            return koji.jsonplus.dumps_response(response, default=json_default)
+        return dumps(response, methodresponse=1, marshaller=Marshaller).encode()
+
+    def _iterdumps(self, response, chunksize):
+        if self.use_json:
+            return koji.jsonplus.iterdumps(response[0], default=json_default,
+                                           chunksize=chunksize)
+        return iterdumps(response, marshaller=Marshaller, chunksize=chunksize)
+
     def _log_exception(self):
         e_class, e = sys.exc_info()[:2]
         faultCode = getattr(e_class, 'faultCode', 1)
@@ -246,24 +293,38 @@ class ModXMLRPCRequestHandler(object):
         return faultCode, faultString
 
     def _wrap_handler(self, handler, environ):
-        """Catch exceptions and encode response of handler"""
+        """Catch exceptions and encode response of handler
+
+        Returns a list of encoded chunks and, if the rest of the response
+        should be streamed, an iterator of the remaining chunks (else None)
+        """
 
+        chunksize = context.opts.get('ResponseChunkSize')
         # generate response
         try:
             response = handler(environ)
             # wrap response in a singleton tuple
             response = (response,)
-            response = dumps(response, methodresponse=1, marshaller=Marshaller)
+            if not chunksize:
+                return [self._dumps(response)], None
+            chunks = self._iterdumps(response, chunksize)
+            # errors at the start (e.g. in queries) can still be reported as a fault
+            head = list(itertools.islice(chunks, 2))
+            if len(head) < 2 or context.commit_pending:
+                # small response or changes, which must be committed first
+                head.extend(chunks)
+                return head, None
+            return head, chunks
         except Fault as fault:
             self.traceback = True
-            response = dumps(fault, marshaller=Marshaller)
+            response = self._dumps(fault)
         except Exception:
             self.traceback = True
             # report exception back to server
             faultCode, faultString = self._log_exception()
-            response = dumps(Fault(faultCode, faultString), marshaller=Marshaller)
+            response = self._dumps(Fault(faultCode, faultString))
 
-        return response
+        return [response], None
 
     def handle_upload(self, environ):
         # uploads can't be in a multicall
@@ -272,8 +333,25 @@ class ModXMLRPCRequestHandler(object):
         self.enforce_lockout()
         return kojihub.handle_upload(environ)
 
+    def handle_download(self, environ):
+        # downloads can't be in a multicall
+        context.method = None
+        self.check_session()
+        self.enforce_lockout()
+        return kojihub.open_task_output(environ)
+
     def handle_rpc(self, environ):
-        params, method = self._read_request(environ['wsgi.input'])
+        stream = environ['wsgi.input']
+        encoding = environ.get('HTTP_CONTENT_ENCODING')
+        if encoding and encoding != 'identity':
+            try:
+                stream = koji.compression.decompress_stream(stream, encoding)
+            except ValueError as e:
+                raise koji.GenericError(str(e))
+        if environ.get('CONTENT_TYPE') == koji.jsonplus.CONTENT_TYPE:
+            params, method = self._read_json_request(stream)
+        else:
+            params, method = self._read_request(stream)
         return self._dispatch(method, params)
 
     def check_session(self):
@@ -311,7 +389,11 @@ class ModXMLRPCRequestHandler(object):
                 self.logger.debug("Opts: %s", pprint.pformat(opts))
             start = time.time()
 
-        ret = koji.util.call_with_argcheck(func, params, opts)
+        replica = self._get_replica(func, params, opts)
+        if replica:
+            ret = self._call_on_replica(replica, func, params, opts)
+        else:
+            ret = koji.util.call_with_argcheck(func, params, opts)
 
         if self.logger.isEnabledFor(logging.INFO):
             rusage = resource.getrusage(resource.RUSAGE_SELF)
@@ -323,32 +405,118 @@ class ModXMLRPCRequestHandler(object):
 
         return ret
 
+    def _get_replica(self, func, params, opts):
+        """Return the replica connection if it can serve this call, otherwise None
+
+        Only calls of read-only methods are routed to the replica and only
+        until the request writes to the primary database. The replica must
+        not lag behind more than DBReplicaMaxLag seconds and it must already
+        have replayed the event requested by the call.
+        """
+        if not getattr(func, 'readonly', False) or context.commit_pending:
+            return None
+        if not hasattr(context, 'replica'):
+            # checked once per request
+            context.replica = get_replica()
+        if context.replica is None:
+            return None
+        cnx, last_event = context.replica
+        event = opts.get('event')
+        if event is None:
+            pos = self._event_arg_index(func)
+            if pos is not None and pos < len(params):
+                event = params[pos]
+        if isinstance(event, int) and event > last_event:
+            self.logger.debug("Replica has not replayed event %s yet", event)
+            return None
+        return cnx
+
+    def _event_arg_index(self, func):
+        """Return the position of the event argument of func, or None"""
+        if func not in self._event_args:
+            args = [isinstance(a, tuple) and a[0] or a
+                    for a in self.handlers._getFuncArgs(func)]
+            if 'event' in args:
+                self._event_args[func] = args.index('event')
+            else:
+                self._event_args[func] = None
+        return self._event_args[func]
+
+    def _call_on_replica(self, cnx, func, params, opts):
+        ret = self._on_replica(cnx, self._call_read_only, cnx, func, params, opts)
+        if isinstance(ret, types.GeneratorType):
+            # results read while the response is sent must come from the replica too
+            return self._iterate_on_replica(cnx, ret)
+        return ret
+
+    def _iterate_on_replica(self, cnx, gen):
+        try:
+            while True:
+                try:
+                    item = self._on_replica(cnx, next, gen)
+                except StopIteration:
+                    return
+                except Exception:
+                    cnx.rollback()
+                    raise
+                yield item
+        finally:
+            self._on_replica(cnx, gen.close)
+
+    def _on_replica(self, cnx, func, *args):
+        primary = context.cnx
+        # current data cached during the call might be stale
+        cache = getattr(context, 'inheritance_cache', None)
+        context.cnx = cnx
+        context.inheritance_cache = {}
+        try:
+            return func(*args)
+        finally:
+            context.cnx = primary
+            context.inheritance_cache = cache
+
+    def _call_read_only(self, cnx, func, params, opts):
+        """Call a read-only handler without savepoints
+
+        If the call fails, cnx is rolled back, so a database error does not
+        affect the following calls. Once a result is streamed though, its
+        cursor must survive until the response is sent, so the calls after
+        it only roll back to a savepoint.
+        """
+        savepoint = getattr(context, 'streamed_results', False)
+        if savepoint:
+            # not a write, so not with _dml
+            _execute(cnx, 'SAVEPOINT read_only_call')
+        try:
+            ret = koji.util.call_with_argcheck(func, params, opts)
+        except Exception:
+            if savepoint:
+                _execute(cnx, 'ROLLBACK TO SAVEPOINT read_only_call')
+            else:
+                # don't leave an aborted transaction for following calls
+                cnx.rollback()
+            raise
+        if savepoint:
+            _execute(cnx, 'RELEASE SAVEPOINT read_only_call')
+        if isinstance(ret, types.GeneratorType):
+            context.streamed_results = True
+        return ret
+
     def multiCall(self, calls):
         """Execute a multicall.  Execute each method call in the calls list, collecting
         results and errors, and return those as a list."""
+        if context.opts.get('ReadOnlyMultiCall'):
+            funcs = self._readonly_handlers(calls)
+            if funcs is not None:
+                return self._readonly_multicall(calls, funcs)
         results = []
         for call in calls:
             savepoint = kojihub.Savepoint('multiCall_loop')
             try:
                 result = self._dispatch(call['methodName'], call['params'])
-            except Fault as fault:
-                savepoint.rollback()
-                results.append({'faultCode': fault.faultCode, 'faultString': fault.faultString})
             except Exception:
                 savepoint.rollback()
-                # transform unknown exceptions into XML-RPC Faults
-                # don't create a reference to full traceback since this creates
-                # a circular reference.
-                exc_type, exc_value = sys.exc_info()[:2]
-                faultCode = getattr(exc_type, 'faultCode', 1)
-                faultString = ', '.join([str(arg) for arg in exc_value.args])
-                trace = traceback.format_exception(*sys.exc_info())
-                # traceback is not part of the multicall spec,
-                # but we include it for debugging purposes
-                results.append({'faultCode': faultCode,
-                                'faultString': faultString,
-                                'traceback': trace})
-                self._log_exception()
+                results.append(self._multicall_fault())
             else:
                 results.append([result])
 
@@ -358,6 +526,80 @@ class ModXMLRPCRequestHandler(object):
 
         return results
 
+    def _multicall_fault(self):
+        """Return the multicall entry for the current exception"""
+        exc_type, exc_value = sys.exc_info()[:2]
+        if isinstance(exc_value, Fault):
+            return {'faultCode': exc_value.faultCode, 'faultString': exc_value.faultString}
+        # transform unknown exceptions into XML-RPC Faults
+        # don't create a reference to full traceback since this creates
+        # a circular reference.
+        faultCode = getattr(exc_type, 'faultCode', 1)
+        faultString = ', '.join([str(arg) for arg in exc_value.args])
+        trace = traceback.format_exception(*sys.exc_info())
+        self._log_exception()
+        # traceback is not part of the multicall spec,
+        # but we include it for debugging purposes
+        return {'faultCode': faultCode,
+                'faultString': faultString,
+                'traceback': trace}
+
+    def _readonly_handlers(self, calls):
+        """Return the handlers by method name if all calls are read-only, else None"""
+        funcs = {}
+        for call in calls:
+            try:
+                method = call['methodName']
+                if method not in funcs:
+                    funcs[method] = self._get_handler(method)
+            except Exception:
+                # reported by the regular path
+                return None
+            if not getattr(funcs[method], 'readonly', False):
+                return None
+        return funcs
+
+    def _readonly_multicall(self, calls, funcs):
+        """Execute a multicall of read-only calls
+
+        Nothing is written, so the calls need no savepoints. When a call
+        fails, the transaction is rolled back instead (see _call_read_only),
+        so a database error does not affect the following calls. The session was already checked
+        for the multicall and the calls are logged in a single line.
+        """
+        start = time.time()
+        results = []
+        faults = 0
+        for call in calls:
+            method = call['methodName']
+            func = funcs[method]
+            context.method = method
+            context.params = call['params']
+            try:
+                params, opts = koji.decode_args(*call['params'])
+                replica = self._get_replica(func, params, opts)
+                if replica:
+                    result = self._call_on_replica(replica, func, params, opts)
+                else:
+                    result = self._call_read_only(context.cnx, func, params, opts)
+            except Exception:
+                faults += 1
+                results.append(self._multicall_fault())
+            else:
+                results.append([result])
+        context.method = 'multiCall'
+        context.params = (calls,)
+        if self.logger.isEnabledFor(logging.INFO):
+            counts = {}
+            for call in calls:
+                counts[call['methodName']] = counts.get(call['methodName'], 0) + 1
+            self.logger.info(
+                "Completed %i read-only calls (%s) with %i faults for session %s (#%s): "
+                "%f seconds", len(calls),
+                ', '.join(['%s: %i' % item for item in sorted(counts.items())]),
+                faults, context.session.id, context.session.callnum, time.time() - start)
+        return results
+
     def handle_request(self, req):
         """Handle a single XML-RPC request"""
 
@@ -365,6 +607,43 @@ class ModXMLRPCRequestHandler(object):
         # XXX no longer used
 
 
+def _execute(cnx, sql):
+    c = cnx.cursor()
+    c.execute(sql, {})
+    c.close()
+
+
+def get_replica():
+    """Connect to the read-only replica and check its lag
+
+    Returns a (connection, last replayed event) tuple, or None if the replica
+    is not configured, unavailable or lagging too much.
+    """
+    logger = logging.getLogger('koji.db')
+    try:
+        cnx = koji.db.connectReplica()
+        if cnx is None:
+            return None
+        c = cnx.cursor()
+        # no lag if all received WAL has been replayed, regardless of the
+        # time of the last replayed transaction
+        c.execute("""SELECT
+            CASE WHEN NOT pg_is_in_recovery() THEN 0
+                 WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                 ELSE EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp())
+            END,
+            (SELECT MAX(id) FROM events)""", {})
+        lag, last_event = c.fetchone()
+    except Exception:
+        logger.warning("Replica database is not available", exc_info=True)
+        return None
+    if lag is None or lag > context.opts['DBReplicaMaxLag']:
+        logger.info("Replica lag is %s seconds, using the primary database", lag)
+        cnx.close()
+        return None
+    return cnx, last_event
+
+
 def offline_reply(start_response, msg=None):
     """Send a ServerOffline reply"""
     faultCode = koji.ServerOffline.faultCode
@@ -381,6 +660,160 @@ def offline_reply(start_response, msg=None):
     return [response]
 
 
+def error_reply(start_response, status, faultCode, faultString):
+    """Send a fault with an error status, for requests other than calls"""
+    response = dumps(Fault(faultCode, faultString)).encode()
+    headers = [
+        ('Content-Length', str(len(response))),
+        ('Content-Type', "text/xml"),
+    ]
+    start_response(status, headers)
+    return [response]
+
+
+def parse_range(value, size):
+    """Parse the Range header of a download
+
+    Only single byte ranges are supported, other ranges are ignored as
+    allowed by RFC 7233.
+
+    :param str value: header value, e.g. "bytes=100-"
+    :param int size: size of the file
+    :returns: (start, end) of the range, end excluded, or None to send the
+              whole file
+    :raises ValueError: if the range cannot be satisfied
+    """
+    if not value:
+        return None
+    unit, _, spec = value.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, sep, last = [x.strip() for x in spec.partition('-')]
+    if not sep or not (first or last):
+        return None
+    if (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+    if not first:
+        # the last bytes of the file
+        length = int(last)
+        if not length or not size:
+            raise ValueError('unsatisfiable range: %s' % value)
+        return max(size - length, 0), size
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError('unsatisfiable range: %s' % value)
+    if last:
+        return start, min(int(last) + 1, size)
+    return start, size
+
+
+def iter_file(fo, length, blocksize=1048576):
+    """Read up to length bytes of an open file in blocks"""
+    try:
+        while length > 0:
+            data = fo.read(min(length, blocksize))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        fo.close()
+
+
+def download_reply(fo, environ, start_response):
+    """Send (a range of) an open file
+
+    Files still being written (e.g. logs of running tasks) are sent up to
+    their size at the time of the request.
+    """
+    st = os.fstat(fo.fileno())
+    size = st.st_size
+    etag = '"%x-%x"' % (size, int(st.st_mtime))
+    headers = [
+        ('Content-Type', 'application/octet-stream'),
+        ('Accept-Ranges', 'bytes'),
+        ('Last-Modified', email.utils.formatdate(st.st_mtime, usegmt=True)),
+        ('ETag', etag),
+    ]
+    try:
+        byterange = parse_range(environ.get('HTTP_RANGE'), size)
+    except ValueError:
+        fo.close()
+        headers = [
+            ('Content-Range', 'bytes */%d' % size),
+            ('Content-Length', '0'),
+        ]
+        start_response('416 Range Not Satisfiable', headers)
+        return []
+    if_range = environ.get('HTTP_IF_RANGE')
+    if byterange is None or (if_range and if_range != etag):
+        status = '200 OK'
+        start, end = 0, size
+    else:
+        status = '206 Partial Content'
+        start, end = byterange
+        headers.append(('Content-Range', 'bytes %d-%d/%d' % (start, end - 1, size)))
+    headers.append(('Content-Length', str(end - start)))
+    start_response(status, headers)
+    if environ['REQUEST_METHOD'] == 'HEAD' or start == end:
+        fo.close()
+        return []
+    fo.seek(start)
+    wrapper = environ.get('wsgi.file_wrapper')
+    if wrapper and 'mod_wsgi.version' in environ:
+        # mod_wsgi sends no more than the Content-Length, using sendfile
+        return wrapper(fo, 1048576)
+    # other servers may send the file up to its current end
+    return iter_file(fo, end - start)
+
+
+def handle_download(environ, start_response):
+    """Handle a GET or HEAD request for a task output file
+
+    The file is named by the query string, which may also have the usual
+    session args. Unlike calls, the file is sent as is, supporting single
+    byte ranges, and errors are reported as faults with an error status.
+    """
+    if opts.get('ServerOffline'):
+        return error_reply(start_response, '503 Service Unavailable',
+                           koji.ServerOffline.faultCode,
+                           opts.get("OfflineMessage") or "server is offline")
+    logger = logging.getLogger("koji.xmlrpc")
+    try:
+        context._threadclear()
+        context.commit_pending = False
+        context.opts = opts
+        context.handlers = HandlerAccess(registry)
+        context.environ = environ
+        context.policy = policy
+        try:
+            context.cnx = koji.db.connect()
+        except Exception:
+            return error_reply(start_response, '503 Service Unavailable',
+                               koji.ServerOffline.faultCode, "database outage")
+        h = ModXMLRPCRequestHandler(registry)
+        try:
+            fo = h.handle_download(environ)
+        except Exception as e:
+            if isinstance(e, (koji.AuthError, koji.ActionNotAllowed)):
+                status = '403 Forbidden'
+            elif isinstance(e, koji.ServerOffline):
+                status = '503 Service Unavailable'
+            elif isinstance(e, koji.GenericError):
+                status = '400 Bad Request'
+            else:
+                status = '500 Internal Server Error'
+            faultCode, faultString = h._log_exception()
+            return error_reply(start_response, status, faultCode, faultString)
+    finally:
+        # the database is not needed to send the file
+        cleanup_context()
+    logger.debug("Sending task output for query %s", environ.get('QUERY_STRING'))
+    return download_reply(fo, environ, start_response)
+
+
 def load_config(environ):
     """Load configuration options
 
@@ -411,6 +844,13 @@ def load_config(environ):
         ['DBPort', 'integer', None],
         ['DBPass', 'string', None],
         ['DBConnectionString', 'string', None],
+        ['DBPoolMaxSize', 'integer', 0],
+        ['DBPoolMinSize', 'integer', 1],
+        ['DBPoolMaxAge', 'integer', 3600],
+        ['DBPoolMaxIdle', 'integer', 300],
+        ['DBPoolTimeout', 'integer', 30],
+        ['DBReplicaConnectionString', 'string', None],
+        ['DBReplicaMaxLag', 'integer', 30],
         ['KojiDir', 'string', None],
 
         ['AuthPrincipal', 'string', None],
@@ -425,6 +865,7 @@ def load_config(environ):
         ['ProxyDNs', 'string', ''],
 
         ['CheckClientIP', 'boolean', True],
+        ['SessionUpdateInterval', 'integer', 60],
 
         ['LoginCreatesUser', 'boolean', True],
         ['KojiWebURL', 'string', 'http://localhost.localdomain/koji'],
@@ -447,6 +888,11 @@ def load_config(environ):
         ['MissingPolicyOk', 'boolean', True],
         ['EnableMaven', 'boolean', False],
         ['EnableWin', 'boolean', False],
+        ['TaskScheduler', 'boolean', False],
+        ['TaskSchedulerInterval', 'integer', 1],
+        ['TaskSchedulerBatch', 'integer', 1000],
+        ['TaskEvents', 'boolean', False],
+        ['TaskEventsMaxWait', 'integer', 60],
 
         ['RLIMIT_AS', 'string', None],
         ['RLIMIT_CORE', 'string', None],
@@ -460,8 +906,17 @@ def load_config(environ):
         ['RLIMIT_RSS', 'string', None],
         ['RLIMIT_STACK', 'string', None],
 
+        ['InheritanceCacheSize', 'integer', 64],
+        ['InheritanceCacheMaxAge', 'integer', 3600],
+
         ['MemoryWarnThreshold', 'integer', 5000],
         ['MaxRequestLength', 'integer', 4194304],
+        ['ResponseChunkSize', 'integer', 65536],
+        ['ResponseCompressMinSize', 'integer', 4096],
+        ['ReadOnlyMultiCall', 'boolean', True],
+        ['UploadDedup', 'boolean', False],
+        ['UploadChunkSize', 'integer', 262144],
+        ['UploadPreallocate', 'boolean', False],
 
         ['LockOut', 'boolean', False],
         ['ServerOffline', 'boolean', False],
@@ -689,6 +1144,8 @@ def server_setup(environ):
         opts = load_config(environ)
         setup_logging2(opts)
         load_scripts(environ)
+        kojihub.inheritance_cache.configure(opts['InheritanceCacheSize'],
+                                            opts['InheritanceCacheMaxAge'])
         koji.util.setup_rlimits(opts)
         plugins = load_plugins(opts)
         registry = get_registry(opts, plugins)
@@ -701,6 +1158,14 @@ def server_setup(environ):
                                   password=opts.get("DBPass", None),
                                   host=opts.get("DBHost", None),
                                   port=opts.get("DBPort", None))
+        if opts['DBPoolMaxSize'] > 0:
+            koji.db.configurePool(min_size=min(opts['DBPoolMinSize'], opts['DBPoolMaxSize']),
+                                  max_size=opts['DBPoolMaxSize'],
+                                  max_age=opts['DBPoolMaxAge'],
+                                  max_idle=opts['DBPoolMaxIdle'],
+                                  timeout=opts['DBPoolTimeout'])
+        if opts['DBReplicaConnectionString']:
+            koji.db.provideReplicaDBopts(dsn=opts['DBReplicaConnectionString'])
     except Exception:
         tb_str = ''.join(traceback.format_exception(*sys.exc_info()))
         logger.error(tb_str)
@@ -726,6 +1191,10 @@ def application(environ, start_response):
             if firstcall:
                 server_setup(environ)
                 firstcall = False
+    # task output files may be downloaded with GET
+    if environ['REQUEST_METHOD'] in ('GET', 'HEAD') and \
+            'taskID=' in environ.get('QUERY_STRING', ''):
+        return handle_download(environ, start_response)
     # XMLRPC uses POST only. Reject anything else
     if environ['REQUEST_METHOD'] != 'POST':
         headers = [
@@ -745,12 +1214,14 @@ def application(environ, start_response):
     # XXX check request length
     # XXX most of this should be moved elsewhere
     if 1:
+        streaming = False
         try:
             start = time.time()
             memory_usage_at_start = get_memory_usage()
 
             context._threadclear()
             context.commit_pending = False
+            context.streamed_results = False
             context.opts = opts
             context.handlers = HandlerAccess(registry)
             context.environ = environ
@@ -760,47 +1231,141 @@ def application(environ, start_response):
             except Exception:
                 return offline_reply(start_response, msg="database outage")
             h = ModXMLRPCRequestHandler(registry)
+            h.use_json = koji.jsonplus.CONTENT_TYPE in environ.get('HTTP_ACCEPT', '')
             if environ.get('CONTENT_TYPE') == 'application/octet-stream':
-                response = h._wrap_handler(h.handle_upload, environ)
+                response, rest = h._wrap_handler(h.handle_upload, environ)
             else:
-                response = h._wrap_handler(h.handle_rpc, environ)
-            response = response.encode()
+                response, rest = h._wrap_handler(h.handle_rpc, environ)
             headers = [
-                ('Content-Length', str(len(response))),
-                ('Content-Type', "text/xml"),
+                ('Content-Type', h.content_type),
+                # encodings we accept for requests (RFC 7694)
+                ('Accept-Encoding', ', '.join(koji.compression.supported_encodings())),
             ]
+            encoding = None
+            if opts['ResponseCompressMinSize'] > 0:
+                encoding = koji.compression.choose_encoding(environ.get('HTTP_ACCEPT_ENCODING'))
+                headers.append(('Vary', 'Accept-Encoding'))
+            if rest is not None:
+                if encoding:
+                    headers.append(('Content-Encoding', encoding))
+                start_response('200 OK', headers)
+                # finished when the response is sent
+                streaming = True
+                return StreamedResponse(h, response, rest, start, memory_usage_at_start,
+                                        encoding=encoding)
+            size = raw_size = sum([len(chunk) for chunk in response])
+            if encoding and size >= opts['ResponseCompressMinSize']:
+                response = [koji.compression.compress(b''.join(response), encoding)]
+                size = len(response[0])
+                headers.append(('Content-Encoding', encoding))
+            else:
+                encoding = None
+            headers.append(('Content-Length', str(size)))
             start_response('200 OK', headers)
-            if h.traceback:
-                # rollback
-                context.cnx.rollback()
-            elif context.commit_pending:
-                # Currently there is not much data we can provide to the
-                # pre/postCommit callbacks. The handler can access context at
-                # least
-                koji.plugin.run_callbacks('preCommit')
-                context.cnx.commit()
-                koji.plugin.run_callbacks('postCommit')
-            memory_usage_at_end = get_memory_usage()
-            if memory_usage_at_end - memory_usage_at_start > opts['MemoryWarnThreshold']:
-                paramstr = repr(getattr(context, 'params', 'UNKNOWN'))
-                if len(paramstr) > 120:
-                    paramstr = paramstr[:117] + "..."
-                h.logger.warning(
-                    "Memory usage of process %d grew from %d KiB to %d KiB (+%d KiB) processing "
-                    "request %s with args %s" %
-                    (os.getpid(), memory_usage_at_start, memory_usage_at_end,
-                     memory_usage_at_end - memory_usage_at_start, context.method, paramstr))
-            h.logger.debug("Returning %d bytes after %f seconds", len(response),
-                           time.time() - start)
+            finish_request(h, size, start, memory_usage_at_start, encoding, raw_size)
         finally:
-            # make sure context gets cleaned up
-            if hasattr(context, 'cnx'):
-                try:
-                    context.cnx.close()
-                except Exception:
-                    pass
-            context._threadclear()
-        return [response]  # XXX
+            if not streaming:
+                cleanup_context()
+        return response
+
+
+def finish_request(h, size, start, memory_usage_at_start, encoding=None, raw_size=None):
+    """Commit or roll back the request and log its stats
+
+    size is the number of bytes sent, raw_size the size before compression
+    """
+    if h.traceback:
+        # rollback
+        context.cnx.rollback()
+    elif context.commit_pending:
+        # Currently there is not much data we can provide to the
+        # pre/postCommit callbacks. The handler can access context at
+        # least
+        koji.plugin.run_callbacks('preCommit')
+        context.cnx.commit()
+        koji.plugin.run_callbacks('postCommit')
+    memory_usage_at_end = get_memory_usage()
+    if memory_usage_at_end - memory_usage_at_start > context.opts['MemoryWarnThreshold']:
+        paramstr = repr(getattr(context, 'params', 'UNKNOWN'))
+        if len(paramstr) > 120:
+            paramstr = paramstr[:117] + "..."
+        h.logger.warning(
+            "Memory usage of process %d grew from %d KiB to %d KiB (+%d KiB) processing "
+            "request %s with args %s" %
+            (os.getpid(), memory_usage_at_start, memory_usage_at_end,
+             memory_usage_at_end - memory_usage_at_start, context.method, paramstr))
+    if encoding:
+        h.logger.debug("Returning %d bytes (%s, %d uncompressed) after %f seconds",
+                       size, encoding, raw_size, time.time() - start)
+    else:
+        h.logger.debug("Returning %d bytes after %f seconds", size, time.time() - start)
+
+
+def cleanup_context():
+    # make sure context gets cleaned up
+    if hasattr(context, 'cnx'):
+        try:
+            context.cnx.close()
+        except Exception:
+            pass
+    if getattr(context, 'replica', None):
+        try:
+            context.replica[0].close()
+        except Exception:
+            pass
+    context._threadclear()
+
+
+class StreamedResponse(object):
+    """WSGI iterable for responses which are marshalled while they are sent
+
+    The request is finished when the server closes the iterable. The WSGI
+    server reads the response in the thread that handles the request, so the
+    context is still ours.
+    """
+
+    def __init__(self, handler, head, rest, start, memory_usage_at_start, encoding=None):
+        self.handler = handler
+        self.head = head
+        self.rest = rest
+        self.start = start
+        self.memory_usage_at_start = memory_usage_at_start
+        self.encoding = encoding
+        self.size = 0
+        self.raw_size = 0
+        self.complete = False
+
+    def _raw_chunks(self):
+        for chunk in itertools.chain(self.head, self.rest):
+            self.raw_size += len(chunk)
+            yield chunk
+
+    def __iter__(self):
+        chunks = self._raw_chunks()
+        if self.encoding:
+            chunks = koji.compression.iter_compress(chunks, self.encoding)
+        try:
+            for chunk in chunks:
+                self.size += len(chunk)
+                yield chunk
+        except Exception:
+            # too late for a fault, the client gets an incomplete response
+            self.handler.traceback = True
+            self.handler._log_exception()
+        self.complete = True
+
+    def close(self):
+        try:
+            if self.complete:
+                finish_request(self.handler, self.size, self.start, self.memory_usage_at_start,
+                               self.encoding, self.raw_size)
+        finally:
+            # close open cursors while we still have the connection
+            try:
+                self.rest.close()
+            except Exception:
+                pass
+            cleanup_context()
 
 
 def get_registry(opts, plugins):
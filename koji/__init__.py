@@ -42,6 +42,7 @@ import socket
 import struct
 import sys
 import tempfile
+import threading
 import time
 import traceback
 import warnings
@@ -62,13 +63,15 @@ import requests
 import six
 import six.moves.configparser
 import six.moves.http_client
+import six.moves.queue
 import six.moves.urllib
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 from six.moves import range, zip
 
+from koji import compression, jsonplus
 from koji.tasks import parse_task_params
-from koji.xmlrpcplus import Fault, dumps, getparser, loads, xmlrpc_client
+from koji.xmlrpcplus import Fault, IterUnmarshaller, dumps, getparser, loads, xmlrpc_client
 from koji.util import deprecated
 from . import util
 from . import _version
@@ -290,6 +293,10 @@ PRIO_DEFAULT = 20
 # default timeouts
 DEFAULT_REQUEST_TIMEOUT = 60 * 60 * 12
 DEFAULT_AUTH_TIMEOUT = 60
+# limit of concurrent requests of a parallel multicall
+MULTICALL_MAX_WORKERS = 8
+# limit of concurrent chunks of a parallel upload
+UPLOAD_MAX_WORKERS = 8
 
 # BEGIN kojikamid dup #
 
@@ -1948,6 +1955,9 @@ def read_config(profile_name, user_config=None):
         'auth_timeout': DEFAULT_AUTH_TIMEOUT,
         'use_fast_upload': False,
         'upload_blocksize': 1048576,
+        'upload_workers': 1,
+        'upload_resume': False,
+        'upload_dedup': False,
         'poll_interval': 6,
         'principal': None,
         'keytab': None,
@@ -1960,6 +1970,8 @@ def read_config(profile_name, user_config=None):
         'pyver': None,
         'plugin_paths': None,
         'force_auth': False,
+        'compression': True,
+        'compress_min_size': 4096,
     }
 
     result = config_defaults.copy()
@@ -1996,12 +2008,14 @@ def read_config(profile_name, user_config=None):
             # not have a default value set in the option parser.
             if name in result:
                 if name in ('anon_retry', 'offline_retry', 'use_fast_upload',
-                            'debug', 'debug_xmlrpc', 'force_auth'):
+                            'upload_resume', 'upload_dedup', 'debug', 'debug_xmlrpc',
+                            'force_auth', 'compression'):
                     result[name] = config.getboolean(profile_name, name)
                 elif name in ('max_retries', 'retry_interval',
                               'offline_retry_interval', 'poll_interval',
                               'timeout', 'auth_timeout',
-                              'upload_blocksize', 'pyver'):
+                              'upload_blocksize', 'upload_workers', 'pyver',
+                              'compress_min_size'):
                     try:
                         result[name] = int(value)
                     except ValueError:
@@ -2391,8 +2405,14 @@ def grab_session_options(options):
         'auth_timeout',
         'use_fast_upload',
         'upload_blocksize',
+        'upload_workers',
+        'upload_resume',
+        'upload_dedup',
+        'lazy_session_update',
         'no_ssl_verify',
         'serverca',
+        'compression',
+        'compress_min_size',
     )
     # cert is omitted for now
     if isinstance(options, dict):
@@ -2429,6 +2449,12 @@ class ClientSession(object):
         self.rsession = None
         self.new_session()
         self.opts.setdefault('timeout', DEFAULT_REQUEST_TIMEOUT)
+        # set once the hub answers in json, see koji.jsonplus
+        self.json_transport = False
+        # set once the hub accepts compressed requests, see koji.compression
+        self.request_encoding = None
+        # cleared if the hub does not serve task output with GET requests
+        self.get_task_output = True
 
     @property
     def multicall(self):
@@ -2662,24 +2688,40 @@ class ClientSession(object):
         if self.logged_in:
             sinfo = self.sinfo.copy()
             sinfo['callnum'] = self.callnum
+            if self.opts.get('lazy_session_update'):
+                sinfo['lazy-update'] = '1'
             self.callnum += 1
             handler = "%s?%s" % (self.baseurl, six.moves.urllib.parse.urlencode(sinfo))
         elif name == 'sslLogin':
             handler = self.baseurl + '/ssllogin'
         else:
             handler = self.baseurl
-        request = dumps(args, name, allow_none=1)
-        if six.PY3:
-            # For python2, dumps() without encoding specified means return a str
-            # encoded as UTF-8. For python3 it means "return a str with an appropriate
-            # xml declaration for encoding as UTF-8".
-            request = request.encode('utf-8')
+        if self.json_transport:
+            request = jsonplus.dumps_request(name, args)
+            content_type = jsonplus.CONTENT_TYPE
+        else:
+            request = dumps(args, name, allow_none=1)
+            if six.PY3:
+                # For python2, dumps() without encoding specified means return a str
+                # encoded as UTF-8. For python3 it means "return a str with an appropriate
+                # xml declaration for encoding as UTF-8".
+                request = request.encode('utf-8')
+            content_type = 'text/xml'
         headers = [
             # connection class handles Host
             ('User-Agent', 'koji/1'),
-            ('Content-Type', 'text/xml'),
-            ('Content-Length', str(len(request))),
+            ('Content-Type', content_type),
         ]
+        if not self.opts.get('compression', True):
+            headers.append(('Accept-Encoding', 'identity'))
+        elif (self.request_encoding and
+                len(request) >= self.opts.get('compress_min_size', 4096)):
+            request = compression.compress(request, self.request_encoding)
+            headers.append(('Content-Encoding', self.request_encoding))
+        headers.append(('Content-Length', str(len(request))))
+        if self.opts.get('use_json', True):
+            # older hubs ignore this and answer in xmlrpc
+            headers.append(('Accept', '%s, text/xml' % jsonplus.CONTENT_TYPE))
         return handler, headers, request
 
     def _sendCall(self, handler, headers, request):
@@ -2694,28 +2736,22 @@ class ClientSession(object):
                 self.new_session()
 
     def _sendOneCall(self, handler, headers, request):
+        r = self._postCall(handler, headers, request)
+        try:
+            ret = self._read_xmlrpc_response(r)
+        finally:
+            r.close()
+        return ret
+
+    def _postCall(self, handler, headers, request):
+        """Post a call and return the (streamed) response"""
         headers = dict(headers)
         callopts = {
             'headers': headers,
             'data': request,
             'stream': True,
         }
-        verify = self.opts.get('serverca')
-        if verify:
-            callopts['verify'] = verify
-        elif self.opts.get('no_ssl_verify'):
-            callopts['verify'] = False
-            # XXX - not great, but this is the previous behavior
-        cert = self.opts.get('cert')
-        if cert:
-            # TODO: we really only need to do this for ssllogin calls
-            callopts['cert'] = cert
-        auth = self.opts.get('auth')
-        if auth:
-            callopts['auth'] = auth
-        timeout = self.opts.get('timeout')
-        if timeout:
-            callopts['timeout'] = timeout
+        self._addRequestOpts(callopts)
         if self.opts.get('debug_xmlrpc', False):
             self.logger.debug("url: %s" % handler)
             for _key in callopts:
@@ -2733,14 +2769,42 @@ class ClientSession(object):
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")
             r = self.rsession.post(handler, **callopts)
+        try:
             r.raise_for_status()
-            try:
-                ret = self._read_xmlrpc_response(r)
-            finally:
-                r.close()
-        return ret
+        except Exception:
+            r.close()
+            raise
+        if self.opts.get('compression', True):
+            # older hubs do not advertise any
+            self.request_encoding = compression.choose_encoding(r.headers.get('Accept-Encoding'))
+        return r
+
+    def _addRequestOpts(self, callopts):
+        """Add the ssl, auth and timeout options of a request"""
+        verify = self.opts.get('serverca')
+        if verify:
+            callopts['verify'] = verify
+        elif self.opts.get('no_ssl_verify'):
+            callopts['verify'] = False
+            # XXX - not great, but this is the previous behavior
+        cert = self.opts.get('cert')
+        if cert:
+            # TODO: we really only need to do this for ssllogin calls
+            callopts['cert'] = cert
+        auth = self.opts.get('auth')
+        if auth:
+            callopts['auth'] = auth
+        timeout = self.opts.get('timeout')
+        if timeout:
+            callopts['timeout'] = timeout
 
     def _read_xmlrpc_response(self, response):
+        if response.headers.get('Content-Type') == jsonplus.CONTENT_TYPE:
+            self.json_transport = True
+            data = b''.join(response.iter_content(65536))
+            if self.opts.get('debug_xmlrpc', False):
+                self.logger.debug("body: %r" % data)
+            return jsonplus.loads_response(data)
         p, u = getparser()
         for chunk in response.iter_content(8192):
             if self.opts.get('debug_xmlrpc', False):
@@ -2752,6 +2816,55 @@ class ClientSession(object):
             result = result[0]
         return result
 
+    def _iter_xmlrpc_response(self, response):
+        u = IterUnmarshaller()
+        p = xmlrpc_client.ExpatParser(u)
+        for chunk in response.iter_content(8192):
+            if self.opts.get('debug_xmlrpc', False):
+                self.logger.debug("body: %r" % chunk)
+            p.feed(chunk)
+            for item in u.items:
+                yield item
+            del u.items[:]
+        p.close()
+        u.close()
+        for item in u.items:
+            yield item
+
+    def iterMethod(self, name, *args, **kwargs):
+        """Make a call to the hub and iterate over the result as it arrives
+
+        Yields (path, item) pairs for the items of the returned list, while
+        the response is parsed. The path is empty for a plain list. Lists in
+        the result are streamed the same way, e.g. listTaggedRPMS yields
+        ((0,), rpm) and ((1,), build) pairs and queryHistory yields
+        ((table,), entry) pairs. See IterUnmarshaller for details.
+
+        Unlike other calls, these are not retried once the hub has answered.
+        """
+        if self.multicall:
+            raise GenericError('iterMethod cannot be used in a multicall')
+        handler, headers, request = self._prepCall(name, args, kwargs)
+        # the response is parsed as xmlrpc
+        headers = [h for h in headers if h[0] != 'Accept']
+        # handle expired connections
+        for i in (0, 1):
+            try:
+                r = self._postCall(handler, headers, request)
+                break
+            except Exception as e:
+                if i or not is_conn_error(e):
+                    raise
+                self.logger.debug("Connection Error: %s", e)
+                self.new_session()
+        try:
+            for item in self._iter_xmlrpc_response(r):
+                yield item
+        except Fault as fault:
+            raise convertFault(fault)
+        finally:
+            r.close()
+
     def _callMethod(self, name, args, kwargs=None, retry=True):
         """Make a call to the hub with retries and other niceties"""
 
@@ -2895,21 +3008,54 @@ class ClientSession(object):
         return VirtualMethod(self._callMethod, name, self)
 
     def fastUpload(self, localfile, path, name=None, callback=None, blocksize=None,
-                   overwrite=False, volume=None):
+                   overwrite=False, volume=None, workers=None, resume=None, dedup=None):
+        """Upload a file in chunks with rawUpload calls
+
+        With several workers (default: the upload_workers option), up to that
+        many chunks (at most UPLOAD_MAX_WORKERS) are sent at the same time,
+        each worker using its own subsession. This only happens when the hub
+        supports it. The whole file is verified afterwards in that case.
+
+        With resume (default: the upload_resume option), an earlier upload of
+        the file to the same place is continued. The blocks it got right are
+        kept and only the rest of the file is sent. An existing file at that
+        place is overwritten.
+
+        With dedup (default: the upload_dedup option), files of at least one
+        block are not sent if the hub already has the same content, it links
+        its copy into place instead. Uploaded files are then registered for
+        later uploads.
+        """
         if blocksize is None:
             blocksize = self.opts.get('upload_blocksize', 1048576)
+        if workers is None:
+            workers = self.opts.get('upload_workers', 1)
+        workers = min(workers, UPLOAD_MAX_WORKERS)
+        if resume is None:
+            resume = self.opts.get('upload_resume', False)
+        if dedup is None:
+            dedup = self.opts.get('upload_dedup', False)
 
         if not self.logged_in:
             raise ActionNotAllowed('You must be logged in to upload files')
         if name is None:
             name = os.path.basename(localfile)
         self.logger.debug("Fast upload: %s to %s/%s", localfile, path, name)
-        fo = open(localfile, 'rb')
-        ofs = 0
         size = os.path.getsize(localfile)
         start = time.time()
         if callback:
             callback(0, size, 0, 0, 0)
+        sha256 = None
+        if dedup and size >= blocksize:
+            sha256, linked = self._linkUpload(localfile, path, name, size,
+                                              overwrite or resume, volume)
+            if linked:
+                if callback:
+                    t2 = max(time.time() - start, 0.00001)
+                    callback(size, size, size, t2, t2)
+                return
+        fo = open(localfile, 'rb')
+        ofs = 0
         problems = False
         full_chksum = util.adler32_constructor()
         # cycle is need to run at least once (for empty files)
@@ -2917,30 +3063,63 @@ class ClientSession(object):
         callopts = {'overwrite': overwrite}
         if volume and volume != 'DEFAULT':
             callopts['volume'] = volume
+        if workers > 1:
+            callopts['parallel'] = True
+        first_opts = callopts
+        resumed = None
+        if resume:
+            resumed = self._resumeUpload(fo, path, name, blocksize, volume, full_chksum)
+        if resumed is not None:
+            # the existing file is our own partial upload
+            callopts['overwrite'] = True
+            ofs = resumed
+            # without the parallel option, the hub truncates the file after the
+            # first chunk we send
+            first_opts = dict(callopts, parallel=False)
+            problems = True
+            self.logger.debug("Resuming upload of %s at offset %i", localfile, ofs)
+            if callback:
+                callback(ofs, size, 0, 0, 0)
+        uploaded = [ofs]
+
+        def progress(length, lap):
+            uploaded[0] += length
+            now = time.time()
+            t1 = max(now - lap, 0.00001)
+            t2 = max(now - start, 0.00001)
+            # max is to prevent possible divide by zero in callback function
+            if callback:
+                callback(uploaded[0], size, length, t1, t2)
+            return t2
+
+        t2 = 0.0
         while True:
             lap = time.time()
             chunk = fo.read(blocksize)
             if not chunk and not first_cycle:
                 break
+            if first_cycle:
+                result = self._callMethod('rawUpload', (chunk, ofs, path, name), first_opts)
+                # a hub that can resume uploads also takes parallel chunks
+                parallel = result.get('parallel') or (resumed is not None and workers > 1)
+            else:
+                result = self._callMethod('rawUpload', (chunk, ofs, path, name), callopts)
             first_cycle = False
-            result = self._callMethod('rawUpload', (chunk, ofs, path, name), callopts)
             if self.retries > 1:
                 problems = True
-            hexdigest = util.adler32_constructor(chunk).hexdigest()
             full_chksum.update(chunk)
-            if result['size'] != len(chunk):
-                raise GenericError("server returned wrong chunk size: %s != %s" %
-                                   (result['size'], len(chunk)))
-            if result['hexdigest'] != hexdigest:
-                raise GenericError('upload checksum failed: %s != %s'
-                                   % (result['hexdigest'], hexdigest))
+            self._checkUploadChunk(result, chunk)
             ofs += len(chunk)
-            now = time.time()
-            t1 = max(now - lap, 0.00001)
-            t2 = max(now - start, 0.00001)
-            # max is to prevent possible divide by zero in callback function
-            if callback:
-                callback(ofs, size, len(chunk), t1, t2)
+            t2 = progress(len(chunk), lap)
+            if parallel and len(chunk) == blocksize:
+                # the hub accepts the remaining chunks in parallel
+                ofs = self._fastUploadParallel(fo, ofs, path, name, callopts, blocksize,
+                                               workers, full_chksum, progress)
+                # verify the whole file
+                problems = True
+                break
+        fo.close()
+        t2 = max(time.time() - start, t2)
         if ofs != size:
             self.logger.error("Local file changed size: %s, %s -> %s", localfile, size, ofs)
         chk_opts = {}
@@ -2957,16 +3136,194 @@ class ClientSession(object):
         if problems and result['hexdigest'] != full_chksum.hexdigest():
             raise GenericError("Uploaded file has wrong checksum: %s/%s, %s != %s"
                                % (path, name, result['hexdigest'], full_chksum.hexdigest()))
+        if sha256 is not None:
+            # for later uploads of the same content
+            opts = {}
+            if volume and volume != 'DEFAULT':
+                opts['volume'] = volume
+            self._callMethod('storeUpload', (path, name, sha256), opts)
         self.logger.debug("Fast upload: %s complete. %i bytes in %.1f seconds",
                           localfile, size, t2)
 
+    def _linkUpload(self, localfile, path, name, size, overwrite, volume):
+        """Ask the hub to link its copy of localfile into place
+
+        :returns: a tuple of the sha256 of the file (None if the hub cannot
+                  do this) and whether the file was linked
+        """
+        chksum = hashlib.sha256()
+        with open(localfile, 'rb') as fo:
+            while True:
+                chunk = fo.read(1048576)
+                if not chunk:
+                    break
+                chksum.update(chunk)
+        sha256 = chksum.hexdigest()
+        opts = {'overwrite': overwrite}
+        if volume and volume != 'DEFAULT':
+            opts['volume'] = volume
+        try:
+            linked = self._callMethod('linkUpload', (path, name, str(size), sha256), opts)
+        except GenericError as e:
+            if 'Invalid method' not in str(e):
+                raise
+            # older hubs do not have this call
+            self.logger.debug("Upload dedup not supported by hub: %s", e)
+            return None, False
+        if linked:
+            self.logger.debug("Linked %s from hub copy, %i bytes not uploaded", localfile, size)
+        return sha256, linked
+
+    def _resumeUpload(self, fo, path, name, blocksize, volume, full_chksum):
+        """Compare fo with an earlier upload of it
+
+        fo is read up to the first block that differs from the uploaded file
+        and full_chksum is updated with the data before it.
+
+        :returns: the offset to resume the upload at, or None if there is
+                  no earlier upload
+        """
+        opts = {'verify': 'sha256'}
+        if volume and volume != 'DEFAULT':
+            opts['volume'] = volume
+        try:
+            result = self._callMethod('checkUploadBlocks', (path, name, blocksize), opts)
+        except GenericError as e:
+            # older hubs do not have this call
+            self.logger.debug("Cannot resume upload of %s/%s: %s", path, name, e)
+            return None
+        if result is None:
+            return None
+        ofs = 0
+        for hexdigest in result['blocks']:
+            chunk = fo.read(blocksize)
+            if not chunk or hashlib.sha256(chunk).hexdigest() != hexdigest:
+                break
+            full_chksum.update(chunk)
+            ofs += len(chunk)
+        fo.seek(ofs)
+        return ofs
+
+    @staticmethod
+    def _checkUploadChunk(result, chunk):
+        hexdigest = util.adler32_constructor(chunk).hexdigest()
+        if result['size'] != len(chunk):
+            raise GenericError("server returned wrong chunk size: %s != %s" %
+                               (result['size'], len(chunk)))
+        if result['hexdigest'] != hexdigest:
+            raise GenericError('upload checksum failed: %s != %s'
+                               % (result['hexdigest'], hexdigest))
+
+    def _fastUploadParallel(self, fo, ofs, path, name, callopts, blocksize, workers,
+                            full_chksum, progress):
+        """Upload the rest of fo from ofs with several workers
+
+        The file is read in order (for the checksum of the whole file) and
+        the chunks are handed to the workers, at most one waiting chunk per
+        worker.
+
+        :returns: the final offset
+        """
+        queue = six.moves.queue.Queue(workers)
+        lock = threading.Lock()
+        errors = []
+
+        def worker(session):
+            while True:
+                item = queue.get()
+                if item is None:
+                    return
+                if errors:
+                    # just drain the queue
+                    continue
+                chunk_ofs, chunk = item
+                lap = time.time()
+                try:
+                    result = session._callMethod('rawUpload', (chunk, chunk_ofs, path, name),
+                                                 callopts)
+                    self._checkUploadChunk(result, chunk)
+                    with lock:
+                        # runs the callback, which may fail too
+                        progress(len(chunk), lap)
+                except Exception:
+                    errors.append(sys.exc_info())
+
+        def put(item):
+            # don't wait for workers which are gone
+            while True:
+                try:
+                    queue.put(item, timeout=1)
+                    return True
+                except six.moves.queue.Full:
+                    if item is not None and errors:
+                        return False
+                    if not [t for t in threads if t.is_alive()]:
+                        return False
+
+        self.logger.debug("Fast upload with %i workers", workers)
+        # we only read the file in the meantime, so we are the first worker
+        sessions = [self]
+        threads = []
+        try:
+            for n in range(workers - 1):
+                sessions.append(self._worker_session())
+            for session in sessions:
+                thread = threading.Thread(target=worker, args=(session,))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+            while not errors:
+                chunk = fo.read(blocksize)
+                if not chunk:
+                    break
+                full_chksum.update(chunk)
+                if not put((ofs, chunk)):
+                    if not errors:
+                        raise GenericError("Upload workers exited unexpectedly")
+                    break
+                ofs += len(chunk)
+        finally:
+            for thread in threads:
+                put(None)
+            for thread in threads:
+                thread.join()
+            for session in sessions[1:]:
+                session._close_worker()
+        if errors:
+            six.reraise(*errors[0])
+        return ofs
+
+    def _worker_session(self):
+        """Open another session for calls made in parallel
+
+        Calls of a session must arrive in sequence, so logged in sessions
+        get a subsession. Close it with _close_worker.
+        """
+        if self.logged_in:
+            worker = self.subsession()
+        else:
+            worker = type(self)(self.baseurl, self.opts)
+        # skip the negotiation
+        worker.json_transport = self.json_transport
+        worker.request_encoding = self.request_encoding
+        return worker
+
+    def _close_worker(self):
+        try:
+            self.logout()
+        except Exception:
+            pass
+        self.rsession.close()
+
     def _prepUpload(self, chunk, offset, path, name, verify="adler32", overwrite=False,
-                    volume=None):
+                    volume=None, parallel=False):
         """prep a rawUpload call"""
         if not self.logged_in:
             raise ActionNotAllowed("you must be logged in to upload")
         args = self.sinfo.copy()
         args['callnum'] = self.callnum
+        if self.opts.get('lazy_session_update'):
+            args['lazy-update'] = '1'
         args['filename'] = name
         args['filepath'] = path
         args['fileverify'] = verify
@@ -2975,6 +3332,8 @@ class ClientSession(object):
             args['overwrite'] = "1"
         if volume is not None:
             args['volume'] = volume
+        if parallel:
+            args['parallel'] = "1"
         size = len(chunk)
         self.callnum += 1
         handler = "%s?%s" % (self.baseurl, six.moves.urllib.parse.urlencode(args))
@@ -2992,13 +3351,14 @@ class ClientSession(object):
         return handler, headers, request
 
     def uploadWrapper(self, localfile, path, name=None, callback=None, blocksize=None,
-                      overwrite=True, volume=None):
+                      overwrite=True, volume=None, resume=None, dedup=None):
         """upload a file in chunks using the uploadFile call"""
         if blocksize is None:
             blocksize = self.opts.get('upload_blocksize', 1048576)
 
         if self.opts.get('use_fast_upload'):
-            self.fastUpload(localfile, path, name, callback, blocksize, overwrite, volume=volume)
+            self.fastUpload(localfile, path, name, callback, blocksize, overwrite, volume=volume,
+                            resume=resume, dedup=dedup)
             return
         if name is None:
             name = os.path.basename(localfile)
@@ -3015,7 +3375,8 @@ class ClientSession(object):
         except GenericError:
             pass
         else:
-            self.fastUpload(localfile, path, name, callback, blocksize, overwrite, volume=volume)
+            self.fastUpload(localfile, path, name, callback, blocksize, overwrite, volume=volume,
+                            resume=resume, dedup=dedup)
             return
 
         start = time.time()
@@ -3081,16 +3442,135 @@ class ClientSession(object):
         """Download the file with the given name, generated by the task with the
         given ID.
 
+        A negative offset is relative to the end of the file and a negative
+        size reads up to the end of the file.
+
         Note: This method does not work with multicall.
         """
         if self.multicall:
             raise GenericError('downloadTaskOutput() may not be called during a multicall')
+        if self.get_task_output:
+            chunks = self._getTaskOutput(taskID, fileName, offset, size, volume)
+            if chunks is not None:
+                return b''.join(chunks)
         dlopts = {'offset': offset, 'size': size}
         if volume and volume != 'DEFAULT':
             dlopts['volume'] = volume
         result = self.callMethod('downloadTaskOutput', taskID, fileName, **dlopts)
         return base64.b64decode(result)
 
+    def iterTaskOutput(self, taskID, fileName, offset=0, size=-1, volume=None,
+                       blocksize=1048576):
+        """Download a task output file, yielding its contents in blocks
+
+        The arguments are the same as for downloadTaskOutput. The file is
+        streamed by a single GET request. Hubs without support for that are
+        called to download each block.
+        """
+        if self.multicall:
+            raise GenericError('iterTaskOutput() may not be called during a multicall')
+        if offset < 0 and (size < 0 or size > -offset):
+            # up to the end of the file
+            size = -offset
+        if self.get_task_output:
+            chunks = self._getTaskOutput(taskID, fileName, offset, size, volume, blocksize)
+            if chunks is not None:
+                for data in chunks:
+                    yield data
+                return
+        dlopts = {}
+        if volume and volume != 'DEFAULT':
+            dlopts['volume'] = volume
+        while size != 0:
+            if size < 0:
+                length = blocksize
+            else:
+                length = min(size, blocksize)
+            result = self.callMethod('downloadTaskOutput', taskID, fileName,
+                                     offset=offset, size=length, **dlopts)
+            data = base64.b64decode(result)
+            if not data:
+                break
+            offset += len(data)
+            if size > 0:
+                size -= len(data)
+            yield data
+
+    def _getTaskOutput(self, taskID, fileName, offset, size, volume, blocksize=1048576):
+        """Request a task output file with a GET request
+
+        Returns an iterator over the contents, or None if the hub does not
+        support such requests
+        """
+        if size == 0:
+            return iter([])
+        args = {'taskID': taskID, 'filename': fileName}
+        if volume and volume != 'DEFAULT':
+            args['volume'] = volume
+        if self.logged_in:
+            # no callnum, downloads do not change anything
+            args.update(self.sinfo)
+            if self.opts.get('lazy_session_update'):
+                args['lazy-update'] = '1'
+        handler = "%s?%s" % (self.baseurl, six.moves.urllib.parse.urlencode(args))
+        headers = {'User-Agent': 'koji/1'}
+        if offset < 0:
+            headers['Range'] = 'bytes=%d' % offset
+        elif size > 0:
+            headers['Range'] = 'bytes=%d-%d' % (offset, offset + size - 1)
+        elif offset > 0:
+            headers['Range'] = 'bytes=%d-' % offset
+        callopts = {'headers': headers, 'stream': True}
+        self._addRequestOpts(callopts)
+        # handle expired connections
+        for i in (0, 1):
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    r = self.rsession.get(handler, **callopts)
+                break
+            except Exception as e:
+                if i or not is_conn_error(e):
+                    raise
+                self.logger.debug("Connection Error: %s", e)
+                self.new_session()
+        if r.status_code == 405:
+            # older hubs only accept calls
+            r.close()
+            self.get_task_output = False
+            return None
+        if r.status_code >= 400 and r.headers.get('Content-Type') == 'text/xml':
+            # the hub sends a fault
+            try:
+                self._read_xmlrpc_response(r)
+            except Fault as fault:
+                raise convertFault(fault)
+            finally:
+                r.close()
+        if r.status_code == 416:
+            # nothing at that offset
+            r.close()
+            return iter([])
+        try:
+            r.raise_for_status()
+        except Exception:
+            r.close()
+            raise
+        return self._iterResponse(r, size, blocksize)
+
+    def _iterResponse(self, response, size, blocksize):
+        """Iterate over the body of a response, up to size bytes if not negative"""
+        try:
+            for data in response.iter_content(blocksize):
+                if size >= 0:
+                    if len(data) >= size:
+                        yield data[:size]
+                        break
+                    size -= len(data)
+                yield data
+        finally:
+            response.close()
+
 
 class MultiCallHack(object):
     """Workaround of a terribly overloaded namespace
@@ -3153,10 +3633,11 @@ class MultiCallSession(object):
 
     """Manages a single multicall, acts like a session"""
 
-    def __init__(self, session, strict=False, batch=None):
+    def __init__(self, session, strict=False, batch=None, workers=None):
         self._session = session
         self._strict = strict
         self._batch = batch
+        self._workers = workers
         self._calls = []
 
     def __getattr__(self, name):
@@ -3175,25 +3656,37 @@ class MultiCallSession(object):
         """compatibility wrapper for _callMethod"""
         return self._callMethod(name, args, opts)
 
-    def call_all(self, strict=None, batch=None):
+    def call_all(self, strict=None, batch=None, workers=None):
         """Perform all calls in one or more multiCall batches
 
         Returns a list of results for each call. For successful calls, the
         entry will be a singleton list. For calls that raised a fault, the
         entry will be a dictionary with keys "faultCode", "faultString",
         and "traceback".
+
+        With workers, up to that many batches (at most MULTICALL_MAX_WORKERS)
+        are sent at the same time, each worker using its own connection and,
+        for logged in sessions, its own subsession. The batches are not run
+        in order, so this is only suitable for read-only calls. Without a
+        batch size, the calls are split evenly among the workers.
         """
 
         if strict is None:
             strict = self._strict
         if batch is None:
             batch = self._batch
+        if workers is None:
+            workers = self._workers
 
         if len(self._calls) == 0:
             return []
 
         calls = self._calls
         self._calls = []
+        if workers:
+            workers = min(workers, MULTICALL_MAX_WORKERS)
+            if not batch:
+                batch = (len(calls) + workers - 1) // workers
         if batch:
             self._session.logger.debug(
                 "MultiCall with batch size %i, calls/groups(%i/%i)",
@@ -3201,12 +3694,12 @@ class MultiCallSession(object):
             batches = [calls[i:i + batch] for i in range(0, len(calls), batch)]
         else:
             batches = [calls]
+        if workers and workers > 1 and len(batches) > 1:
+            batch_results = self._call_parallel(batches, min(workers, len(batches)))
+        else:
+            batch_results = [self._call_batch(self._session, calls) for calls in batches]
         results = []
-        for calls in batches:
-            args = ([c.format() for c in calls],)
-            _results = self._session._callMethod('multiCall', args, {})
-            for call, result in zip(calls, _results):
-                call._result = result
+        for _results in batch_results:
             results.extend(_results)
         if strict:
             # check for faults and raise first one
@@ -3217,6 +3710,52 @@ class MultiCallSession(object):
                     raise err
         return results
 
+    def _call_batch(self, session, calls):
+        args = ([c.format() for c in calls],)
+        _results = session._callMethod('multiCall', args, {})
+        for call, result in zip(calls, _results):
+            call._result = result
+        return _results
+
+    def _call_parallel(self, batches, workers):
+        """Run the batches in worker threads, return their results in order"""
+        queue = six.moves.queue.Queue()
+        for item in enumerate(batches):
+            queue.put(item)
+        results = [None] * len(batches)
+        errors = []
+
+        def worker(session):
+            while not errors:
+                try:
+                    i, calls = queue.get_nowait()
+                except six.moves.queue.Empty:
+                    return
+                try:
+                    results[i] = self._call_batch(session, calls)
+                except Exception:
+                    errors.append(sys.exc_info())
+
+        self._session.logger.debug("MultiCall with %i workers", workers)
+        # the session itself is idle in the meantime, so it is the first worker
+        sessions = [self._session]
+        try:
+            for n in range(workers - 1):
+                sessions.append(self._session._worker_session())
+            threads = [threading.Thread(target=worker, args=(session,))
+                       for session in sessions]
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            for session in sessions[1:]:
+                session._close_worker()
+        if errors:
+            six.reraise(*errors[0])
+        return results
+
     # alias for compatibility with ClientSession
     multiCall = call_all
 
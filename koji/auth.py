@@ -91,6 +91,16 @@ class Session(object):
             callnum = args['callnum'][0]
         except Exception:
             callnum = None
+        # Clients may ask for a lighter validation: the session row is not locked
+        # and update_time is refreshed at most every SessionUpdateInterval seconds,
+        # so most calls do not need to write and commit here.
+        try:
+            lazy = args['lazy-update'][0] == '1'
+        except Exception:
+            lazy = False
+        if lazy:
+            interval = context.opts.get('SessionUpdateInterval', 0)
+            lazy = interval > 0
         # lookup the session
         c = context.cnx.cursor()
         fields = {
@@ -112,8 +122,9 @@ class Session(object):
         WHERE id = %%(id)i
         AND key = %%(key)s
         AND hostip = %%(hostip)s
-        FOR UPDATE
         """ % ",".join(fields)
+        if not lazy:
+            q += "FOR UPDATE\n"
         c.execute(q, locals())
         row = c.fetchone()
         if not row:
@@ -186,15 +197,30 @@ class Session(object):
 
         # update timestamp
         q = """UPDATE sessions SET update_time=NOW() WHERE id = %(id)i"""
+        if lazy:
+            q += """ AND update_time < NOW() - %(interval)i * '1 second'::interval"""
         c.execute(q, locals())
-        # save update time
-        context.cnx.commit()
+        if not lazy or c.rowcount:
+            # save update time
+            context.cnx.commit()
 
         # update callnum (this is deliberately after the commit)
         # see earlier note near RetryError
         if callnum is not None:
             q = """UPDATE sessions SET callnum=%(callnum)i WHERE id = %(id)i"""
+            if lazy:
+                # Without the row lock, a concurrent call may have updated callnum
+                # since we checked it. This update waits for such call and then
+                # rechecks the sequence.
+                method = getattr(context, 'method', 'UNKNOWN')
+                if method in RetryWhitelist:
+                    q += """ AND (callnum IS NULL OR callnum <= %(callnum)i)"""
+                else:
+                    q += """ AND (callnum IS NULL OR callnum < %(callnum)i)"""
             c.execute(q, locals())
+            if lazy and not c.rowcount:
+                raise koji.SequenceError("callnum %d is out of sequence (session %d)"
+                                         % (callnum, id))
 
         # record the login data
         self.id = id
@@ -22,11 +22,14 @@
 
 from __future__ import absolute_import, division
 
+import ctypes
+import ctypes.util
 import errno
 import hashlib
 import logging
 import os
 import re
+import select
 import signal
 import subprocess
 import sys
@@ -51,20 +54,27 @@ from koji.util import (
 )
 
 
-def incremental_upload(session, fname, fd, path, retries=5, logger=None):
+def incremental_upload(session, fname, fd, path, retries=5, logger=None, blocksize=None):
+    """Upload the new content of a file that is still being written
+
+    The data is sent in blocks of blocksize bytes (default: the
+    upload_blocksize option of the session, or 64 KiB).
+    """
     if not fd:
         return
 
     if logger is None:
         logger = logging.getLogger('koji.daemon')
+    if blocksize is None:
+        blocksize = session.opts.get('upload_blocksize', 65536)
 
     if session.opts.get('use_fast_upload'):
-        fast_incremental_upload(session, fname, fd, path, retries, logger)
+        fast_incremental_upload(session, fname, fd, path, retries, logger, blocksize)
         return
 
     while True:
         offset = fd.tell()
-        contents = fd.read(65536)
+        contents = fd.read(blocksize)
         size = len(contents)
         if size == 0:
             break
@@ -87,12 +97,12 @@ def incremental_upload(session, fname, fd, path, retries=5, logger=None):
                 break
 
 
-def fast_incremental_upload(session, fname, fd, path, retries, logger):
+def fast_incremental_upload(session, fname, fd, path, retries, logger, blocksize=65536):
     """Like incremental_upload, but use the fast upload mechanism"""
 
     while True:
         offset = fd.tell()
-        contents = fd.read(65536)
+        contents = fd.read(blocksize)
         if not contents:
             break
         hexdigest = adler32_constructor(contents).hexdigest()
@@ -112,6 +122,167 @@ def fast_incremental_upload(session, fname, fd, path, retries, logger):
                 break
 
 
+class _Inotify(object):
+    """Minimal inotify binding, just enough to wait for changes"""
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path, mask=IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE):
+        if self._add_watch(self.fd, os.fsencode(path), mask) < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+
+    def drain(self):
+        """Discard the pending events"""
+        while True:
+            try:
+                if not os.read(self.fd, 65536):
+                    return
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LogTailer(object):
+    """Upload the logs of a running process as they are written
+
+    One tailer serves all the log files of a process. wait() blocks until a
+    watched directory changes or the process exits, using inotify and a
+    pidfd where available and polling every poll_interval seconds otherwise.
+
+    upload() sends new data right away if nothing was sent for that file in
+    the last max_delay seconds or if min_size bytes are pending. Otherwise
+    the data is sent once max_delay seconds have passed since the last
+    upload, so busy logs are sent at most once per max_delay, in blocks of
+    blocksize bytes.
+    """
+
+    def __init__(self, session, uploadpath, pid, logger=None, min_size=1048576, max_delay=1,
+                 blocksize=1048576, poll_interval=1):
+        self.session = session
+        self.uploadpath = uploadpath
+        self.pid = pid
+        self.logger = logger or logging.getLogger('koji.daemon')
+        self.min_size = min_size
+        self.max_delay = max_delay
+        self.blocksize = blocksize
+        self.poll_interval = poll_interval
+        self.status = None
+        self.last_upload = {}
+        self.pending = set()
+        self.unwatched = []
+        # the logs may have been written before we watched them
+        self.started = False
+        try:
+            self.inotify = _Inotify()
+        except (OSError, AttributeError) as e:
+            self.logger.debug("inotify not available: %s", e)
+            self.inotify = None
+        self.pidfd = None
+        if hasattr(os, 'pidfd_open'):
+            try:
+                self.pidfd = os.pidfd_open(pid)
+            except OSError as e:
+                self.logger.debug("pidfd not available: %s", e)
+
+    def watch(self, path):
+        """Wake up for changes of the files in this directory
+
+        The directory does not have to exist yet.
+        """
+        self.unwatched.append(path)
+        self._add_watches()
+
+    def _add_watches(self):
+        if self.inotify is None:
+            return
+        for path in self.unwatched[:]:
+            try:
+                self.inotify.add_watch(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            else:
+                self.unwatched.remove(path)
+
+    def wait(self):
+        """Wait for log changes or the exit of the process
+
+        :returns: True once the process has exited, its exit status is in
+                  the status attribute
+        """
+        fds = []
+        if self.pidfd is not None:
+            fds.append(self.pidfd)
+        timeout = None
+        if not self.started:
+            self.started = True
+            timeout = 0
+        elif self.pending:
+            # only the time matters until then
+            deadline = min(self.last_upload[name] for name in self.pending) + self.max_delay
+            timeout = max(deadline - time.time(), 0)
+        elif self.inotify is not None:
+            fds.append(self.inotify.fd)
+        if self.pidfd is None or self.inotify is None or self.unwatched:
+            if timeout is None or timeout > self.poll_interval:
+                timeout = self.poll_interval
+        if fds:
+            select.select(fds, [], [], timeout)
+        else:
+            time.sleep(timeout)
+        if self.inotify is not None:
+            self.inotify.drain()
+            self._add_watches()
+        pid, status = os.waitpid(self.pid, os.WNOHANG)
+        if pid != 0:
+            self.status = status
+            return True
+        return False
+
+    def upload(self, name, fd, final=False):
+        """Upload the new content of an open log file if it is time"""
+        if not fd:
+            return
+        available = os.fstat(fd.fileno()).st_size - fd.tell()
+        if available <= 0:
+            self.pending.discard(name)
+            return
+        now = time.time()
+        recent = now - self.last_upload.get(name, 0) < self.max_delay
+        if not final and available < self.min_size and recent:
+            self.pending.add(name)
+            return
+        incremental_upload(self.session, name, fd, self.uploadpath, logger=self.logger,
+                           blocksize=self.blocksize)
+        self.last_upload[name] = now
+        self.pending.discard(name)
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+        if self.pidfd is not None:
+            os.close(self.pidfd)
+            self.pidfd = None
+
+
 def log_output(session, path, args, outfile, uploadpath, cwd=None, logerror=0, append=0,
                chroot=None, env=None):
     """Run command with output redirected. If chroot is not None, chroot to the directory specified
@@ -159,26 +330,32 @@ def log_output(session, path, args, outfile, uploadpath, cwd=None, logerror=0, a
             outfile = os.path.normpath(chroot + outfile)
         outfd = None
         remotename = os.path.basename(outfile)
-        while True:
-            status = os.waitpid(pid, os.WNOHANG)
-            time.sleep(1)
+        tailer = LogTailer(session, uploadpath, pid)
+        try:
+            tailer.watch(os.path.dirname(outfile))
+            while True:
+                finished = tailer.wait()
 
-            if not outfd:
-                try:
-                    outfd = open(outfile, 'rb')
-                except IOError:
-                    # will happen if the forked process has not created the logfile yet
-                    continue
-                except Exception:
-                    print('Error reading log file: %s' % outfile)
-                    print(''.join(traceback.format_exception(*sys.exc_info())))
+                if not outfd:
+                    try:
+                        outfd = open(outfile, 'rb')
+                    except IOError:
+                        # will happen if the forked process has not created the logfile yet
+                        if finished:
+                            return tailer.status
+                        continue
+                    except Exception:
+                        print('Error reading log file: %s' % outfile)
+                        print(''.join(traceback.format_exception(*sys.exc_info())))
 
-            incremental_upload(session, remotename, outfd, uploadpath)
+                tailer.upload(remotename, outfd, final=finished)
 
-            if status[0] != 0:
-                if outfd:
-                    outfd.close()
-                return status[1]
+                if finished:
+                    if outfd:
+                        outfd.close()
+                    return tailer.status
+        finally:
+            tailer.close()
 
 
 # BEGIN kojikamid dup #
@@ -698,6 +875,12 @@ class TaskManager(object):
         self.ready = False
         self.hostdata = {}
         self.task_load = 0.0
+        # whether the hub supports host.waitForTaskEvents
+        self.task_events = True
+        # whether the hub supports host.getTask
+        self.task_claims = True
+        # tasks we claimed but could not take, by time of the host check
+        self.refused_tasks = {}
         self.host_id = self.session.host.getID()
         self.start_ts = self.session.getSessionInfo()['start_ts']
         self.logger = logging.getLogger("koji.TaskManager")
@@ -991,12 +1174,38 @@ class TaskManager(object):
                 else:
                     self.logger.info("Lingering task %r (pid %r)" % (id, pid))
 
+    def waitForEvents(self, timeout):
+        """Sleep until the hub reports relevant task changes or timeout passes
+
+        Falls back to plain sleeping when the hub does not support (or has not
+        enabled) task events.
+        """
+        if self.task_events:
+            try:
+                events = self.session.host.waitForTaskEvents(timeout)
+            except koji.GenericError as e:
+                if isinstance(e, koji.ActionNotAllowed) or 'Invalid method' in str(e):
+                    self.logger.warning("Task events are not available, polling instead: %s", e)
+                    self.task_events = False
+                else:
+                    self.logger.warning("Failed to wait for task events: %s", e)
+            except Exception:
+                self.logger.error(''.join(traceback.format_exception(*sys.exc_info())))
+            else:
+                self.logger.debug("Task events: %r", events)
+                return
+        time.sleep(timeout)
+
     def getNextTask(self):
         self.ready = self.readyForTask()
         self.session.host.updateHost(self.task_load, self.ready)
         if not self.ready:
             self.logger.info("Not ready for task")
             return False
+        if self.task_claims:
+            ret = self.claimTask()
+            if ret is not None:
+                return ret
         hosts, tasks = self.session.host.getLoadData()
         self.logger.debug("Load Data:")
         self.logger.debug("  hosts: %r" % hosts)
@@ -1069,6 +1278,52 @@ class TaskManager(object):
                 raise Exception("Invalid task state reported by server")
         return False
 
+    def claimTask(self):
+        """Let the hub choose and open the next task we can handle
+
+        The hub locks the candidate tasks with SKIP LOCKED, so this stays
+        fast however many tasks are waiting. Unlike the load data path, tasks
+        are not left for hosts with more available capacity.
+
+        Returns True if a task was started, False otherwise, or None if the
+        hub does not support host.getTask.
+        """
+        self.cleanRefusedTasks()
+        while True:
+            try:
+                # tasks freed or reassigned while we still run them can't be
+                # taken until updateTasks cleans up
+                exclude = set(self.tasks) | set(self.pids) | set(self.refused_tasks)
+                exclude = sorted(exclude)
+                data = self.session.host.getTask(methods=list(self.handlers), exclude=exclude)
+            except koji.GenericError as e:
+                if 'Invalid method' in str(e):
+                    self.logger.warning("Task claims are not available, using load data: %s",
+                                        e)
+                    self.task_claims = False
+                    return None
+                raise
+            if data is None:
+                self.logger.debug("No task to claim")
+                return False
+            self.logger.info("Claimed task %(id)s (%(method)s)", data)
+            params = koji.xmlrpcplus.loads(data['request'])[0]
+            handler = self.handlers[data['method']](data['id'], data['method'], params,
+                                                    self.session, self.options)
+            if self.checkHost(handler, data):
+                return self.startTask(handler, data)
+            # give it back and don't claim it again for a while
+            self.refused_tasks[data['id']] = time.time()
+            self.session.host.freeTasks([data['id']])
+
+    def cleanRefusedTasks(self):
+        """Remove old entries from refused_tasks"""
+        delay = getattr(self.options, 'task_avail_delay', 180)
+        cutoff = time.time() - delay * 10
+        for task_id in list(self.refused_tasks):
+            if self.refused_tasks[task_id] < cutoff:
+                del self.refused_tasks[task_id]
+
     def checkAvailDelay(self, task, bin_avail, our_avail):
         """Check to see if we should still delay taking a task
 
@@ -1383,6 +1638,16 @@ class TaskManager(object):
             return False
         params = task_info['request']
         handler = handlerClass(task_info['id'], method, params, self.session, self.options)
+        if not self.checkHost(handler, task):
+            return False
+        data = self.session.host.openTask(task['id'])
+        if data is None:
+            self.logger.warning("Could not open")
+            return False
+        return self.startTask(handler, data)
+
+    def checkHost(self, handler, task):
+        """Return whether the handler accepts this host for the task"""
         if hasattr(handler, 'checkHost'):
             try:
                 valid_host = handler.checkHost(self.hostdata)
@@ -1396,17 +1661,20 @@ class TaskManager(object):
                 self.logger.info(
                     'Skipping task %s (%s) due to host check', task['id'], task['method'])
                 return False
-        data = self.session.host.openTask(task['id'])
-        if data is None:
-            self.logger.warning("Could not open")
-            return False
+        return True
+
+    def startTask(self, handler, data):
+        """Run the handler of a task we have opened
+
+        Returns True if the task was started
+        """
         task_id = data['id']
         self.tasks[task_id] = data
         # set weight
         try:
             self.session.host.setTaskWeight(task_id, handler.weight())
         except koji.ActionNotAllowed:
-            info2 = self.session.getTaskInfo(task['id'])
+            info2 = self.session.getTaskInfo(task_id)
             if info2['host_id'] != self.host_id:
                 self.logger.warning("Task %i was reassigned", task_id)
                 return False
@@ -31,8 +31,11 @@ import logging
 # del psycopg2.extensions.string_types[1082]
 # del psycopg2.extensions.string_types[1083]
 # del psycopg2.extensions.string_types[1266]
+import collections
 import re
+import select
 import sys
+import threading
 import time
 import traceback
 
@@ -54,11 +57,17 @@ _DBopts = None
 # since Apache is not using threading,
 # but play it safe anyway.
 _DBconn = context.ThreadLocal()
+# Optional connection pool shared by all threads, see configurePool()
+_DBpool = None
+# Optional read-only replica, see provideReplicaDBopts()
+_DBreplica_opts = None
+_DBreplica_conn = context.ThreadLocal()
 
 
 class DBWrapper:
-    def __init__(self, cnx):
+    def __init__(self, cnx, pool=None):
         self.cnx = cnx
+        self.pool = pool
 
     def __getattr__(self, key):
         if not self.cnx:
@@ -75,10 +84,17 @@ class DBWrapper:
         # this DBWrapper is no longer usable after close()
         if not self.cnx:
             raise Exception('connection is closed')
-        self.cnx.cursor().execute('ROLLBACK')
-        # We do this rather than cnx.rollback to avoid opening a new transaction
-        # If our connection gets recycled cnx.rollback will be called then.
-        self.cnx = None
+        cnx, self.cnx = self.cnx, None
+        try:
+            cnx.cursor().execute('ROLLBACK')
+            # We do this rather than cnx.rollback to avoid opening a new transaction
+            # If our connection gets recycled cnx.rollback will be called then.
+        except Exception:
+            if self.pool:
+                self.pool.checkin(cnx, broken=True)
+            raise
+        if self.pool:
+            self.pool.checkin(cnx)
 
 
 class CursorWrapper:
@@ -148,6 +164,242 @@ class CursorWrapper:
         return ret
 
 
+class ConnectionPool(object):
+    """A pool of database connections shared by the threads of a process
+
+    :param int min_size: number of idle connections that are kept open even
+                         if they are not used for max_idle seconds
+    :param int max_size: maximum number of open connections, further checkouts
+                         wait for a connection to be returned
+    :param int max_age: connections older than this (seconds) are replaced
+    :param int max_idle: idle connections (above min_size) are closed after
+                         this many seconds
+    :param int timeout: how long a checkout waits for a free connection
+    """
+
+    def __init__(self, min_size=0, max_size=10, max_age=3600, max_idle=300, timeout=30):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError('Invalid pool size: min=%r, max=%r' % (min_size, max_size))
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_age = max_age
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.logger = logging.getLogger('koji.db.pool')
+        self.cond = threading.Condition()
+        # idle connections: [(conn, create_time, checkin_time), ...] most recent last
+        self.idle = []
+        # create_time of checked out connections, by id
+        self.busy = {}
+        # connections being created
+        self.connecting = 0
+        self.stats = dict.fromkeys(['checkouts', 'waits', 'timeouts', 'created', 'closed',
+                                    'failed_checks'], 0)
+
+    def _size(self):
+        return len(self.idle) + len(self.busy) + self.connecting
+
+    def _close(self, conn):
+        self.stats['closed'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _reap(self, now):
+        """Close idle connections that are too old or unused for too long"""
+        size = self._size()
+        keep = []
+        # least recently used first
+        for entry in self.idle:
+            conn, created, used = entry
+            if now - created > self.max_age or \
+                    (now - used > self.max_idle and size > self.min_size):
+                self._close(conn)
+                size -= 1
+            else:
+                keep.append(entry)
+        self.idle = keep
+
+    def checkout(self):
+        """Return a healthy connection, waiting for one if the pool is exhausted"""
+        deadline = time.time() + self.timeout
+        waited = False
+        while True:
+            with self.cond:
+                now = time.time()
+                self._reap(now)
+                if self.idle:
+                    conn, created, used = self.idle.pop()
+                    self.busy[id(conn)] = created
+                elif self._size() < self.max_size:
+                    conn = None
+                    # reserve the slot while we connect
+                    self.connecting += 1
+                else:
+                    if not waited:
+                        self.stats['waits'] += 1
+                        waited = True
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self.stats['timeouts'] += 1
+                        raise Exception('timed out waiting for a database connection')
+                    self.cond.wait(remaining)
+                    continue
+            if conn is None:
+                try:
+                    conn = _connect()
+                except Exception:
+                    with self.cond:
+                        self.connecting -= 1
+                        self.cond.notify()
+                    raise
+                with self.cond:
+                    self.connecting -= 1
+                    self.busy[id(conn)] = time.time()
+                    self.stats['created'] += 1
+                    self.stats['checkouts'] += 1
+                return conn
+            if _check_connection(conn):
+                with self.cond:
+                    self.stats['checkouts'] += 1
+                return conn
+            # broken connection, discard and try again
+            self.logger.warning('Discarding broken database connection')
+            with self.cond:
+                self.stats['failed_checks'] += 1
+                self.busy.pop(id(conn), None)
+                self._close(conn)
+
+    def checkin(self, conn, broken=False):
+        """Return a connection obtained via checkout()"""
+        with self.cond:
+            created = self.busy.pop(id(conn), None)
+            now = time.time()
+            if created is None:
+                # not ours (pool was reconfigured)
+                self._close(conn)
+            elif broken or conn.closed or now - created > self.max_age:
+                self._close(conn)
+            else:
+                self.idle.append((conn, created, now))
+            self._reap(now)
+            self.cond.notify()
+
+    def close(self):
+        """Close all idle connections"""
+        with self.cond:
+            for conn, created, used in self.idle:
+                self._close(conn)
+            self.idle = []
+
+    def getStats(self):
+        with self.cond:
+            stats = self.stats.copy()
+            stats['idle'] = len(self.idle)
+            stats['busy'] = len(self.busy)
+            stats['min_size'] = self.min_size
+            stats['max_size'] = self.max_size
+        return stats
+
+
+class NotifyListener(object):
+    """Receive NOTIFY messages of a channel in a background thread
+
+    Received payloads are numbered and kept in a short backlog, so that
+    threads can wait for messages newer than a position they took before
+    checking the database state. A None payload means messages might have
+    been lost (e.g. the connection was reset) and waiters have to recheck.
+
+    :param str channel: the channel to LISTEN on
+    :param int backlog: how many messages are kept
+    :param int retry: delay before reconnecting after an error (seconds)
+    """
+
+    def __init__(self, channel, backlog=1000, retry=5):
+        self.channel = channel
+        self.retry = retry
+        self.logger = logging.getLogger('koji.db.listener')
+        self.cond = threading.Condition()
+        # [(seq, payload), ...]
+        self.messages = collections.deque(maxlen=backlog)
+        self.seq = 0
+        self.thread = None
+
+    def start(self):
+        """Start the listening thread, unless it is running already"""
+        with self.cond:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run,
+                                               name='listen-%s' % self.channel)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def position(self):
+        """Return the number of the last received message"""
+        with self.cond:
+            return self.seq
+
+    def _add(self, payloads):
+        with self.cond:
+            for payload in payloads:
+                self.seq += 1
+                self.messages.append((self.seq, payload))
+            self.cond.notify_all()
+
+    def _run(self):
+        while True:
+            conn = None
+            try:
+                conn = _connect()
+                conn.autocommit = True
+                conn.cursor().execute('LISTEN %s' % self.channel)
+                # anything before this point was missed
+                self._add([None])
+                while True:
+                    select.select([conn], [], [], 60)
+                    conn.poll()
+                    payloads = []
+                    while conn.notifies:
+                        payloads.append(conn.notifies.pop(0).payload)
+                    if payloads:
+                        self._add(payloads)
+            except Exception:
+                self.logger.error('Listening on %s failed, retrying in %is',
+                                  self.channel, self.retry, exc_info=True)
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                time.sleep(self.retry)
+
+    def wait(self, since, timeout, match=None):
+        """Wait for messages received after position since
+
+        :param int since: position as returned by position()
+        :param float timeout: how long to wait (seconds)
+        :param match: function deciding which payloads to return, messages
+                      not matching are skipped (None payloads always match)
+        :returns: list of payloads, empty on timeout
+        """
+        deadline = time.time() + timeout
+        with self.cond:
+            while True:
+                if self.messages and self.messages[0][0] > since + 1:
+                    # overflow, we missed some
+                    return [None]
+                ret = [p for seq, p in self.messages
+                       if seq > since and (p is None or match is None or match(p))]
+                if ret:
+                    return ret
+                since = self.seq
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return []
+                self.cond.wait(remaining)
+
+
 ## Functions ##
 def provideDBopts(**opts):
     global _DBopts
@@ -164,27 +416,93 @@ def getDBopts():
     return _DBopts
 
 
+def configurePool(**kwargs):
+    """Share a pool of connections between threads instead of one per thread
+
+    The keyword arguments are passed to ConnectionPool. Without arguments,
+    the pool is disabled.
+    """
+    global _DBpool
+    old, _DBpool = _DBpool, None
+    if old:
+        old.close()
+    if kwargs:
+        _DBpool = ConnectionPool(**kwargs)
+
+
+def getPoolStats():
+    """Return statistics of the connection pool, None if not configured"""
+    if _DBpool is None:
+        return None
+    return _DBpool.getStats()
+
+
+def _check_connection(conn):
+    """Make sure the connection is usable and the previous transaction is closed"""
+    try:
+        # Under normal circumstances, the last use of this connection
+        # will have issued a raw ROLLBACK to close the transaction. To
+        # avoid 'no transaction in progress' warnings (depending on postgres
+        # configuration) we open a new one here.
+        # Should there somehow be a transaction in progress, a second
+        # BEGIN will be a harmless no-op, though there may be a warning.
+        conn.cursor().execute('BEGIN')
+        conn.rollback()
+    except psycopg2.Error:
+        return False
+    return True
+
+
+def provideReplicaDBopts(**opts):
+    """Set the connection options of a read-only replica (hot standby)
+
+    Without options, the replica is not used.
+    """
+    global _DBreplica_opts
+    opts = dict([i for i in opts.items() if i[1] is not None])
+    _DBreplica_opts = opts or None
+
+
 def connect():
-    logger = logging.getLogger('koji.db')
     global _DBconn
-    if hasattr(_DBconn, 'conn'):
+    if _DBpool is not None:
+        return DBWrapper(_DBpool.checkout(), _DBpool)
+    return _thread_connect(_DBconn, _DBopts)
+
+
+def connectReplica():
+    """Connect to the read-only replica, None if no replica is configured
+
+    Like in connect(), each thread keeps its own connection.
+    """
+    if _DBreplica_opts is None:
+        return None
+    return _thread_connect(_DBreplica_conn, _DBreplica_opts, readonly=True)
+
+
+def _thread_connect(local, opts, readonly=False):
+    if hasattr(local, 'conn'):
         # Make sure the previous transaction has been
         # closed.  This is safe to call multiple times.
-        conn = _DBconn.conn
-        try:
-            # Under normal circumstances, the last use of this connection
-            # will have issued a raw ROLLBACK to close the transaction. To
-            # avoid 'no transaction in progress' warnings (depending on postgres
-            # configuration) we open a new one here.
-            # Should there somehow be a transaction in progress, a second
-            # BEGIN will be a harmless no-op, though there may be a warning.
-            conn.cursor().execute('BEGIN')
-            conn.rollback()
+        conn = local.conn
+        if _check_connection(conn):
             return DBWrapper(conn)
-        except psycopg2.Error:
-            del _DBconn.conn
-    # create a fresh connection
-    opts = _DBopts
+        del local.conn
+    conn = _connect(opts)
+    if readonly:
+        conn.set_session(readonly=True)
+    # XXX test
+    # return conn
+    local.conn = conn
+
+    return DBWrapper(conn)
+
+
+def _connect(opts=None):
+    """Create a fresh connection, by default to the main database"""
+    logger = logging.getLogger('koji.db')
+    if opts is None:
+        opts = _DBopts
     if opts is None:
         opts = {}
     try:
@@ -196,8 +514,4 @@ def connect():
     except Exception:
         logger.error(''.join(traceback.format_exception(*sys.exc_info())))
         raise
-    # XXX test
-    # return conn
-    _DBconn.conn = conn
-
-    return DBWrapper(conn)
+    return conn
@@ -175,6 +175,16 @@ def export_in(module, alias=None):
     return dec
 
 
+def readonly(f):
+    """a decorator that marks an exported function as read-only
+
+    the hub may serve calls of such functions from a read-only replica
+    of the database, so the function must never write to the database
+    """
+    setattr(f, 'readonly', True)
+    return f
+
+
 def callback(*cbtypes):
     """A decorator that indicates a function is a callback.
     cbtypes is a list of callback types to register for.  Valid
@@ -0,0 +1,63 @@
+"""Central task scheduling
+
+By default, each builder looks at the task queue itself and competes for the
+tasks it can handle (see TaskManager.getNextTask). With the TaskScheduler hub
+option, the hub assigns the tasks instead and builders just pick up the tasks
+assigned to them. This module holds the assignment logic, which works on plain
+data so it can also be used for simulations.
+"""
+
+from __future__ import absolute_import
+
+import logging
+
+logger = logging.getLogger('koji.scheduler')
+
+
+def host_bins(host):
+    """Return the channel:arch bins a host can handle
+
+    This matches the bins used by TaskManager.getNextTask
+    """
+    bins = set()
+    for chan in host['channels']:
+        for arch in host['arches'].split() + ['noarch']:
+            bins.add("%s:%s" % (chan, arch))
+    return bins
+
+
+def assign_tasks(hosts, tasks):
+    """Compute task assignments
+
+    Tasks are handled in the given (priority) order. Each task goes to the
+    host with the most available capacity among the hosts that can handle
+    its channel and arch, as long as that host is below its capacity.
+
+    :param list hosts: ready hosts as returned by get_ready_hosts(). The
+                       task_load should include the weight of tasks that are
+                       already assigned but not yet opened.
+    :param list tasks: free tasks (id, channel_id, arch, weight)
+    :returns: list of (task_id, host_id) pairs
+    """
+    load = {}
+    bin_hosts = {}
+    for host in hosts:
+        load[host['id']] = host['task_load']
+        for bin in host_bins(host):
+            bin_hosts.setdefault(bin, []).append(host)
+    ret = []
+    for task in tasks:
+        bin = "%(channel_id)s:%(arch)s" % task
+        best = None
+        best_avail = 0.0
+        for host in bin_hosts.get(bin, []):
+            avail = host['capacity'] - load[host['id']]
+            if avail > best_avail:
+                best = host
+                best_avail = avail
+        if best is None:
+            logger.debug("No capacity for task %(id)s (bin %(bin)s)", dict(task, bin=bin))
+            continue
+        load[best['id']] += task['weight']
+        ret.append((task['id'], best['id']))
+    return ret
@@ -458,18 +458,22 @@ class BaseTaskHandler(object):
     def getUploadDir(self):
         return koji.pathinfo.taskrelpath(self.id)
 
-    def uploadFile(self, filename, relPath=None, remoteName=None, volume=None):
+    def uploadFile(self, filename, relPath=None, remoteName=None, volume=None, dedup=None):
         """Upload the file with the given name to the task output directory
-        on the hub."""
+        on the hub.
+
+        With dedup (default: the upload_dedup option), the hub links its own
+        copy of the file into place if it has one."""
         uploadPath = self.getUploadDir()
         if relPath:
             relPath = relPath.strip('/')
             uploadPath += '/' + relPath
         # Only upload files with content
         if os.path.isfile(filename) and os.stat(filename).st_size > 0:
-            self.session.uploadWrapper(filename, uploadPath, remoteName, volume=volume)
+            self.session.uploadWrapper(filename, uploadPath, remoteName, volume=volume,
+                                       dedup=dedup)
 
-    def uploadTree(self, dirpath, flatten=False, volume=None):
+    def uploadTree(self, dirpath, flatten=False, volume=None, dedup=None):
         """Upload the directory tree at dirpath to the task directory on the
         hub, preserving the directory structure"""
         dirpath = dirpath.rstrip('/')
@@ -479,7 +483,8 @@ class BaseTaskHandler(object):
             else:
                 relpath = path[len(dirpath) + 1:]
             for filename in files:
-                self.uploadFile(os.path.join(path, filename), relpath, volume=volume)
+                self.uploadFile(os.path.join(path, filename), relpath, volume=volume,
+                                dedup=dedup)
 
     def chownTree(self, dirpath, uid, gid):
         """chown the given path and all files and directories under
@@ -14,6 +14,7 @@ getparser = xmlrpc_client.getparser
 loads = xmlrpc_client.loads
 Fault = xmlrpc_client.Fault
 DateTime = xmlrpc_client.DateTime
+Unmarshaller = xmlrpc_client.Unmarshaller
 
 
 class ExtendedMarshaller(xmlrpc_client.Marshaller):
@@ -25,7 +26,16 @@ class ExtendedMarshaller(xmlrpc_client.Marshaller):
         f = self.dispatch[type(value)]
         f(self, value, write)
 
+    # set by iterdumps
+    defer_generators = False
+    deferred = 0
+
     def dump_generator(self, value, write):
+        if self.defer_generators:
+            # the items are marshalled when the output is read
+            self.deferred += 1
+            write(value)
+            return
         dump = self._dump
         write("<value><array><data>\n")
         for v in value:
@@ -111,3 +121,165 @@ def dumps(params, methodname=None, methodresponse=None, encoding=None,
     else:
         return data  # return as is
     return ''.join(parts)
+
+
+def _iterdump(marshaller, out):
+    """Expand the deferred generators in marshalled output
+
+    Yields the output strings, marshalling the generator items one by one
+    """
+    for part in out:
+        if not isinstance(part, types.GeneratorType):
+            yield part
+            continue
+        yield "<value><array><data>\n"
+        for item in part:
+            deferred = marshaller.deferred
+            data = []
+            marshaller._dump(item, data.append)
+            if marshaller.deferred == deferred:
+                yield ''.join(data)
+            else:
+                for data in _iterdump(marshaller, data):
+                    yield data
+        yield "</data></array></value>\n"
+
+
+def iterdumps(params, encoding=None, marshaller=None, chunksize=65536):
+    """encode an xmlrpc response incrementally
+
+    Returns an iterator of encoded chunks of roughly chunksize bytes, which
+    join to the same data as dumps(params, methodresponse=1) encoded.
+    Generators in the params are only consumed as the chunks are read, so
+    large results never have to be marshalled as a whole.
+    """
+    if not encoding:
+        encoding = "utf-8"
+    if isinstance(params, Fault):
+        yield dumps(params, encoding=encoding, marshaller=marshaller).encode(encoding)
+        return
+    elif not isinstance(params, tuple):
+        raise TypeError('params must be a tuple or Fault instance')
+    elif len(params) != 1:
+        raise ValueError('response tuple must be a singleton')
+
+    if marshaller is not None:
+        m = marshaller(encoding, allow_none=True)
+    else:
+        m = ExtendedMarshaller(encoding, allow_none=True)
+    m.defer_generators = True
+
+    if encoding != "utf-8":
+        xmlheader = "<?xml version='1.0' encoding='%s'?>\n" % str(encoding)
+    else:
+        xmlheader = "<?xml version='1.0'?>\n"  # utf-8 is default
+
+    buf = [xmlheader, "<methodResponse>\n<params>\n<param>\n"]
+    size = 0
+    out = []
+    m._dump(params[0], out.append)
+    for data in _iterdump(m, out):
+        buf.append(data)
+        size += len(data)
+        if size >= chunksize:
+            yield ''.join(buf).encode(encoding)
+            buf = []
+            size = 0
+    buf.append("</param>\n</params>\n</methodResponse>\n")
+    yield ''.join(buf).encode(encoding)
+
+
+class _Container(object):
+    """An array or struct being parsed by IterUnmarshaller"""
+
+    def __init__(self, tag, path, streamed):
+        self.tag = tag
+        self.path = path
+        self.streamed = streamed
+        self.count = 0
+
+
+class IterUnmarshaller(Unmarshaller):
+    """Unmarshal an XML-RPC response while it is parsed
+
+    The arrays and structs in the result are not built. Instead, the items
+    of the arrays are added to the items list as (path, item) pairs as soon
+    as they are parsed, where path holds the indices and keys which lead to
+    the array. Items which are arrays are streamed the same way, other
+    items (e.g. structs) are returned whole. Members of streamed structs
+    which are not arrays or structs come with their key at the end of the
+    path. A scalar result comes as ((), value).
+    """
+
+    dispatch = Unmarshaller.dispatch.copy()
+
+    def __init__(self, *args, **kwargs):
+        Unmarshaller.__init__(self, *args, **kwargs)
+        self.items = []
+        self._containers = []
+        self._fault = False
+
+    def start(self, tag, attrs):
+        if tag == 'fault':
+            self._fault = True
+        elif tag in ('array', 'struct'):
+            if not self._containers:
+                # the result, unless this is a fault
+                container = _Container(tag, (), not self._fault)
+            else:
+                parent = self._containers[-1]
+                if not parent.streamed:
+                    container = _Container(tag, None, False)
+                elif parent.tag == 'struct':
+                    # the member name is on the stack
+                    container = _Container(tag, parent.path + (self._stack[-1],), True)
+                elif tag == 'array':
+                    container = _Container(tag, parent.path + (parent.count,), True)
+                else:
+                    container = _Container(tag, None, False)
+            self._containers.append(container)
+        Unmarshaller.start(self, tag, attrs)
+
+    def _end_container(self, data):
+        container = self._containers.pop()
+        if not container.streamed:
+            if container.tag == 'array':
+                Unmarshaller.end_array(self, data)
+            else:
+                Unmarshaller.end_struct(self, data)
+            return
+        mark = self._marks.pop()
+        del self._stack[mark:]
+        self._stack.append(container)
+        self._value = 0
+    dispatch['array'] = _end_container
+    dispatch['struct'] = _end_container
+
+    def _end_value(self, data):
+        Unmarshaller.end_value(self, data)
+        if not self._stack:
+            return
+        if not self._containers:
+            # the result
+            if not self._fault and not isinstance(self._stack[-1], _Container):
+                self.items.append(((), self._stack.pop()))
+            return
+        parent = self._containers[-1]
+        if not parent.streamed:
+            return
+        value = self._stack.pop()
+        if parent.tag == 'array':
+            if not isinstance(value, _Container):
+                self.items.append((parent.path, value))
+            parent.count += 1
+        else:
+            key = self._stack.pop()
+            if not isinstance(value, _Container):
+                self.items.append((parent.path + (key,), value))
+    dispatch['value'] = _end_value
+
+    def close(self):
+        if self._type is None or self._marks:
+            raise xmlrpc_client.ResponseError()
+        if self._type == "fault":
+            raise Fault(**self._stack[0])
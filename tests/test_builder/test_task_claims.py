@@ -0,0 +1,96 @@
+from __future__ import absolute_import
+import mock
+import unittest
+
+import koji.daemon
+import koji
+
+
+class TestTaskClaims(unittest.TestCase):
+
+    def setUp(self):
+        self.options = mock.MagicMock()
+        self.options.task_avail_delay = 180
+        self.session = mock.MagicMock()
+        self.tm = koji.daemon.TaskManager(self.options, self.session)
+        self.tm.readyForTask = mock.MagicMock(return_value=True)
+        self.tm.startTask = mock.MagicMock(return_value=True)
+        self.tm.takeTask = mock.MagicMock(return_value=True)
+        self.handler = mock.MagicMock()
+        del self.handler.return_value.checkHost
+        self.tm.handlers = {'build': self.handler, 'newRepo': mock.MagicMock()}
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def task(self, task_id):
+        request = koji.xmlrpcplus.dumps(('pkg.src.rpm', 'f40'), methodname='build')
+        return {'id': task_id, 'method': 'build', 'request': request}
+
+    def test_claim(self):
+        data = self.task(10)
+        self.session.host.getTask.return_value = data
+        self.assertTrue(self.tm.getNextTask())
+        self.session.host.getTask.assert_called_once_with(methods=['build', 'newRepo'],
+                                                          exclude=[])
+        self.handler.assert_called_once_with(10, 'build', ('pkg.src.rpm', 'f40'),
+                                             self.session, self.options)
+        self.tm.startTask.assert_called_once_with(self.handler.return_value, data)
+        # the hub opened the task
+        self.session.host.openTask.assert_not_called()
+        self.session.host.getLoadData.assert_not_called()
+
+    def test_no_task(self):
+        self.session.host.getTask.return_value = None
+        self.assertFalse(self.tm.getNextTask())
+        self.tm.startTask.assert_not_called()
+        self.session.host.getLoadData.assert_not_called()
+
+    def test_host_check(self):
+        self.handler.return_value.checkHost = mock.MagicMock(side_effect=[False, True])
+        self.session.host.getTask.side_effect = [self.task(10), self.task(11)]
+        self.assertTrue(self.tm.getNextTask())
+        self.session.host.freeTasks.assert_called_once_with([10])
+        self.assertEqual(self.session.host.getTask.call_args[1]['exclude'], [10])
+        self.assertEqual(self.tm.startTask.call_args[0][1]['id'], 11)
+        # not claimed again until it expires
+        with mock.patch('time.time', return_value=self.tm.refused_tasks[10] + 1801):
+            self.session.host.getTask.side_effect = None
+            self.session.host.getTask.return_value = None
+            self.tm.getNextTask()
+        self.assertEqual(self.session.host.getTask.call_args[1]['exclude'], [])
+
+    def test_running(self):
+        # e.g. freed by the hub while the handler still runs here
+        self.tm.tasks = {7: {'id': 7}}
+        # no longer open to us, but the process did not exit yet
+        self.tm.pids = {7: 100, 9: 101}
+        self.tm.refused_tasks = {8: 1000.0}
+        self.session.host.getTask.return_value = None
+        with mock.patch('time.time', return_value=1001.0):
+            self.assertFalse(self.tm.getNextTask())
+        self.assertEqual(self.session.host.getTask.call_args[1]['exclude'], [7, 8, 9])
+
+    def test_old_hub(self):
+        self.session.host.getTask.side_effect = koji.GenericError(
+            'Invalid method: host.getTask')
+        self.tm.host_id = 1
+        self.session.host.getLoadData.return_value = (
+            [{'id': 1, 'capacity': 2.0, 'task_load': 0.0, 'channels': [1],
+              'arches': 'x86_64'}],
+            [{'id': 10, 'state': koji.TASK_STATES['FREE'], 'method': 'build',
+              'channel_id': 1, 'arch': 'noarch', 'host_id': None}])
+        self.assertTrue(self.tm.getNextTask())
+        self.assertFalse(self.tm.task_claims)
+        self.tm.takeTask.assert_called_once()
+        self.assertEqual(self.tm.takeTask.call_args[0][0]['id'], 10)
+        # no more tries
+        self.tm.getNextTask()
+        self.session.host.getTask.assert_called_once()
+        self.assertEqual(self.session.host.getLoadData.call_count, 2)
+
+    def test_error(self):
+        self.session.host.getTask.side_effect = koji.GenericError('failed')
+        with self.assertRaises(koji.GenericError):
+            self.tm.getNextTask()
+        self.assertTrue(self.tm.task_claims)
@@ -0,0 +1,47 @@
+from __future__ import absolute_import
+import mock
+import unittest
+
+import koji.daemon
+import koji
+
+
+class TestWaitForEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.options = mock.MagicMock()
+        self.session = mock.MagicMock()
+        self.tm = koji.daemon.TaskManager(self.options, self.session)
+        self.sleep = mock.patch('time.sleep').start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_events(self):
+        self.session.host.waitForTaskEvents.return_value = [{'id': 1}]
+        self.tm.waitForEvents(15)
+        self.session.host.waitForTaskEvents.assert_called_once_with(15)
+        self.sleep.assert_not_called()
+        self.assertTrue(self.tm.task_events)
+
+    def test_not_available(self):
+        for exc in (koji.ActionNotAllowed('Task events are not enabled'),
+                    koji.GenericError('Invalid method: host.waitForTaskEvents')):
+            self.tm.task_events = True
+            self.session.host.waitForTaskEvents.reset_mock()
+            self.session.host.waitForTaskEvents.side_effect = exc
+            self.tm.waitForEvents(15)
+            self.sleep.assert_called_with(15)
+            self.assertFalse(self.tm.task_events)
+            # no more tries
+            self.tm.waitForEvents(15)
+            self.session.host.waitForTaskEvents.assert_called_once()
+
+    def test_error(self):
+        self.session.host.waitForTaskEvents.side_effect = [koji.GenericError('db error'),
+                                                           Exception('connection reset')]
+        self.tm.waitForEvents(15)
+        self.tm.waitForEvents(15)
+        self.assertEqual(self.sleep.call_count, 2)
+        # still enabled
+        self.assertTrue(self.tm.task_events)
@@ -138,5 +138,6 @@ Options:
   --key=KEY             Download rpms signed with the given key
   --topurl=URL          URL under which Koji files are accessible
   --noprogress          Do not display progress meter
+  --parallel=N          Download up to N files at the same time
   -q, --quiet           Suppress output
 """ % self.progname)
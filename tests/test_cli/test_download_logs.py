@@ -23,7 +23,6 @@ class TestDownloadLogs(utils.CliTestCase):
         self.list_task_output_all_volumes = mock.patch(
             'koji_cli.commands.list_task_output_all_volumes').start()
         self.ensuredir = mock.patch('koji.ensuredir').start()
-        self.download_file = mock.patch('koji_cli.commands.download_file').start()
         self.ensure_connection = mock.patch('koji_cli.commands.ensure_connection').start()
         self.stdout = mock.patch('sys.stdout', new_callable=six.StringIO).start()
         self.stderr = mock.patch('sys.stderr', new_callable=six.StringIO).start()
@@ -74,7 +73,7 @@ class TestDownloadLogs(utils.CliTestCase):
             mock.call(task_id),
             mock.call(23),
         ])
-        self.session.downloadTaskOutput.assert_not_called()
+        self.session.iterTaskOutput.assert_not_called()
 
     def test_anon_handle_download_logs(self):
         task_id = 123456
@@ -86,8 +85,9 @@ class TestDownloadLogs(utils.CliTestCase):
             'file1.log': ['volume1'],
             'file2_not_log': ['volume2'],
         }
-        self.session.downloadTaskOutput.side_effect = ['abcde', '']
+        self.session.iterTaskOutput.return_value = iter(['abc', 'de'])
         out_file = six.StringIO()
+        out_file.write = mock.MagicMock()
         self.custom_open['kojilogs/x86_64-123456/volume1/file1.log'] = out_file
 
         if six.PY2:
@@ -100,11 +100,9 @@ class TestDownloadLogs(utils.CliTestCase):
         self.session.getTaskInfo.assert_called_once_with(task_id)
         self.list_task_output_all_volumes.assert_called_once_with(self.session, task_id)
         self.assertTrue(out_file.closed)
-        self.assertEqual(self.session.downloadTaskOutput.call_count, 2)
-        self.session.downloadTaskOutput.assert_has_calls([
-            mock.call(123456, 'file1.log', offset=0, size=102400, volume='volume1'),
-            mock.call(123456, 'file1.log', offset=5, size=102400, volume='volume1'),
-        ])
+        out_file.write.assert_has_calls([mock.call('abc'), mock.call('de')])
+        self.session.iterTaskOutput.assert_called_once_with(
+            123456, 'file1.log', offset=0, volume='volume1', blocksize=102400)
 
     def test_anon_handle_download_logs_task_not_found(self):
         task_id = '123333'
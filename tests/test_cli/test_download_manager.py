@@ -0,0 +1,246 @@
+from __future__ import absolute_import
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import mock
+import requests
+import six
+
+import koji
+from koji_cli.lib import DownloadManager, check_archive_download
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, data=b'', fail_after=None):
+        self.status_code = status_code
+        self.data = data
+        self.fail_after = fail_after
+        self.headers = {'Content-Length': str(len(data))}
+        self.closed = False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError('%d Error' % self.status_code)
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.data), chunk_size):
+            if self.fail_after is not None and i >= self.fail_after:
+                raise requests.exceptions.ChunkedEncodingError('connection broken')
+            yield self.data[i:i + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class TestDownloadManager(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.tempdir)
+        self.stdout = mock.patch('sys.stdout', new_callable=six.StringIO).start()
+        self.stderr = mock.patch('sys.stderr', new_callable=six.StringIO).start()
+        self.files = {}
+        self.requests = []
+        self.sessions = []
+        self.ignore_range = False
+        self.failures = {}
+        self.lock = threading.Lock()
+        mock.patch('requests.Session', side_effect=self.new_session).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tempdir)
+
+    def new_session(self):
+        rsession = mock.MagicMock()
+        rsession.get.side_effect = self.get
+        self.sessions.append(rsession)
+        return rsession
+
+    def get(self, url, headers=None, stream=False):
+        with self.lock:
+            self.requests.append((url, headers.get('Range')))
+        data = self.files.get(url)
+        if data is None:
+            return FakeResponse(404)
+        byterange = headers.get('Range')
+        fail_after = self.failures.pop(url, None)
+        if not byterange or self.ignore_range:
+            return FakeResponse(200, data, fail_after)
+        start = int(byterange[6:-1])
+        if start >= len(data):
+            return FakeResponse(416)
+        return FakeResponse(206, data[start:], fail_after)
+
+    def serve(self, name, size):
+        url = 'https://topurl/files/%s' % name
+        self.files[url] = os.urandom(size)
+        return url
+
+    def read(self, path):
+        with open(path, 'rb') as fo:
+            return fo.read()
+
+    def write(self, path, data):
+        with open(path, 'wb') as fo:
+            fo.write(data)
+
+    def test_parallel(self):
+        manager = DownloadManager(parallel=3, blocksize=1000)
+        for i in range(10):
+            url = self.serve('file%i' % i, 5000 + i)
+            manager.add(url, 'dir/file%i' % i, size=5000 + i)
+        self.assertEqual(manager.run(), [])
+        for i in range(10):
+            self.assertEqual(self.read('dir/file%i' % i),
+                             self.files['https://topurl/files/file%i' % i])
+        # one session, i.e. connection pool, per worker
+        self.assertEqual(len(self.sessions), 3)
+        for rsession in self.sessions:
+            rsession.close.assert_called_once()
+        output = self.stdout.getvalue()
+        self.assertIn('Downloading [10/10]: dir/file9\n', output)
+        self.assertIn('100% 10/10 files', output)
+
+    def test_sequential(self):
+        manager = DownloadManager(noprogress=True)
+        for i in range(3):
+            manager.add(self.serve('file%i' % i, 100), 'file%i' % i)
+        self.assertEqual(manager.run(), [])
+        self.assertEqual(len(self.sessions), 1)
+        self.assertEqual(self.stdout.getvalue(),
+                         'Downloading [1/3]: file0\n'
+                         'Downloading [2/3]: file1\n'
+                         'Downloading [3/3]: file2\n')
+
+    def test_resume(self):
+        url = self.serve('file', 10000)
+        self.write('file', self.files[url][:4000])
+        manager = DownloadManager(quiet=True)
+        manager.add(url, 'file', size=10000)
+        self.assertEqual(manager.run(), [])
+        self.assertEqual(self.requests, [(url, 'bytes=4000-')])
+        self.assertEqual(self.read('file'), self.files[url])
+        self.assertEqual(self.stdout.getvalue(), '')
+
+    def test_resume_ignored(self):
+        url = self.serve('file', 10000)
+        self.write('file', self.files[url][:4000])
+        self.ignore_range = True
+        manager = DownloadManager(quiet=True)
+        manager.add(url, 'file', size=10000)
+        self.assertEqual(manager.run(), [])
+        self.assertEqual(self.read('file'), self.files[url])
+
+    def test_complete(self):
+        url = self.serve('file', 10000)
+        self.write('file', self.files[url])
+        check = mock.MagicMock(return_value=None)
+        manager = DownloadManager(noprogress=True)
+        manager.add(url, 'file', size=10000, check=check)
+        self.assertEqual(manager.run(), [])
+        self.assertEqual(self.requests, [])
+        check.assert_called_once_with('file')
+        self.assertIn('File file already downloaded, skipping\n', self.stdout.getvalue())
+
+    def test_unknown_size(self):
+        # without a size or check, existing files are replaced
+        url = self.serve('file', 1000)
+        self.write('file', b'old data')
+        manager = DownloadManager(quiet=True)
+        manager.add(url, 'file')
+        self.assertEqual(manager.run(), [])
+        self.assertEqual(self.requests, [(url, None)])
+        self.assertEqual(self.read('file'), self.files[url])
+
+    def test_resumed_check_failed(self):
+        url = self.serve('file', 10000)
+        data = self.files[url]
+        # the start of another file
+        self.write('file', b'x' * 4000)
+
+        def check(path):
+            if self.read(path) != data:
+                return 'bad file'
+        manager = DownloadManager(quiet=True)
+        manager.add(url, 'file', check=check)
+        self.assertEqual(manager.run(), [])
+        self.assertEqual(self.requests, [(url, 'bytes=4000-'), (url, None)])
+        self.assertEqual(self.read('file'), data)
+
+    def test_check_failed(self):
+        url = self.serve('file', 1000)
+        manager = DownloadManager(quiet=True)
+        manager.add(url, 'file', check=lambda path: 'bad file')
+        self.assertEqual(manager.run(), [('file', 'bad file')])
+        self.assertFalse(os.path.exists('file'))
+        self.assertEqual(self.stderr.getvalue(), 'bad file\n')
+
+    def test_size_mismatch(self):
+        url = self.serve('file', 1000)
+        manager = DownloadManager(quiet=True)
+        manager.add(url, 'file', size=2000)
+        failed = manager.run()
+        self.assertEqual(failed, [('file', 'Downloaded file file size 1000 does not match '
+                                           'expected size 2000, deleting')])
+        self.assertFalse(os.path.exists('file'))
+
+    def test_not_found(self):
+        url = self.serve('file', 1000)
+        manager = DownloadManager(parallel=2, quiet=True)
+        manager.add('https://topurl/files/missing', 'missing')
+        manager.add(url, 'file')
+        failed = manager.run()
+        self.assertEqual(failed, [('missing', 'Download of missing failed: 404 Error')])
+        self.assertFalse(os.path.exists('missing'))
+        self.assertEqual(self.read('file'), self.files[url])
+
+    def test_retry(self):
+        url = self.serve('file', 10000)
+        self.failures[url] = 3000
+        manager = DownloadManager(noprogress=True, blocksize=1000)
+        manager.add(url, 'file', size=10000)
+        self.assertEqual(manager.run(), [])
+        self.assertEqual(self.requests, [(url, None), (url, 'bytes=3000-')])
+        self.assertEqual(self.read('file'), self.files[url])
+        self.assertIn('Retrying download of file: connection broken', self.stdout.getvalue())
+
+    def test_retries_exhausted(self):
+        url = self.serve('file', 10000)
+        self.failures[url] = 3000
+        manager = DownloadManager(quiet=True, blocksize=1000, retries=0)
+        manager.add(url, 'file', size=10000)
+        failed = manager.run()
+        self.assertEqual(failed, [('file', 'Download of file failed: connection broken')])
+        # kept to be resumed later
+        self.assertEqual(os.path.getsize('file'), 3000)
+
+    def test_archive_check(self):
+        data = b'archive data'
+        self.write('file.zip', data)
+        archive = {'size': len(data),
+                   'checksum_type': koji.CHECKSUM_TYPES['sha256'],
+                   'checksum': hashlib.sha256(data).hexdigest()}
+        self.assertIsNone(check_archive_download('file.zip', archive))
+        archive['checksum'] = hashlib.sha256(b'other').hexdigest()
+        self.assertEqual(check_archive_download('file.zip', archive),
+                         "Downloaded archive file.zip doesn't match checksum, deleting")
+
+    def test_add_archive(self):
+        build = {'name': 'pkg', 'version': '1', 'release': '1'}
+        archive = {'btype': 'image', 'filename': 'image.qcow2', 'size': 1000,
+                   'checksum_type': koji.CHECKSUM_TYPES['md5'], 'checksum': 'x'}
+        manager = DownloadManager()
+        manager.add_archive(build, archive, 'https://topurl')
+        dl = manager.downloads[0]
+        self.assertEqual(dl['url'], 'https://topurl/packages/pkg/1/1/images/image.qcow2')
+        self.assertEqual(dl['path'], 'image.qcow2')
+        self.assertEqual(dl['size'], 1000)
@@ -23,7 +23,6 @@ class TestDownloadTask(utils.CliTestCase):
                   six.iteritems(task_output)
                   if k not in blacklist
                   for v in vl]
-        total = len(params)
         calls = []
         for i, (k, v) in enumerate(params):
             target = k
@@ -35,10 +34,14 @@ class TestDownloadTask(utils.CliTestCase):
             url = pattern % (subpath, k)
             if target.endswith('.log') and arch is not None:
                 target = "%s.%s.log" % (target.rstrip(".log"), arch)
-            calls.append(call(url, target, quiet=None, noprogress=None,
-                              size=total, num=i + 1))
+            calls.append(call(url, target, size=int(task_output[k][v]['st_size'])))
         return calls
 
+    def stat(self, task_output):
+        """Add stat info to the volumes of each file"""
+        return dict([(k, dict([(v, {'st_size': str(len(k) * 100)}) for v in vl]))
+                     for k, vl in six.iteritems(task_output)])
+
     def setUp(self):
         # Mock out the options parsed in main
         self.options = mock.MagicMock()
@@ -49,7 +52,9 @@ class TestDownloadTask(utils.CliTestCase):
         self.list_task_output_all_volumes = mock.patch(
             'koji_cli.commands.list_task_output_all_volumes').start()
         self.ensuredir = mock.patch('koji.ensuredir').start()
-        self.download_file = mock.patch('koji_cli.commands.download_file').start()
+        self.DownloadManager = mock.patch('koji_cli.commands.DownloadManager').start()
+        self.manager = self.DownloadManager.return_value
+        self.manager.run.return_value = []
         self.ensure_connection = mock.patch('koji_cli.commands.ensure_connection').start()
         self.stdout = mock.patch('sys.stdout', new_callable=six.StringIO).start()
         self.stderr = mock.patch('sys.stderr', new_callable=six.StringIO).start()
@@ -64,11 +69,11 @@ class TestDownloadTask(utils.CliTestCase):
                                                  'method': 'buildArch',
                                                  'arch': 'taskarch',
                                                  'state': 2}
-        self.list_task_output_all_volumes.return_value = {
+        self.list_task_output_all_volumes.return_value = self.stat({
             'somerpm.src.rpm': ['DEFAULT', 'vol1'],
             'somerpm.x86_64.rpm': ['DEFAULT', 'vol2'],
             'somerpm.noarch.rpm': ['vol3'],
-            'somelog.log': ['DEFAULT', 'vol1']}
+            'somelog.log': ['DEFAULT', 'vol1']})
 
         calls = self.gen_calls(self.list_task_output_all_volumes.return_value,
                                'https://topurl/%swork/tasks/3333/123333/%s',
@@ -86,8 +91,9 @@ class TestDownloadTask(utils.CliTestCase):
         self.ensure_connection.assert_called_once_with(self.session, self.options)
         self.session.getTaskInfo.assert_called_once_with(task_id)
         self.session.getTaskChildren.assert_not_called()
-        self.list_task_output_all_volumes.assert_called_once_with(self.session, task_id)
-        self.assertListEqual(self.download_file.mock_calls, calls)
+        self.list_task_output_all_volumes.assert_called_once_with(self.session, task_id,
+                                                                  stat=True)
+        self.assertListEqual(self.manager.add.mock_calls, calls)
         self.assertIsNone(rv)
 
     def test_handle_download_task_not_found(self):
@@ -137,10 +143,10 @@ class TestDownloadTask(utils.CliTestCase):
                                                       'state': 2}
                                                      ]
         self.list_task_output_all_volumes.side_effect = [
-            {'somerpm.src.rpm': ['DEFAULT', 'vol1']},
-            {'somerpm.x86_64.rpm': ['DEFAULT', 'vol2']},
-            {'somerpm.noarch.rpm': ['vol3'],
-             'somelog.log': ['DEFAULT', 'vol1']}]
+            self.stat({'somerpm.src.rpm': ['DEFAULT', 'vol1']}),
+            self.stat({'somerpm.x86_64.rpm': ['DEFAULT', 'vol2']}),
+            self.stat({'somerpm.noarch.rpm': ['vol3'],
+                       'somelog.log': ['DEFAULT', 'vol1']})]
         # Run it and check immediate output
         # args: task_id --arch=noarch,x86_64
         # expected: success
@@ -154,16 +160,18 @@ class TestDownloadTask(utils.CliTestCase):
         self.session.getTaskInfo.assert_called_once_with(task_id)
         self.session.getTaskChildren.assert_called_once_with(task_id)
         self.assertEqual(self.list_task_output_all_volumes.mock_calls, [
-            call(self.session, 22222),
-            call(self.session, 33333),
-            call(self.session, 44444)])
-        self.assertListEqual(self.download_file.mock_calls, [
+            call(self.session, 22222, stat=True),
+            call(self.session, 33333, stat=True),
+            call(self.session, 44444, stat=True)])
+        self.DownloadManager.assert_called_once_with(parallel=1, quiet=None, noprogress=None)
+        self.assertListEqual(self.manager.add.mock_calls, [
             call('https://topurl/work/tasks/3333/33333/somerpm.x86_64.rpm',
-                 'somerpm.x86_64.rpm', quiet=None, noprogress=None, size=3, num=1),
+                 'somerpm.x86_64.rpm', size=1800),
             call('https://topurl/vol/vol2/work/tasks/3333/33333/somerpm.x86_64.rpm',
-                 'vol2/somerpm.x86_64.rpm', quiet=None, noprogress=None, size=3, num=2),
+                 'vol2/somerpm.x86_64.rpm', size=1800),
             call('https://topurl/vol/vol3/work/tasks/4444/44444/somerpm.noarch.rpm',
-                 'vol3/somerpm.noarch.rpm', quiet=None, noprogress=None, size=3, num=3)])
+                 'vol3/somerpm.noarch.rpm', size=1800)])
+        self.manager.run.assert_called_once_with()
         self.assertIsNone(rv)
 
     def test_handle_download_task_log(self):
@@ -173,11 +181,11 @@ class TestDownloadTask(utils.CliTestCase):
                                                  'method': 'buildArch',
                                                  'arch': 'taskarch',
                                                  'state': 2}
-        self.list_task_output_all_volumes.return_value = {
+        self.list_task_output_all_volumes.return_value = self.stat({
             'somerpm.src.rpm': ['DEFAULT', 'vol1'],
             'somerpm.x86_64.rpm': ['DEFAULT', 'vol2'],
             'somerpm.noarch.rpm': ['vol3'],
-            'somelog.log': ['DEFAULT', 'vol1']}
+            'somelog.log': ['DEFAULT', 'vol1']})
 
         calls = self.gen_calls(self.list_task_output_all_volumes.return_value,
                                'https://topurl/%swork/tasks/3333/123333/%s', arch='taskarch')
@@ -194,8 +202,9 @@ class TestDownloadTask(utils.CliTestCase):
         self.ensure_connection.assert_called_once_with(self.session, self.options)
         self.session.getTaskInfo.assert_called_once_with(task_id)
         self.session.getTaskChildren.assert_not_called()
-        self.list_task_output_all_volumes.assert_called_once_with(self.session, task_id)
-        self.assertListEqual(self.download_file.mock_calls, calls)
+        self.list_task_output_all_volumes.assert_called_once_with(self.session, task_id,
+                                                                  stat=True)
+        self.assertListEqual(self.manager.add.mock_calls, calls)
         self.assertIsNone(rv)
 
     def test_handle_download_no_download(self):
@@ -205,13 +214,13 @@ class TestDownloadTask(utils.CliTestCase):
                                                  'method': 'buildArch',
                                                  'arch': 'taskarch',
                                                  'state': 2}
-        self.list_task_output_all_volumes.return_value = {
+        self.list_task_output_all_volumes.return_value = self.stat({
             'somerpm.src.rpm': ['DEFAULT', 'vol1'],
             'somerpm.x86_64.rpm': ['DEFAULT', 'vol2'],
             'somerpm.noarch.rpm': ['vol3'],
             'somelog.log': ['DEFAULT', 'vol1'],
             'somezip.zip': ['DEFAULT']
-        }
+        })
 
         # Run it and check immediate output
         # args: task_id --arch=s390,ppc
@@ -229,8 +238,9 @@ class TestDownloadTask(utils.CliTestCase):
         self.ensure_connection.assert_called_once_with(self.session, self.options)
         self.session.getTaskInfo.assert_called_once_with(task_id)
         self.session.getTaskChildren.assert_not_called()
-        self.list_task_output_all_volumes.assert_called_once_with(self.session, task_id)
-        self.download_file.assert_not_called()
+        self.list_task_output_all_volumes.assert_called_once_with(self.session, task_id,
+                                                                  stat=True)
+        self.manager.add.assert_not_called()
 
     def test_handle_download_parent_not_finished(self):
         task_id = 123333
@@ -239,13 +249,13 @@ class TestDownloadTask(utils.CliTestCase):
                                                  'method': 'buildArch',
                                                  'arch': 'taskarch',
                                                  'state': 3}
-        self.list_task_output_all_volumes.return_value = {
+        self.list_task_output_all_volumes.return_value = self.stat({
             'somerpm.src.rpm': ['DEFAULT', 'vol1'],
             'somerpm.x86_64.rpm': ['DEFAULT', 'vol2'],
             'somerpm.noarch.rpm': ['vol3'],
             'somelog.log': ['DEFAULT', 'vol1'],
             'somezip.zip': ['DEFAULT']
-        }
+        })
         # Run it and check immediate output
         # args: task_id
         # expected: failure
@@ -262,8 +272,9 @@ class TestDownloadTask(utils.CliTestCase):
         self.ensure_connection.assert_called_once_with(self.session, self.options)
         self.session.getTaskInfo.assert_called_once_with(task_id)
         self.session.getTaskChildren.assert_not_called()
-        self.list_task_output_all_volumes.assert_called_once_with(self.session, task_id)
-        self.download_file.assert_not_called()
+        self.list_task_output_all_volumes.assert_called_once_with(self.session, task_id,
+                                                                  stat=True)
+        self.manager.add.assert_not_called()
 
     def test_handle_download_child_not_finished(self):
         task_id = 123333
@@ -276,7 +287,8 @@ class TestDownloadTask(utils.CliTestCase):
                                                       'method': 'buildArch',
                                                       'arch': 'noarch',
                                                       'state': 3}]
-        self.list_task_output_all_volumes.return_value = {'somerpm.src.rpm': ['DEFAULT', 'vol1']}
+        self.list_task_output_all_volumes.return_value = self.stat(
+            {'somerpm.src.rpm': ['DEFAULT', 'vol1']})
         # Run it and check immediate output
         # args: task_id
         # expected: failure
@@ -293,8 +305,9 @@ class TestDownloadTask(utils.CliTestCase):
         self.ensure_connection.assert_called_once_with(self.session, self.options)
         self.session.getTaskInfo.assert_called_once_with(task_id)
         self.session.getTaskChildren.assert_called_once_with(task_id)
-        self.list_task_output_all_volumes.assert_called_once_with(self.session, 22222)
-        self.download_file.assert_not_called()
+        self.list_task_output_all_volumes.assert_called_once_with(self.session, 22222,
+                                                                  stat=True)
+        self.manager.add.assert_not_called()
 
     def test_handle_download_invalid_file_name(self):
         task_id = 123333
@@ -303,7 +316,8 @@ class TestDownloadTask(utils.CliTestCase):
                                                  'method': 'buildArch',
                                                  'arch': 'taskarch',
                                                  'state': 2}
-        self.list_task_output_all_volumes.return_value = {'somerpm..src.rpm': ['DEFAULT', 'vol1']}
+        self.list_task_output_all_volumes.return_value = self.stat(
+            {'somerpm..src.rpm': ['DEFAULT', 'vol1']})
         # Run it and check immediate output
         # args: task_id
         # expected: failure
@@ -320,8 +334,9 @@ class TestDownloadTask(utils.CliTestCase):
         self.ensure_connection.assert_called_once_with(self.session, self.options)
         self.session.getTaskInfo.assert_called_once_with(task_id)
         self.session.getTaskChildren.assert_not_called()
-        self.list_task_output_all_volumes.assert_called_once_with(self.session, task_id)
-        self.download_file.assert_not_called()
+        self.list_task_output_all_volumes.assert_called_once_with(self.session, task_id,
+                                                                  stat=True)
+        self.manager.add.assert_not_called()
 
     def test_handle_download_help(self):
         args = ['--help']
@@ -345,6 +360,7 @@ Options:
   --wait        Wait for running tasks to finish, even if running in the
                 background
   --nowait      Do not wait for running tasks to finish
+  --parallel=N  Download up to N files at the same time
   -q, --quiet   Suppress output
 """ % progname
         self.assertMultiLineEqual(actual, expected)
@@ -17,6 +17,7 @@ class TestListHistory(utils.CliTestCase):
         self.options = mock.MagicMock()
         self.options.debug = False
         self.session = mock.MagicMock()
+        utils.mock_iter_method(self.session)
 
     @staticmethod
     def get_expected_date_active_action(item, act='add'):
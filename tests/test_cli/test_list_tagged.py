@@ -22,6 +22,7 @@ class TestCliListTagged(utils.CliTestCase):
 %s: error: {message}
 """ % (self.progname, self.progname)
         self.session = mock.MagicMock()
+        utils.mock_iter_method(self.session)
         self.options = mock.MagicMock(quiet=False)
         self.session.getTag.return_value = {'id': 1}
         self.session.listTaggedRPMS.return_value = [[{'id': 100,
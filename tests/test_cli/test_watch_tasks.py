@@ -19,6 +19,9 @@ class TestWatchTasks(unittest.TestCase):
     def setUp(self):
         self.options = mock.MagicMock()
         self.session = FakeClientSession('SERVER', {})
+        # the recorded calls are from a hub without watchTasks
+        self.session.watchTasks = mock.MagicMock(
+            side_effect=koji.GenericError('Invalid method: watchTasks'))
         self.recording = False
         self.record_file = None
         self.args = mock.MagicMock()
@@ -143,5 +146,53 @@ some output
         self.assertMultiLineEqual(stdout.getvalue(), expected)
 
 
+class TestWatchTasksEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.session = mock.MagicMock()
+        self.session.getHost.return_value = {'name': 'builder-01'}
+
+    def task(self, task_id, state, parent=None, request=True):
+        info = {'id': task_id, 'state': koji.TASK_STATES[state], 'parent': parent,
+                'method': 'someMethod', 'arch': 'noarch', 'host_id': 1}
+        if request:
+            info['request'] = []
+        return info
+
+    @mock.patch('time.sleep')
+    @mock.patch('sys.stdout', new_callable=six.StringIO)
+    def test_watch_tasks(self, stdout, sleep):
+        self.session.watchTasks.side_effect = [
+            {'token': 't1', 'tasks': [self.task(1, 'FREE')]},
+            {'token': 't2', 'tasks': [self.task(1, 'OPEN', request=False),
+                                      self.task(2, 'OPEN', parent=1)]},
+            {'token': 't3', 'tasks': [self.task(1, 'OPEN', request=False),
+                                      self.task(2, 'CLOSED', parent=1, request=False)]},
+            {'token': 't4', 'tasks': [self.task(1, 'CLOSED', request=False),
+                                      self.task(2, 'CLOSED', parent=1, request=False)]},
+        ]
+        rv = watch_tasks(self.session, [1], quiet=False, poll_interval=5)
+        self.assertEqual(rv, 0)
+        self.assertEqual(self.session.watchTasks.call_args_list,
+                         [call([1], None, 5), call([1], 't1', 5), call([1, 2], 't2', 5),
+                          call([1, 2], 't3', 5)])
+        # no polling
+        sleep.assert_not_called()
+        self.session.getTaskInfo.assert_not_called()
+        self.session.getTaskChildren.assert_not_called()
+        expected = ('''Watching tasks (this may be safely interrupted)...
+1 someMethod (noarch): free
+1 someMethod (noarch): free -> open (builder-01)
+  2 someMethod (noarch): open (builder-01)
+  2 someMethod (noarch): open (builder-01) -> closed
+  0 free  1 open  1 done  0 failed
+1 someMethod (noarch): open (builder-01) -> closed
+  0 free  0 open  2 done  0 failed
+
+1 someMethod (noarch) completed successfully
+''')
+        self.assertMultiLineEqual(stdout.getvalue(), expected)
+
+
 if __name__ == '__main__':
     unittest.main()
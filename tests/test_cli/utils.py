@@ -212,6 +212,22 @@ class CliTestCase(unittest.TestCase):
             self.assertEqual(ex.exception.code, code)
 
 
+def mock_iter_method(session):
+    """Make session.iterMethod return the results of the mocked calls"""
+    from koji import xmlrpcplus
+
+    def iterMethod(name, *args, **kwargs):
+        result = getattr(session, name)(*args, **kwargs)
+        data = xmlrpcplus.dumps((result,), methodresponse=1).encode()
+        u = xmlrpcplus.IterUnmarshaller()
+        p = xmlrpcplus.xmlrpc_client.ExpatParser(u)
+        p.feed(data)
+        p.close()
+        u.close()
+        return iter(u.items)
+    session.iterMethod.side_effect = iterMethod
+
+
 def get_builtin_open():
     if six.PY2:
         return '__builtin__.open'
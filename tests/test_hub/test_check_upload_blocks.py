@@ -0,0 +1,68 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+import mock
+import unittest
+
+import koji
+import kojihub
+
+
+class TestCheckUploadBlocks(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tempdir, 'file')
+        self.get_upload_path = mock.patch('kojihub.get_upload_path',
+                                          return_value=self.fn).start()
+        self.exports = kojihub.RootExports()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        shutil.rmtree(self.tempdir)
+
+    def write(self, data):
+        with open(self.fn, 'wb') as fo:
+            fo.write(data)
+
+    def test_blocks(self):
+        data = os.urandom(200000)
+        self.write(data)
+        result = self.exports.checkUploadBlocks('target', 'file', 65536, volume='vol')
+        self.get_upload_path.assert_called_once_with('target', 'file', volume='vol')
+        self.assertEqual(result['size'], 200000)
+        self.assertEqual(result['blocksize'], 65536)
+        self.assertEqual(result['verify'], 'sha256')
+        expected = [hashlib.sha256(data[i:i + 65536]).hexdigest()
+                    for i in range(0, 200000, 65536)]
+        self.assertEqual(result['blocks'], expected)
+
+    def test_verify(self):
+        data = os.urandom(131072)
+        self.write(data)
+        result = self.exports.checkUploadBlocks('target', 'file', 65536, verify='adler32')
+        expected = [koji.util.adler32_constructor(data[i:i + 65536]).hexdigest()
+                    for i in (0, 65536)]
+        self.assertEqual(result['blocks'], expected)
+
+    def test_empty(self):
+        self.write(b'')
+        result = self.exports.checkUploadBlocks('target', 'file', 65536)
+        self.assertEqual(result['size'], 0)
+        self.assertEqual(result['blocks'], [])
+
+    def test_missing(self):
+        self.assertIsNone(self.exports.checkUploadBlocks('target', 'file', 65536))
+
+    def test_invalid(self):
+        self.write(b'data')
+        with self.assertRaises(koji.GenericError):
+            self.exports.checkUploadBlocks('target', 'file', 1)
+        with self.assertRaises(koji.GenericError):
+            self.exports.checkUploadBlocks('target', 'file', '65536')
+        with self.assertRaises(koji.GenericError):
+            self.exports.checkUploadBlocks('target', 'file', 65536, verify=None)
+        with self.assertRaises(koji.GenericError):
+            self.exports.checkUploadBlocks('target', 'file', 65536, verify='crc')
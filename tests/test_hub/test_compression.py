@@ -0,0 +1,72 @@
+import gzip
+import io
+
+import mock
+import unittest
+
+import koji
+import koji.compression
+from kojixmlrpc import ModXMLRPCRequestHandler, StreamedResponse
+
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojixmlrpc.context').start()
+        self.context.commit_pending = False
+        self.context.opts = {'ResponseChunkSize': 1000, 'MemoryWarnThreshold': 5000}
+        self.opts = mock.patch('kojixmlrpc.opts', {'MaxRequestLength': 100000},
+                               create=True).start()
+        mock.patch('kojixmlrpc.get_memory_usage', return_value=0).start()
+        self.h = ModXMLRPCRequestHandler(mock.MagicMock())
+        self.h.logger = mock.MagicMock()
+        self.h._dispatch = mock.MagicMock()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_request(self):
+        data = koji.xmlrpcplus.dumps((1, 'x' * 1000), 'getBuild').encode()
+        environ = {
+            'CONTENT_TYPE': 'text/xml',
+            'HTTP_CONTENT_ENCODING': 'gzip',
+            'wsgi.input': io.BytesIO(gzip.compress(data)),
+        }
+        self.h.handle_rpc(environ)
+        self.h._dispatch.assert_called_once_with('getBuild', (1, 'x' * 1000))
+
+    def test_request_too_long(self):
+        # the limit applies to the uncompressed request
+        data = koji.xmlrpcplus.dumps(('x' * 200000,), 'getBuild').encode()
+        environ = {
+            'CONTENT_TYPE': 'text/xml',
+            'HTTP_CONTENT_ENCODING': 'gzip',
+            'wsgi.input': io.BytesIO(gzip.compress(data)),
+        }
+        with self.assertRaises(koji.GenericError) as cm:
+            self.h.handle_rpc(environ)
+        self.assertEqual(cm.exception.args[0], 'Request too long')
+        self.h._dispatch.assert_not_called()
+
+    def test_request_unsupported(self):
+        environ = {
+            'CONTENT_TYPE': 'text/xml',
+            'HTTP_CONTENT_ENCODING': 'br',
+            'wsgi.input': io.BytesIO(b''),
+        }
+        with self.assertRaises(koji.GenericError):
+            self.h.handle_rpc(environ)
+
+    def test_streamed_response(self):
+        rows = ({'id': n, 'name': 'x' * 100} for n in range(1000))
+        head, rest = self.h._wrap_handler(lambda environ: rows, {})
+        response = StreamedResponse(self.h, head, rest, 0, 0, encoding='gzip')
+        data = b''.join(response)
+        response.close()
+        raw = gzip.decompress(data)
+        self.assertEqual(len(koji.xmlrpcplus.loads(raw)[0][0]), 1000)
+        self.assertEqual(response.size, len(data))
+        self.assertEqual(response.raw_size, len(raw))
+        self.h.logger.debug.assert_called_once_with(
+            "Returning %d bytes (%s, %d uncompressed) after %f seconds",
+            len(data), 'gzip', len(raw), mock.ANY)
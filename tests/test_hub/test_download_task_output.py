@@ -0,0 +1,191 @@
+import os
+import shutil
+import tempfile
+
+import mock
+import unittest
+
+import koji
+import kojihub
+import kojixmlrpc
+from kojixmlrpc import download_reply, parse_range
+
+
+class TestParseRange(unittest.TestCase):
+
+    def test_ranges(self):
+        self.assertEqual(parse_range(None, 100), None)
+        self.assertEqual(parse_range('bytes=0-', 100), (0, 100))
+        self.assertEqual(parse_range('bytes=10-19', 100), (10, 20))
+        self.assertEqual(parse_range('bytes=10-1000', 100), (10, 100))
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 100))
+        self.assertEqual(parse_range('bytes=-1000', 100), (0, 100))
+        self.assertEqual(parse_range('Bytes = 10 - 19', 100), (10, 20))
+
+    def test_ignored(self):
+        for value in ('items=0-10', 'bytes=0-10,20-30', 'bytes=10', 'bytes=-',
+                      'bytes=a-b', 'bytes=20-10', 'bytes=--1'):
+            self.assertEqual(parse_range(value, 100), None, value)
+
+    def test_unsatisfiable(self):
+        for value, size in (('bytes=100-', 100), ('bytes=-0', 100), ('bytes=0-', 0),
+                            ('bytes=-10', 0)):
+            with self.assertRaises(ValueError):
+                parse_range(value, size)
+
+
+class TestDownloadReply(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tempdir, 'build.log')
+        self.data = os.urandom(3000000)
+        with open(self.fn, 'wb') as fo:
+            fo.write(self.data)
+        self.start_response = mock.MagicMock()
+        self.environ = {'REQUEST_METHOD': 'GET'}
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def reply(self, **environ):
+        self.environ.update(environ)
+        fo = open(self.fn, 'rb')
+        body = b''.join(download_reply(fo, self.environ, self.start_response))
+        self.assertTrue(fo.closed)
+        status, headers = self.start_response.call_args[0]
+        return status, dict(headers), body
+
+    def test_whole(self):
+        status, headers, body = self.reply()
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['Content-Length'], '3000000')
+        self.assertEqual(headers['Accept-Ranges'], 'bytes')
+        self.assertNotIn('Content-Range', headers)
+        self.assertEqual(body, self.data)
+
+    def test_range(self):
+        status, headers, body = self.reply(HTTP_RANGE='bytes=1000-1999')
+        self.assertEqual(status, '206 Partial Content')
+        self.assertEqual(headers['Content-Range'], 'bytes 1000-1999/3000000')
+        self.assertEqual(headers['Content-Length'], '1000')
+        self.assertEqual(body, self.data[1000:2000])
+
+    def test_if_range(self):
+        status, headers, body = self.reply()
+        etag = headers['ETag']
+        status, headers, body = self.reply(HTTP_RANGE='bytes=-10', HTTP_IF_RANGE=etag)
+        self.assertEqual(status, '206 Partial Content')
+        self.assertEqual(body, self.data[-10:])
+        # the file changed
+        status, headers, body = self.reply(HTTP_IF_RANGE='"1-1"')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(body, self.data)
+
+    def test_unsatisfiable(self):
+        status, headers, body = self.reply(HTTP_RANGE='bytes=3000000-')
+        self.assertEqual(status, '416 Range Not Satisfiable')
+        self.assertEqual(headers['Content-Range'], 'bytes */3000000')
+        self.assertEqual(body, b'')
+
+    def test_head(self):
+        status, headers, body = self.reply(REQUEST_METHOD='HEAD')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['Content-Length'], '3000000')
+        self.assertEqual(body, b'')
+
+    def test_file_wrapper(self):
+        wrapper = mock.MagicMock()
+        self.environ['wsgi.file_wrapper'] = wrapper
+        fo = open(self.fn, 'rb')
+        self.addCleanup(fo.close)
+        environ = dict(self.environ, HTTP_RANGE='bytes=10-')
+        result = download_reply(fo, environ, self.start_response)
+        # only mod_wsgi is known to stop at the Content-Length
+        self.assertNotEqual(result, wrapper.return_value)
+        wrapper.assert_not_called()
+        result.close()
+        fo = open(self.fn, 'rb')
+        self.addCleanup(fo.close)
+        environ['mod_wsgi.version'] = (4, 9, 0)
+        result = download_reply(fo, environ, self.start_response)
+        self.assertEqual(result, wrapper.return_value)
+        wrapper.assert_called_once_with(fo, 1048576)
+        self.assertEqual(fo.tell(), 10)
+
+
+class TestHandleDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.context = mock.patch('kojixmlrpc.context').start()
+        self.hub_context = mock.patch('kojihub.context').start()
+        mock.patch('kojixmlrpc.opts', new={}, create=True).start()
+        mock.patch('kojixmlrpc.registry', create=True).start()
+        mock.patch('kojixmlrpc.policy', create=True).start()
+        mock.patch('kojixmlrpc.kojihub', new=kojihub, create=True).start()
+        self.connect = mock.patch('koji.db.connect').start()
+        self.session = mock.patch('koji.auth.Session').start()
+        self.context.opts = {}
+        # a new session for each request
+        del self.context.session
+        mock.patch('koji.pathinfo.work', return_value=self.tempdir).start()
+        self.taskdir = os.path.join(self.tempdir, koji.pathinfo.taskrelpath(1))
+        os.makedirs(self.taskdir)
+        with open(os.path.join(self.taskdir, 'build.log'), 'wb') as fo:
+            fo.write(b'build output\n')
+        self.start_response = mock.MagicMock()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        shutil.rmtree(self.tempdir)
+
+    def get(self, query, **environ):
+        environ.update({'REQUEST_METHOD': 'GET', 'QUERY_STRING': query})
+        body = b''.join(kojixmlrpc.handle_download(environ, self.start_response))
+        status, headers = self.start_response.call_args[0]
+        return status, body
+
+    def test_download(self):
+        status, body = self.get('taskID=1&filename=build.log', HTTP_RANGE='bytes=6-')
+        self.assertEqual(status, '206 Partial Content')
+        self.assertEqual(body, b'output\n')
+        # the database is closed before the file is sent
+        self.context._threadclear.assert_called()
+        self.context.cnx.close.assert_called_once()
+
+    def test_missing(self):
+        status, body = self.get('taskID=1&filename=root.log')
+        self.assertEqual(status, '400 Bad Request')
+        with self.assertRaises(koji.xmlrpcplus.Fault) as cm:
+            koji.xmlrpcplus.loads(body)
+        self.assertEqual(cm.exception.faultString, 'no file "root.log" output by task 1')
+        status, body = self.get('taskID=1&filename=../../1/build.log')
+        self.assertEqual(status, '400 Bad Request')
+        status, body = self.get('taskID=x&filename=build.log')
+        self.assertEqual(status, '400 Bad Request')
+
+    def test_auth_error(self):
+        self.session.return_value.validate.side_effect = koji.AuthExpired('expired')
+        status, body = self.get('taskID=1&filename=build.log&session-id=1&session-key=x')
+        self.assertEqual(status, '403 Forbidden')
+        with self.assertRaises(koji.xmlrpcplus.Fault) as cm:
+            koji.xmlrpcplus.loads(body)
+        self.assertEqual(cm.exception.faultCode, koji.AuthExpired.faultCode)
+
+    def test_offline(self):
+        kojixmlrpc.opts['ServerOffline'] = True
+        status, body = self.get('taskID=1&filename=build.log')
+        self.assertEqual(status, '503 Service Unavailable')
+        self.connect.assert_not_called()
+
+    def test_application(self):
+        environ = {'REQUEST_METHOD': 'GET', 'QUERY_STRING': 'taskID=1&filename=build.log'}
+        with mock.patch('kojixmlrpc.firstcall', new=False):
+            body = b''.join(kojixmlrpc.application(environ, self.start_response))
+        self.assertEqual(body, b'build output\n')
+        # other GET requests are still rejected
+        environ = {'REQUEST_METHOD': 'GET', 'QUERY_STRING': ''}
+        with mock.patch('kojixmlrpc.firstcall', new=False):
+            kojixmlrpc.application(environ, self.start_response)
+        self.assertEqual(self.start_response.call_args[0][0], '405 Method Not Allowed')
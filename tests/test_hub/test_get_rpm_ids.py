@@ -0,0 +1,150 @@
+import mock
+import unittest
+
+import koji
+import kojihub
+
+
+BIP = kojihub.BulkInsertProcessor
+
+
+class TestGetRPMIds(unittest.TestCase):
+
+    def setUp(self):
+        self.QueryProcessor = mock.patch('kojihub.QueryProcessor').start()
+        self.query = self.QueryProcessor.return_value
+        self.query.execute.return_value = [
+            self.row(1, 'foo', 0),
+            self.row(2, 'foo', 5),
+            self.row(3, 'bar', 6),
+            self.row(4, 'bar', 5),
+            self.row(5, 'baz', 5, payloadhash='oldhash'),
+        ]
+        self.get_rpm = mock.patch('kojihub.get_rpm').start()
+        self.get_external_repo_id = mock.patch('kojihub.get_external_repo_id',
+                                               side_effect=lambda x, strict: {'repo5': 5,
+                                                                              'repo6': 6}[x]).start()
+        self._fetchMulti = mock.patch('kojihub._fetchMulti',
+                                      return_value=[[100], [101], [102]]).start()
+        self.add_external_rpm = mock.patch('kojihub.add_external_rpm').start()
+        self.Savepoint = mock.patch('kojihub.Savepoint').start()
+        self.BulkInsertProcessor = mock.patch('kojihub.BulkInsertProcessor',
+                                              side_effect=self.getInsert).start()
+        self.inserts = []
+        self.insert_execute = mock.MagicMock()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def getInsert(self, *args, **kwargs):
+        insert = BIP(*args, **kwargs)
+        insert.execute = self.insert_execute
+        self.inserts.append(insert)
+        return insert
+
+    def row(self, rpm_id, name, repo_id, payloadhash='hash'):
+        return {'id': rpm_id, 'name': name, 'version': '1', 'release': '1', 'arch': 'noarch',
+                'external_repo_id': repo_id, 'payloadhash': payloadhash}
+
+    def rpm(self, name, location=None, payloadhash='hash'):
+        rpminfo = {'name': name, 'version': '1', 'release': '1', 'arch': 'noarch',
+                   'epoch': None, 'payloadhash': payloadhash, 'size': 42, 'buildtime': 0}
+        if location:
+            rpminfo['location'] = location
+        return rpminfo
+
+    def test_existing(self):
+        rpmlist = [self.rpm('foo'), self.rpm('bar'), self.rpm('foo', 'repo5'),
+                   self.rpm('bar', 'repo6')]
+        # internal first, then the first external one
+        self.assertEqual(kojihub.get_rpm_ids(rpmlist), [1, 3, 2, 3])
+
+        # a single query for all rpms
+        self.QueryProcessor.assert_called_once()
+        kwargs = self.QueryProcessor.call_args[1]
+        self.assertEqual(kwargs['clauses'],
+                         ['(rpminfo.name, version, release, arch) IN (VALUES '
+                          '(%(name0)s, %(version0)s, %(release0)s, %(arch0)s), '
+                          '(%(name1)s, %(version1)s, %(release1)s, %(arch1)s))'])
+        self.assertEqual(kwargs['values']['name0'], 'bar')
+        self.assertEqual(kwargs['values']['name1'], 'foo')
+        self.get_rpm.assert_not_called()
+        self.assertEqual(self.inserts, [])
+        self.assertEqual(self.get_external_repo_id.call_count, 2)
+
+    def test_add_missing(self):
+        rpmlist = [self.rpm('new1', 'repo5'), self.rpm('foo'), self.rpm('new2', 'repo5'),
+                   self.rpm('new1', 'repo5'), self.rpm('foo', 'repo6')]
+        self.assertEqual(kojihub.get_rpm_ids(rpmlist), [100, 1, 101, 100, 102])
+
+        self._fetchMulti.assert_called_once()
+        self.assertEqual(self._fetchMulti.call_args[0][1], {'count': 3})
+        self.assertEqual(len(self.inserts), 1)
+        insert = self.inserts[0]
+        self.assertEqual(insert.table, 'rpminfo')
+        self.assertEqual([(r['id'], r['name'], r['external_repo_id']) for r in insert.data],
+                         [(100, 'new1', 5), (101, 'new2', 5), (102, 'foo', 6)])
+        self.assertNotIn('location', insert.data[0])
+        self.assertIsNone(insert.data[0]['build_id'])
+        self.insert_execute.assert_called_once()
+        self.add_external_rpm.assert_not_called()
+
+    def test_insert_conflict(self):
+        self.insert_execute.side_effect = Exception('duplicate key')
+        self.add_external_rpm.side_effect = [{'id': 7}, {'id': 8}]
+        rpmlist = [self.rpm('new1', 'repo5'), self.rpm('new2', 'repo6')]
+        self.assertEqual(kojihub.get_rpm_ids(rpmlist), [7, 8])
+        self.Savepoint.return_value.rollback.assert_called_once()
+        self.assertEqual(self.add_external_rpm.call_count, 2)
+        args = self.add_external_rpm.call_args[0]
+        self.assertEqual(args[0]['name'], 'new2')
+        self.assertEqual(args[1], 'repo6')
+
+    def test_errors(self):
+        with self.assertRaises(koji.GenericError) as cm:
+            kojihub.get_rpm_ids([self.rpm('baz', 'repo5')])
+        self.assertEqual(cm.exception.args[0],
+                         'hash changed for external rpm: baz-1-1.noarch@repo5 '
+                         '(oldhash -> hash)')
+
+        with self.assertRaises(koji.GenericError) as cm:
+            kojihub.get_rpm_ids([self.rpm('new1', 'repo5'),
+                                 self.rpm('new1', 'repo5', payloadhash='other')])
+        self.assertIn('hash changed', cm.exception.args[0])
+
+        with self.assertRaises(koji.GenericError):
+            kojihub.get_rpm_ids([self.rpm('nosuchrpm')])
+
+        rpminfo = self.rpm('new1', 'repo5')
+        del rpminfo['size']
+        with self.assertRaises(koji.GenericError):
+            kojihub.get_rpm_ids([rpminfo])
+        self.assertEqual(self.inserts, [])
+
+    def test_by_id(self):
+        self.get_rpm.return_value = {'id': 42}
+        self.assertEqual(kojihub.get_rpm_ids([{'id': 42}, self.rpm('foo')]), [42, 1])
+        self.get_rpm.assert_called_once_with({'id': 42}, strict=True)
+
+
+class TestBuildRootSetList(unittest.TestCase):
+
+    def setUp(self):
+        self.get_rpm_ids = mock.patch('kojihub.get_rpm_ids').start()
+        self.BulkInsertProcessor = mock.patch('kojihub.BulkInsertProcessor').start()
+        self.br = kojihub.BuildRoot.__new__(kojihub.BuildRoot)
+        self.br.id = 1
+        self.br.getList = mock.MagicMock(return_value=[{'rpm_id': 2}])
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_update(self):
+        self.get_rpm_ids.return_value = [3, 2, 1]
+        self.br._setList(['rpm1', 'rpm2', 'rpm3'], update=True)
+        self.get_rpm_ids.assert_called_once_with(['rpm1', 'rpm2', 'rpm3'])
+        insert = self.BulkInsertProcessor.return_value
+        self.assertEqual(insert.add_record.call_args_list,
+                         [mock.call(buildroot_id=1, rpm_id=1, is_update=True),
+                          mock.call(buildroot_id=1, rpm_id=3, is_update=True)])
+        insert.execute.assert_called_once()
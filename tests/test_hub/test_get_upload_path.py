@@ -34,6 +34,10 @@ class TestGetUploadPath(unittest.TestCase):
         with self.assertRaises(GenericError):
             kojihub.get_upload_path(reldir='tasks/1/should_be_number', name='error', create=True)
 
+    def test_get_upload_path_upload_store(self):
+        with self.assertRaises(GenericError):
+            kojihub.get_upload_path(reldir='upload-store/ab', name='error', create=True)
+
     @mock.patch('kojihub.context')
     @mock.patch('kojihub.Host')
     def test_get_upload_path_invalid_upload_dir_owner(self, host, context):
@@ -54,3 +58,29 @@ class TestGetUploadPath(unittest.TestCase):
         dir = kojihub.get_upload_path(reldir='tasks/1/1', name='error', create=False)
         assert dir == '%s/work/tasks/1/1/error' % self.topdir
 
+
+    @mock.patch('kojihub.context')
+    def test_get_upload_path_verify(self, context):
+        context.session.user_id = 1
+        reldir = 'fake/1/1'
+        fullpath = '%s/work/%s' % (self.topdir, reldir)
+        os.makedirs(fullpath)
+        with self.assertRaises(GenericError):
+            kojihub.get_upload_path(reldir=reldir, name='file', verify=True)
+        with open('{0}/.user'.format(fullpath), 'wt', encoding='utf-8') as f:
+            f.write('1')
+        self.assertEqual(kojihub.get_upload_path(reldir=reldir, name='file', verify=True),
+                         '%s/file' % fullpath)
+        context.session.user_id = 2
+        with self.assertRaises(GenericError):
+            kojihub.get_upload_path(reldir=reldir, name='file', verify=True)
+
+    @mock.patch('kojihub.Task')
+    @mock.patch('kojihub.Host')
+    def test_get_upload_path_verify_task(self, host, task):
+        task.return_value = mock.MagicMock(unsafe=True)
+        task.return_value.assertHost.side_effect = GenericError('not the task host')
+        with self.assertRaises(GenericError):
+            kojihub.get_upload_path(reldir='tasks/1/1', name='file', verify=True)
+        task.assert_called_once_with(1)
+        self.assertFalse(os.path.exists('%s/work/tasks' % self.topdir))
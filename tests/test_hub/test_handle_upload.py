@@ -0,0 +1,130 @@
+import io
+import os
+import shutil
+import tempfile
+
+import mock
+import unittest
+
+import koji
+import kojihub
+
+
+class TestHandleUpload(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tempdir, 'file')
+        self.context = mock.patch('kojihub.context').start()
+        self.context.session.logged_in = True
+        self.context.opts = {}
+        mock.patch('kojihub.get_upload_path', return_value=self.fn).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        shutil.rmtree(self.tempdir)
+
+    def upload(self, data, offset, parallel=False, overwrite=False, verify='adler32',
+               inf=None, length=None):
+        query = 'filename=file&filepath=target&fileverify=%s&offset=%i' % (verify, offset)
+        if parallel:
+            query += '&parallel=1'
+        if overwrite:
+            query += '&overwrite=1'
+        if length is None:
+            length = len(data)
+        environ = {
+            'QUERY_STRING': query,
+            'CONTENT_LENGTH': str(length),
+            'wsgi.input': inf or io.BytesIO(data),
+        }
+        return kojihub.handle_upload(environ)
+
+    def read(self):
+        with open(self.fn, 'rb') as fo:
+            return fo.read()
+
+    def test_parallel(self):
+        ret = self.upload(b'a' * 10, 0, parallel=True)
+        self.assertTrue(ret['parallel'])
+        # chunks arrive in any order and do not truncate the file
+        self.upload(b'c' * 10, 20, parallel=True)
+        ret = self.upload(b'b' * 10, 10, parallel=True)
+        self.assertEqual(ret['size'], 10)
+        self.assertEqual(ret['offset'], 10)
+        self.assertEqual(ret['hexdigest'], koji.util.adler32_constructor(b'b' * 10).hexdigest())
+        self.assertEqual(self.read(), b'a' * 10 + b'b' * 10 + b'c' * 10)
+
+    def test_sequential(self):
+        ret = self.upload(b'a' * 10, 0)
+        self.assertNotIn('parallel', ret)
+        self.upload(b'c' * 10, 20)
+        # a chunk truncates the file at its offset
+        self.upload(b'b' * 10, 10)
+        self.assertEqual(self.read(), b'a' * 10 + b'b' * 10)
+
+    def test_parallel_append(self):
+        with self.assertRaises(koji.GenericError):
+            self.upload(b'a', -1, parallel=True)
+
+    def test_parallel_exists(self):
+        self.upload(b'a' * 10, 0, parallel=True)
+        with self.assertRaises(koji.GenericError):
+            self.upload(b'a' * 10, 0, parallel=True)
+
+    def test_linked_upload(self):
+        # an upload that shares its data with a stored copy
+        self.upload(b'a' * 100, 0)
+        stored = os.path.join(self.tempdir, 'stored')
+        os.link(self.fn, stored)
+        self.upload(b'b' * 10, 50)
+        self.assertEqual(self.read(), b'a' * 50 + b'b' * 10)
+        with open(stored, 'rb') as fo:
+            self.assertEqual(fo.read(), b'a' * 100)
+        os.unlink(stored)
+        os.link(self.fn, stored)
+        self.upload(b'c' * 10, 0, overwrite=True)
+        self.assertEqual(self.read(), b'c' * 10)
+        with open(stored, 'rb') as fo:
+            self.assertEqual(fo.read(), b'a' * 50 + b'b' * 10)
+
+    def test_chunks(self):
+        self.context.opts = {'UploadChunkSize': 7}
+        data = os.urandom(100)
+        ret = self.upload(data, 0)
+        self.assertEqual(ret['size'], 100)
+        self.assertEqual(ret['hexdigest'], koji.util.adler32_constructor(data).hexdigest())
+        self.assertEqual(self.read(), data)
+
+    def test_input_without_readinto(self):
+        self.context.opts = {'UploadChunkSize': 7}
+        data = os.urandom(100)
+        inf = mock.MagicMock(spec=['read'])
+        inf.read.side_effect = io.BytesIO(data).read
+        ret = self.upload(data, 0, inf=inf)
+        self.assertEqual(ret['size'], 100)
+        inf.read.assert_called_with(7)
+        self.assertEqual(self.read(), data)
+
+    def test_no_verify(self):
+        ret = self.upload(b'a' * 10, 0, verify='')
+        self.assertEqual(ret['size'], 10)
+        self.assertNotIn('hexdigest', ret)
+        self.assertEqual(self.read(), b'a' * 10)
+
+    def test_preallocate(self):
+        self.context.opts = {'UploadPreallocate': True}
+        self.upload(b'a' * 10, 0)
+        self.assertEqual(self.read(), b'a' * 10)
+        # the client went away
+        ret = self.upload(b'b' * 10, 10, length=100)
+        self.assertEqual(ret['size'], 10)
+        self.assertEqual(self.read(), b'a' * 10 + b'b' * 10)
+
+    @mock.patch('os.posix_fallocate', create=True)
+    def test_preallocate_unsupported(self, posix_fallocate):
+        self.context.opts = {'UploadPreallocate': True}
+        posix_fallocate.side_effect = OSError(95, 'Operation not supported')
+        self.upload(b'a' * 10, 0)
+        posix_fallocate.assert_called_once_with(mock.ANY, 0, 10)
+        self.assertEqual(self.read(), b'a' * 10)
@@ -0,0 +1,138 @@
+import mock
+import unittest
+
+import koji
+import kojihub
+
+QP = kojihub.QueryProcessor
+
+
+class TestHostGetTask(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojihub.context').start()
+        self.context.opts = {}
+        self._singleValue = mock.patch('kojihub._singleValue',
+                                       return_value='x86_64 noarch').start()
+        self._fetchMulti = mock.patch('kojihub._fetchMulti', return_value=[[1], [3]]).start()
+        self.QueryProcessor = mock.patch('kojihub.QueryProcessor',
+                                         side_effect=self.getQuery).start()
+        self.queries = []
+        self.results = []
+        self.Task = mock.patch('kojihub.Task').start()
+        self.host = kojihub.Host.__new__(kojihub.Host)
+        self.host.id = 5
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def getQuery(self, *args, **kwargs):
+        query = QP(*args, **kwargs)
+        query.execute = mock.MagicMock(return_value=self.results.pop(0))
+        self.queries.append(query)
+        return query
+
+    def test_claim(self):
+        self.results = [[{'id': 10}, {'id': 11}]]
+        self.Task.return_value.open.side_effect = [None, {'id': 11}]
+        self.assertEqual(self.host.getTask(), {'id': 11})
+
+        self.assertEqual(len(self.queries), 1)
+        query = self.queries[0]
+        sql = str(query)
+        self.assertIn('ORDER BY priority, create_time', sql)
+        self.assertIn('LIMIT 10', sql)
+        self.assertTrue(sql.endswith('FOR UPDATE SKIP LOCKED'))
+        self.assertEqual(query.clauses, [
+            '(state = %(ASSIGNED)i AND host_id = %(host_id)i) OR '
+            '(state = %(FREE)i AND channel_id IN %(channels)s AND arch IN %(arches)s)',
+            'state IN (%(FREE)i, %(ASSIGNED)i)'])
+        self.assertEqual(query.values['arches'], ['x86_64', 'noarch'])
+        self.assertEqual(query.values['channels'], [1, 3])
+        self.assertEqual(self.Task.call_args_list, [mock.call(10), mock.call(11)])
+        self.Task.return_value.open.assert_called_with(5)
+
+    def test_retry(self):
+        self.results = [[{'id': i} for i in range(10)], [{'id': 42}]]
+        self.Task.return_value.open.side_effect = [None] * 11
+        self.assertIsNone(self.host.getTask())
+
+        self.assertEqual(len(self.queries), 2)
+        self.assertIn('id NOT IN %(skipped)s', self.queries[1].clauses)
+        self.assertEqual(self.queries[1].values['skipped'], list(range(10)))
+        self.assertEqual(self.Task.return_value.open.call_count, 11)
+
+    def test_methods(self):
+        self.results = [[]]
+        self._fetchMulti.return_value = []
+        self.assertIsNone(self.host.getTask(methods=['build']))
+        query = self.queries[0]
+        self.assertIn('method IN %(methods)s', query.clauses)
+        self.assertIn('(state = %(ASSIGNED)i AND host_id = %(host_id)i)', query.clauses)
+
+        self.assertIsNone(self.host.getTask(methods=[]))
+        self.assertEqual(len(self.queries), 1)
+
+    def test_arches(self):
+        self._singleValue.return_value = 'x86_64'
+        self.results = [[]]
+        self.assertIsNone(self.host.getTask())
+        self.assertEqual(self.queries[0].values['arches'], ['x86_64', 'noarch'])
+        # no arch IN ()
+        self._singleValue.return_value = ''
+        self.assertIsNone(self.host.getTask())
+        self.assertEqual(len(self.queries), 1)
+
+    def test_scheduler(self):
+        self.context.opts = {'TaskScheduler': True, 'TaskSchedulerInterval': 60}
+        schedule_tasks = mock.patch('kojihub.schedule_tasks').start()
+        mock.patch('kojihub._schedule_ts', new=[0]).start()
+        self.results = [[{'id': 10}], []]
+        self.Task.return_value.open.return_value = {'id': 10}
+        self.assertEqual(self.host.getTask(), {'id': 10})
+        schedule_tasks.assert_called_once_with()
+        # only the tasks the scheduler assigned to us
+        self.assertEqual(self.queries[0].clauses, [
+            '(state = %(ASSIGNED)i AND host_id = %(host_id)i)',
+            'state IN (%(FREE)i, %(ASSIGNED)i)'])
+        # the pass is throttled like for getLoadData
+        self.assertIsNone(self.host.getTask())
+        schedule_tasks.assert_called_once_with()
+
+    def test_exclude(self):
+        self.results = [[]]
+        self.assertIsNone(self.host.getTask(exclude=[7, 8]))
+        query = self.queries[0]
+        self.assertIn('id NOT IN %(skipped)s', query.clauses)
+        self.assertEqual(query.values['skipped'], [7, 8])
+
+
+class TestTaskLock(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojihub.context').start()
+        self.context.opts = {}
+        self._fetchSingle = mock.patch('kojihub._fetchSingle').start()
+        self.UpdateProcessor = mock.patch('kojihub.UpdateProcessor').start()
+        self.task = kojihub.Task(42)
+        self.task.getInfo = mock.MagicMock()
+        self.task.runCallbacks = mock.MagicMock()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_locked_elsewhere(self):
+        self._fetchSingle.side_effect = [None, [42]]
+        self.assertFalse(self.task.lock(1, 'OPEN'))
+        self.assertIn('SKIP LOCKED', self._fetchSingle.call_args_list[0][0][0])
+        self.UpdateProcessor.assert_not_called()
+
+    def test_missing(self):
+        self._fetchSingle.side_effect = [None, None]
+        with self.assertRaises(koji.GenericError):
+            self.task.lock(1, 'OPEN')
+
+    def test_free(self):
+        self._fetchSingle.return_value = [koji.TASK_STATES['FREE'], None]
+        self.assertTrue(self.task.lock(1, 'OPEN'))
+        self.UpdateProcessor.return_value.execute.assert_called_once()
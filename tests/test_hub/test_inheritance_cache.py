@@ -0,0 +1,185 @@
+import mock
+import unittest
+
+import kojihub
+
+
+def copier(value):
+    return list(value)
+
+
+class TestInheritanceCache(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojihub.context').start()
+        self.context.inheritance_cache = {}
+        self.context.event_id = None
+        self.cache = kojihub.InheritanceCache(size=2)
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_event_entries(self):
+        self.assertIsNone(self.cache.get('a', 100, copier))
+        value = [1, 2]
+        self.cache.set('a', 100, value, [1], copier)
+        value.append(3)
+        result = self.cache.get('a', 100, copier)
+        self.assertEqual(result, [1, 2])
+        result.append(4)
+        self.assertEqual(self.cache.get('a', 100, copier), [1, 2])
+        self.assertEqual(self.context.inheritance_cache, {})
+
+        # event entries survive the request
+        self.context.inheritance_cache = {}
+        self.assertEqual(self.cache.get('a', 100, copier), [1, 2])
+
+        stats = self.cache.get_stats()
+        self.assertEqual(stats['event_hits'], 3)
+        self.assertEqual(stats['event_misses'], 1)
+        self.assertEqual(stats['entries'], 1)
+
+    def test_lru(self):
+        self.cache.set('a', 100, [1], [1], copier)
+        self.cache.set('b', 100, [2], [1], copier)
+        self.cache.get('a', 100, copier)
+        self.cache.set('c', 100, [3], [1], copier)
+        # b was the least recently used
+        self.assertIsNone(self.cache.get('b', 100, copier))
+        self.assertEqual(self.cache.get('a', 100, copier), [1])
+        self.assertEqual(self.cache.get('c', 100, copier), [3])
+
+        self.cache.configure(0, 3600)
+        self.assertEqual(self.cache.get_stats()['entries'], 0)
+        self.cache.set('a', 100, [1], [1], copier)
+        self.assertIsNone(self.cache.get('a', 100, copier))
+
+    @mock.patch('time.time')
+    def test_max_age(self, time):
+        time.return_value = 1000
+        self.cache.set('a', 100, [1], [1], copier)
+        time.return_value = 1000 + 3599
+        self.assertEqual(self.cache.get('a', 100, copier), [1])
+        time.return_value = 1000 + 3600
+        self.assertIsNone(self.cache.get('a', 100, copier))
+
+    def test_current_entries(self):
+        self.cache.set('a', None, [1], [1, 2], copier)
+        self.cache.set('b', None, [2], [2, 3], copier)
+        self.assertEqual(self.cache.get('a', None, copier), [1])
+        self.assertEqual(self.cache.get_stats()['entries'], 0)
+
+        self.cache.invalidate([3])
+        self.assertEqual(self.cache.get('a', None, copier), [1])
+        self.assertIsNone(self.cache.get('b', None, copier))
+        self.cache.invalidate([1, 5])
+        self.assertIsNone(self.cache.get('a', None, copier))
+
+        # only kept for the request
+        self.cache.set('a', None, [1], [1, 2], copier)
+        self.context.inheritance_cache = None
+        self.assertIsNone(self.cache.get('a', None, copier))
+
+        stats = self.cache.get_stats()
+        self.assertEqual(stats['current_hits'], 2)
+        self.assertEqual(stats['current_misses'], 3)
+        self.assertEqual(stats['invalidations'], 2)
+
+    def test_own_event(self):
+        # data at the event of our own changes is not final
+        self.context.event_id = 100
+        self.cache.set('a', 100, [1], [1], copier)
+        self.assertEqual(self.cache.get_stats()['entries'], 0)
+        self.cache.invalidate([1])
+        self.assertIsNone(self.cache.get('a', 100, copier))
+
+
+class TestCachedInheritance(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojihub.context').start()
+        self.context.inheritance_cache = {}
+        self.context.event_id = None
+        kojihub.inheritance_cache.clear()
+        self.readInheritanceGraph = mock.patch('kojihub.readInheritanceGraph').start()
+        self.readInheritanceGraph.return_value = {
+            1: [{'parent_id': 2, 'child_id': 1, 'name': 'parent', 'priority': 10,
+                 'maxdepth': None, 'intransitive': False, 'noconfig': False,
+                 'pkg_filter': 'foo'}],
+        }
+        self.QueryProcessor = mock.patch('kojihub.QueryProcessor').start()
+        self.query = self.QueryProcessor.return_value
+        self.query.values = {}
+        self.query.execute.side_effect = self.query_execute
+        self.packages = {
+            1: [{'package_id': 10, 'package_name': 'foo', 'tag_id': 1, 'blocked': False}],
+            2: [{'package_id': 10, 'package_name': 'foo', 'tag_id': 2, 'blocked': False},
+                {'package_id': 11, 'package_name': 'foobar', 'tag_id': 2, 'blocked': False},
+                {'package_id': 12, 'package_name': 'bar', 'tag_id': 2, 'blocked': False}],
+        }
+
+    def tearDown(self):
+        kojihub.inheritance_cache.clear()
+        mock.patch.stopall()
+
+    def query_execute(self):
+        if 'tagID' in self.query.values:
+            tag_id = self.query.values['tagID']
+        else:
+            tag_id = self.QueryProcessor.call_args[1]['values']['tagID']
+        return [p.copy() for p in self.packages[tag_id]]
+
+    def test_read_full_inheritance(self):
+        for event in (None, 1234):
+            self.readInheritanceGraph.reset_mock()
+            order = kojihub.readFullInheritance(1, event=event)
+            self.assertEqual([link['parent_id'] for link in order], [2])
+            order[0]['filter'].append('bar')
+            order = kojihub.readFullInheritance(1, event=event)
+            self.assertEqual(order[0]['filter'], ['foo'])
+            self.readInheritanceGraph.assert_called_once_with(1, event, False)
+
+    def test_read_package_list(self):
+        packages = kojihub.readPackageList(tagID=1, inherit=True, with_owners=False)
+        self.assertEqual(sorted(packages), [10, 11])
+        self.assertEqual(packages[10]['tag_id'], 1)
+        calls = self.query.execute.call_count
+        packages[10]['blocked'] = True
+
+        packages = kojihub.readPackageList(tagID=1, inherit=True, with_owners=False)
+        self.assertEqual(sorted(packages), [10, 11])
+        self.assertFalse(packages[10]['blocked'])
+        self.assertEqual(self.query.execute.call_count, calls)
+
+        # different options are a different entry
+        kojihub.readPackageList(tagID=1, inherit=True, with_dups=True, with_owners=False)
+        self.assertGreater(self.query.execute.call_count, calls)
+
+    @mock.patch('kojihub.UpdateProcessor')
+    def test_pkglist_change_invalidates(self, UpdateProcessor):
+        kojihub.readPackageList(tagID=1, inherit=True, with_owners=False)
+        calls = self.query.execute.call_count
+        # a parent tag changed
+        kojihub._pkglist_remove(2, 12)
+        kojihub.readPackageList(tagID=1, inherit=True, with_owners=False)
+        self.assertGreater(self.query.execute.call_count, calls)
+
+    @mock.patch('kojihub.get_tag')
+    @mock.patch('kojihub.readInheritanceData')
+    @mock.patch('kojihub.InsertProcessor')
+    @mock.patch('kojihub.UpdateProcessor')
+    def test_write_inheritance_invalidates(self, UpdateProcessor, InsertProcessor,
+                                           readInheritanceData, get_tag):
+        readInheritanceData.return_value = []
+        kojihub.readFullInheritance(1)
+        kojihub.readFullInheritance(3, reverse=True)
+        self.assertEqual(self.readInheritanceGraph.call_count, 2)
+
+        link = {'parent_id': 3, 'priority': 10, 'maxdepth': None, 'intransitive': False,
+                'noconfig': False, 'pkg_filter': ''}
+        kojihub._writeInheritanceData(1, [link])
+
+        # both the child and the new parent are affected
+        kojihub.readFullInheritance(1)
+        kojihub.readFullInheritance(3, reverse=True)
+        self.assertEqual(self.readInheritanceGraph.call_count, 4)
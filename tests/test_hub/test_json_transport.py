@@ -0,0 +1,82 @@
+import datetime
+import io
+
+import mock
+import unittest
+
+import koji
+import kojixmlrpc
+from kojixmlrpc import ModXMLRPCRequestHandler, StreamedResponse
+
+
+class TestJSONTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojixmlrpc.context').start()
+        self.context.commit_pending = False
+        self.context.opts = {'ResponseChunkSize': 1000, 'MemoryWarnThreshold': 5000}
+        mock.patch('kojixmlrpc.opts', {'MaxRequestLength': 4194304}, create=True).start()
+        mock.patch('kojixmlrpc.get_memory_usage', return_value=0).start()
+        self.h = ModXMLRPCRequestHandler(mock.MagicMock())
+        self.h.logger = mock.MagicMock()
+        self.h.use_json = True
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def wrap(self, result):
+        return self.h._wrap_handler(lambda environ: result, {})
+
+    def test_response(self):
+        ts = datetime.datetime(2020, 1, 2, 3, 4, 5)
+        head, rest = self.wrap({'id': 1, 'ts': ts})
+        self.assertIsNone(rest)
+        self.assertEqual(self.h.content_type, 'application/json')
+        self.assertEqual(koji.jsonplus.loads_response(b''.join(head)),
+                         {'id': 1, 'ts': '2020-01-02 03:04:05'})
+
+    def test_stream(self):
+        rows = ({'id': n, 'name': 'x' * 100} for n in range(1000))
+        head, rest = self.wrap(rows)
+        self.assertEqual(len(head), 2)
+        response = StreamedResponse(self.h, head, rest, 0, 0)
+        data = b''.join(response)
+        response.close()
+        self.assertEqual(len(koji.jsonplus.loads_response(data)), 1000)
+
+    def test_fault(self):
+        def handler(environ):
+            raise koji.GenericError('no such build')
+        head, rest = self.h._wrap_handler(handler, {})
+        self.assertIsNone(rest)
+        with self.assertRaises(koji.xmlrpcplus.Fault) as cm:
+            koji.jsonplus.loads_response(b''.join(head))
+        self.assertEqual(cm.exception.faultString, 'no such build')
+        self.assertEqual(cm.exception.faultCode, koji.GenericError.faultCode)
+
+    def test_request(self):
+        self.h._dispatch = mock.MagicMock()
+        data = koji.jsonplus.dumps_request('getBuild', [1, {'strict': True, '__starstar': True}])
+        environ = {'CONTENT_TYPE': 'application/json', 'wsgi.input': io.BytesIO(data)}
+        self.h.handle_rpc(environ)
+        self.h._dispatch.assert_called_once_with(
+            'getBuild', (1, {'strict': True, '__starstar': True}))
+
+    def test_bytes(self):
+        self.h._dispatch = mock.MagicMock(return_value={'sigmd5': b'\x00\x01'})
+        data = koji.xmlrpcplus.dumps((1,), methodname='getRPMHeaders').encode()
+        environ = {'CONTENT_TYPE': 'text/xml', 'wsgi.input': io.BytesIO(data)}
+        head, rest = self.h._wrap_handler(self.h.handle_rpc, environ)
+        self.assertIsNone(rest)
+        result = koji.jsonplus.loads_response(b''.join(head))
+        self.assertEqual(result['sigmd5'].data, b'\x00\x01')
+
+    def test_bad_request(self):
+        environ = {'CONTENT_TYPE': 'application/json', 'wsgi.input': io.BytesIO(b'[1, 2]')}
+        with self.assertRaises(koji.GenericError):
+            self.h.handle_rpc(environ)
+
+    def test_json_default(self):
+        self.assertEqual(kojixmlrpc.json_default(datetime.datetime(2020, 1, 2)),
+                         '2020-01-02 00:00:00')
+        self.assertIs(kojixmlrpc.json_default(object()), NotImplemented)
@@ -1,7 +1,9 @@
 import mock
 import unittest
 
+import koji
 import kojixmlrpc
+from koji.plugin import readonly
 from kojixmlrpc import Fault, HandlerRegistry, ModXMLRPCRequestHandler
 
 
@@ -12,6 +14,21 @@ class DummyExports(object):
             raise err
         return bar
 
+    @readonly
+    def getFoo(self, bar, err=None):
+        if err:
+            raise err
+        return bar
+
+    @readonly
+    def getBar(self, bar):
+        return bar
+
+    @readonly
+    def listFoo(self, n):
+        for i in range(n):
+            yield i
+
 
 class TestMulticall(unittest.TestCase):
 
@@ -38,3 +55,85 @@ class TestMulticall(unittest.TestCase):
                                'traceback': mock.ANY},
                               {'faultCode': 2, 'faultString': 'xmlrpc fault'}])
         self.assertFalse(hasattr(kojixmlrpc.context, 'event_id'))
+
+
+class TestReadOnlyMulticall(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojixmlrpc.context').start()
+        self.context.opts = {'ReadOnlyMultiCall': True}
+        self.context.commit_pending = False
+        self.context.streamed_results = False
+        self.context.replica = None
+        self.kojihub = mock.patch('kojixmlrpc.kojihub').start()
+        self.Savepoint = self.kojihub.Savepoint
+        self.registry = HandlerRegistry()
+        self.registry.register_instance(DummyExports())
+        self.h = ModXMLRPCRequestHandler(self.registry)
+        self.h.logger = mock.MagicMock()
+        self.h.check_session = mock.MagicMock()
+        self.h.enforce_lockout = mock.MagicMock()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_readonly(self):
+        calls = [{'methodName': 'getFoo', 'params': [1]},
+                 {'methodName': 'getBar', 'params': [{'bar': 2, '__starstar': True}]},
+                 {'methodName': 'getFoo', 'params': [3, koji.GenericError('not found')]},
+                 {'methodName': 'getBar', 'params': [4, 5]},
+                 {'methodName': 'getFoo', 'params': [6]}]
+        rv = self.h.multiCall(calls)
+        self.assertEqual(rv, [[1], [2],
+                              {'faultCode': 1000, 'faultString': 'not found',
+                               'traceback': mock.ANY},
+                              {'faultCode': koji.ParameterError.faultCode,
+                               'faultString': mock.ANY, 'traceback': mock.ANY},
+                              [6]])
+        self.Savepoint.assert_not_called()
+        self.assertEqual(self.context.cnx.rollback.call_count, 2)
+        self.assertFalse(self.context.commit_pending)
+        # one log line for all the calls
+        self.h.logger.info.assert_called_once_with(
+            mock.ANY, 5, 'getBar: 2, getFoo: 3', 2, mock.ANY, mock.ANY, mock.ANY)
+        self.assertEqual(self.context.method, 'multiCall')
+
+    def test_streamed(self):
+        cursor = self.context.cnx.cursor.return_value
+        calls = [{'methodName': 'getFoo', 'params': [1, koji.GenericError('not found')]},
+                 {'methodName': 'listFoo', 'params': [3]},
+                 {'methodName': 'getFoo', 'params': [2, koji.GenericError('not found')]},
+                 {'methodName': 'getFoo', 'params': [4]}]
+        rv = self.h.multiCall(calls)
+        self.assertEqual(rv[2]['faultString'], 'not found')
+        self.assertEqual(rv[3], [4])
+        # before the streamed result, the transaction is rolled back
+        self.context.cnx.rollback.assert_called_once()
+        # after it, only to a savepoint, so the cursor of the result is kept
+        self.assertEqual([c[0][0] for c in cursor.execute.call_args_list], [
+            'SAVEPOINT read_only_call',
+            'ROLLBACK TO SAVEPOINT read_only_call',
+            'SAVEPOINT read_only_call',
+            'RELEASE SAVEPOINT read_only_call'])
+        self.assertEqual(list(rv[1][0]), [0, 1, 2])
+        self.Savepoint.assert_not_called()
+        self.assertFalse(self.context.commit_pending)
+
+    def test_mixed(self):
+        calls = [{'methodName': 'getFoo', 'params': [1]},
+                 {'methodName': 'foo', 'params': [2]}]
+        self.assertEqual(self.h.multiCall(calls), [[1], [2]])
+        self.assertEqual(self.Savepoint.call_count, 2)
+
+    def test_invalid_method(self):
+        calls = [{'methodName': 'getFoo', 'params': [1]},
+                 {'methodName': 'non', 'params': []}]
+        rv = self.h.multiCall(calls)
+        self.assertEqual(rv[1]['faultString'], 'Invalid method: non')
+        self.assertEqual(self.Savepoint.call_count, 2)
+
+    def test_disabled(self):
+        self.context.opts['ReadOnlyMultiCall'] = False
+        calls = [{'methodName': 'getFoo', 'params': [1]}]
+        self.assertEqual(self.h.multiCall(calls), [[1]])
+        self.Savepoint.assert_called_once()
@@ -104,6 +104,23 @@ class TestQueryProcessor(unittest.TestCase):
 
 
 
+    @mock.patch('kojihub.context')
+    def test_iterate_connection(self, context):
+        cnx = context.cnx
+        cursor = cnx.cursor.return_value
+        cursor.fetchall.side_effect = [[('value number 1',)], []]
+        proc = kojihub.QueryProcessor(**self.simple_arguments)
+        generator = proc.iterate()
+        # the cursor is declared by the call, not when the rows are read
+        self.assertEqual(len(cursor.execute.mock_calls), 1)
+        self.assertTrue(cursor.execute.call_args[0][0].startswith('DECLARE'))
+        # e.g. a read-only call done on the replica
+        context.cnx = mock.MagicMock()
+        self.assertEqual(list(generator), [{'something': 'value number 1'}])
+        self.assertEqual(len(cursor.execute.mock_calls), 4)
+        self.assertTrue(cursor.execute.call_args[0][0].startswith('CLOSE'))
+        context.cnx.cursor.assert_not_called()
+
     @mock.patch('kojihub.context')
     def test_simple_execution_with_iterate(self, context):
         cursor = mock.MagicMock()
@@ -0,0 +1,206 @@
+import copy
+import time
+import unittest
+
+import mock
+
+import kojihub
+
+
+class FakeInheritanceDB(object):
+    """In-memory tag_inheritance table with simulated query latency"""
+
+    def __init__(self, links, latency=0.0):
+        # links: list of (tag_id, parent_id, priority, maxdepth, intransitive, noconfig, filter)
+        self.links = links
+        self.latency = latency
+        self.queries = 0
+
+    def _link(self, row):
+        tag_id, parent_id, priority, maxdepth, intransitive, noconfig, pkg_filter = row
+        return {
+            'tag_id': tag_id,
+            'parent_id': parent_id,
+            'priority': priority,
+            'maxdepth': maxdepth,
+            'intransitive': intransitive,
+            'noconfig': noconfig,
+            'pkg_filter': pkg_filter,
+        }
+
+    def _query(self):
+        self.queries += 1
+        time.sleep(self.latency)
+
+    def readInheritanceData(self, tag_id, event=None):
+        self._query()
+        ret = []
+        for row in sorted(self.links, key=lambda r: r[2]):
+            if row[0] == tag_id:
+                link = self._link(row)
+                del link['tag_id']
+                link['name'] = 'tag-%i' % link['parent_id']
+                link['child_id'] = tag_id
+                ret.append(link)
+        return ret
+
+    def readDescendantsData(self, tag_id, event=None):
+        self._query()
+        ret = []
+        for row in sorted(self.links, key=lambda r: r[2]):
+            if row[1] == tag_id:
+                link = self._link(row)
+                link['name'] = 'tag-%i' % link['tag_id']
+                ret.append(link)
+        return ret
+
+    def _multiRow(self, query, values, fields):
+        # emulates the recursive query from readInheritanceGraph
+        self._query()
+        reverse = fields[0] == 'tag_id'
+        follow, key = ('parent_id', 'tag_id') if reverse else ('tag_id', 'parent_id')
+        nodes = set([values['tag_id']])
+        while True:
+            new = set([r[key] for r in map(self._link, self.links) if r[follow] in nodes])
+            if new <= nodes:
+                break
+            nodes |= new
+        ret = []
+        for row in sorted(self.links, key=lambda r: r[2]):
+            link = self._link(row)
+            if link[follow] not in nodes:
+                continue
+            link['name'] = 'tag-%i' % link[key]
+            link['node_id'] = link[follow]
+            ret.append(dict([(f, link[f]) for f in fields]))
+        return ret
+
+
+class TestReadFullInheritance(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojihub.context').start()
+        self.log_error = mock.patch('kojihub.log_error').start()
+        kojihub.inheritance_cache.clear()
+
+    def tearDown(self):
+        kojihub.inheritance_cache.clear()
+        mock.patch.stopall()
+
+    def use_db(self, db):
+        mock.patch('kojihub.readInheritanceData', new=db.readInheritanceData).start()
+        mock.patch('kojihub.readDescendantsData', new=db.readDescendantsData).start()
+        mock.patch('kojihub._multiRow', new=db._multiRow).start()
+
+    def read_per_node(self, tag_id, event=None, reverse=False):
+        # the original one-query-per-tag walk
+        order = []
+        kojihub.readFullInheritanceRecurse(tag_id, event, order, {}, {}, 0, None, False, [],
+                                           reverse)
+        return order
+
+    def compare(self, links, tag_id=1):
+        db = FakeInheritanceDB(links)
+        self.use_db(db)
+        for reverse in (False, True):
+            expected = self.read_per_node(tag_id, reverse=reverse)
+            db.queries = 0
+            result = kojihub.readFullInheritance(tag_id, reverse=reverse)
+            self.assertEqual(result, expected)
+            self.assertEqual(db.queries, 1)
+        return result
+
+    def test_simple_chain(self):
+        links = [(1, 2, 10, None, False, False, ''),
+                 (2, 3, 10, None, False, False, '')]
+        self.compare(links)
+        self.assertEqual([link['parent_id'] for link in kojihub.readFullInheritance(1)],
+                         [2, 3])
+        # no inheritance at all
+        self.assertEqual(self.compare(links, tag_id=4), [])
+
+    def test_options(self):
+        links = [
+            (1, 2, 10, None, False, False, ''),
+            (1, 3, 20, 1, False, True, ''),
+            (1, 4, 30, None, True, False, 'foo.*'),
+            (2, 5, 10, 2, False, True, 'bar'),
+            (2, 6, 20, None, True, False, ''),
+            (3, 7, 10, None, False, False, ''),
+            (5, 8, 10, None, False, False, ''),
+            (8, 9, 10, None, False, False, ''),
+            (4, 10, 10, None, False, False, 'baz'),
+            (7, 5, 10, None, False, False, ''),
+        ]
+        self.compare(links)
+        self.compare(links, tag_id=5)
+
+    def test_loops_and_diamonds(self):
+        links = [
+            (1, 2, 10, None, False, False, ''),
+            (1, 3, 20, None, False, False, ''),
+            (2, 4, 10, None, False, False, ''),
+            (3, 4, 10, 1, False, False, 'x'),
+            (4, 1, 10, None, False, False, ''),
+            (4, 5, 20, None, False, False, ''),
+            (5, 2, 10, None, False, False, ''),
+        ]
+        self.compare(links)
+        self.compare(links, tag_id=4)
+
+    def test_event(self):
+        db = FakeInheritanceDB([(1, 2, 10, None, False, False, '')])
+        self.use_db(db)
+        _multiRow = mock.MagicMock(side_effect=db._multiRow)
+        mock.patch('kojihub._multiRow', new=_multiRow).start()
+        kojihub.readFullInheritance(1, event=1234)
+        query = _multiRow.call_args[0][0]
+        self.assertIn('WITH RECURSIVE', query)
+        self.assertIn('1234', query)
+        self.assertNotIn('active = TRUE', query)
+
+    def test_results_not_shared(self):
+        # annotated links must not leak between calls through the graph
+        links = [(1, 2, 10, 1, False, False, 'a'),
+                 (1, 3, 20, None, False, False, ''),
+                 (3, 2, 10, None, False, False, '')]
+        db = FakeInheritanceDB(links)
+        self.use_db(db)
+        graph = kojihub.readInheritanceGraph(1)
+        orig = copy.deepcopy(graph)
+        order = []
+        kojihub.readFullInheritanceRecurse(1, None, order, {}, {}, 0, None, False, [], False,
+                                           graph=graph)
+        self.assertEqual(graph, orig)
+        self.assertEqual([link['parent_id'] for link in order], [2, 3, 2])
+
+    def test_deep_tree_timing(self):
+        # a deep synthetic tree: a 50 tag chain, each with a few leaf parents
+        links = []
+        tag_id = 1
+        next_id = 1000
+        for depth in range(50):
+            links.append((tag_id, tag_id + 1, 10, None, False, False, ''))
+            for n in range(3):
+                links.append((tag_id, next_id, 20 + n, 2, n == 1, n == 2, ''))
+                next_id += 1
+            tag_id += 1
+        db = FakeInheritanceDB(links, latency=0.001)
+        self.use_db(db)
+
+        start = time.time()
+        expected = self.read_per_node(1)
+        per_node_time = time.time() - start
+        per_node_queries = db.queries
+
+        db.queries = 0
+        start = time.time()
+        result = kojihub.readFullInheritance(1)
+        graph_time = time.time() - start
+
+        self.assertEqual(result, expected)
+        # intransitive links are only followed from the root tag
+        self.assertEqual(len(result), 200 - 49)
+        self.assertEqual(db.queries, 1)
+        self.assertGreater(per_node_queries, 100)
+        self.assertLess(graph_time, per_node_time)
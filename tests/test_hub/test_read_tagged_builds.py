@@ -0,0 +1,98 @@
+import mock
+import unittest
+
+import kojihub
+
+
+class TestReadTaggedBuilds(unittest.TestCase):
+
+    def setUp(self):
+        self.readFullInheritance = mock.patch('kojihub.readFullInheritance').start()
+        self.readFullInheritance.return_value = [
+            {'parent_id': 2, 'filter': []},
+            {'parent_id': 3, 'filter': []},
+        ]
+        self.readPackageList = mock.patch('kojihub.readPackageList').start()
+        self._multiRow = mock.patch('kojihub._multiRow').start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_single_query(self):
+        query_result = [{'id': 10, 'package_id': 100, 'inh_order': 0}]
+        with mock.patch('kojihub.QueryProcessor') as QueryProcessor:
+            QueryProcessor.return_value.execute.return_value = query_result
+            builds = kojihub.readTaggedBuilds(1, inherit=True)
+
+            QueryProcessor.assert_called_once()
+            kwargs = QueryProcessor.call_args[1]
+            self.assertEqual(kwargs['opts'], {'order': 'inh_order,-create_event'})
+            self.assertIn('(VALUES (1, 0), (2, 1), (3, 2)) AS taglist(tag_id, inh_order) '
+                          'ON taglist.tag_id = tag_listing.tag_id', kwargs['joins'])
+            self.assertIn('NOT pkglist.blocked', kwargs['clauses'])
+        self.assertEqual(builds, [{'id': 10, 'package_id': 100}])
+        self.readPackageList.assert_not_called()
+        self._multiRow.assert_not_called()
+
+    def test_single_query_no_inherit(self):
+        with mock.patch('kojihub.QueryProcessor') as QueryProcessor:
+            QueryProcessor.return_value.execute.return_value = []
+            kojihub.readTaggedBuilds(1, inherit=False, event=1234)
+            kwargs = QueryProcessor.call_args[1]
+        # builds only from the tag itself, but the package list is still inherited
+        self.assertEqual(kwargs['joins'][0],
+                         '(VALUES (1, 0)) AS taglist(tag_id, inh_order) '
+                         'ON taglist.tag_id = tag_listing.tag_id')
+        self.assertIn('(VALUES (1, 0), (2, 1), (3, 2)) AS pkg_taglist', kwargs['joins'][-1])
+        self.assertIn('tag_packages.create_event <= 1234', kwargs['joins'][-1])
+        self.readFullInheritance.assert_called_once_with(1, 1234)
+
+    def test_single_query_latest(self):
+        self._multiRow.return_value = [
+            {'id': 10, 'package_id': 100, 'inh_order': 0, 'latest_rank': 1},
+            {'id': 11, 'package_id': 100, 'inh_order': 1, 'latest_rank': 2},
+        ]
+        with mock.patch('kojihub.QueryProcessor') as QueryProcessor:
+            QueryProcessor.return_value.__str__.return_value = 'INNER QUERY'
+            QueryProcessor.return_value.aliases = ['id', 'inh_order', 'latest_rank',
+                                                   'package_id']
+            builds = kojihub.readTaggedBuilds(1, inherit=True, latest=2, package='foo')
+            kwargs = QueryProcessor.call_args[1]
+        self.assertIn('latest_rank', kwargs['aliases'])
+        self.assertIn('row_number() OVER (PARTITION BY build.pkg_id '
+                      'ORDER BY taglist.inh_order, tag_listing.create_event DESC) '
+                      'AS latest_rank', kwargs['columns'])
+        self.assertIn('package.name = %(package)s', kwargs['clauses'])
+        self._multiRow.assert_called_once()
+        query, values, fields = self._multiRow.call_args[0]
+        self.assertIn('FROM (INNER QUERY) AS ranked', query)
+        self.assertIn('latest_rank <= %(latest_n)i', query)
+        self.assertEqual(values['latest_n'], 2)
+        self.assertEqual(builds, [{'id': 10, 'package_id': 100}, {'id': 11, 'package_id': 100}])
+
+    def test_pkg_filter_fallback(self):
+        self.readFullInheritance.return_value = [
+            {'parent_id': 2, 'filter': []},
+            {'parent_id': 3, 'filter': ['foo.*']},
+        ]
+        self.readPackageList.return_value = {
+            100: {'package_id': 100, 'blocked': False},
+            101: {'package_id': 101, 'blocked': True},
+        }
+        results = {
+            1: [{'id': 10, 'package_id': 100}],
+            2: [{'id': 11, 'package_id': 100}, {'id': 12, 'package_id': 101}],
+            3: [{'id': 13, 'package_id': 102}],
+        }
+        with mock.patch('kojihub.QueryProcessor') as QueryProcessor:
+            query = QueryProcessor.return_value
+            query.values = {}
+            query.execute.side_effect = lambda: results[query.values['tagid']]
+            builds = kojihub.readTaggedBuilds(1, inherit=True, latest=True)
+            # one query per tag
+            self.assertEqual(query.execute.call_count, 3)
+            kwargs = QueryProcessor.call_args[1]
+            self.assertIn('tag_id = %(tagid)s', kwargs['clauses'])
+        self.readPackageList.assert_called_once_with(tagID=1, event=None, inherit=True,
+                                                     pkgID=None, with_owners=False)
+        self.assertEqual(builds, [{'id': 10, 'package_id': 100}])
@@ -0,0 +1,139 @@
+import mock
+import unittest
+
+import kojixmlrpc
+from kojixmlrpc import HandlerRegistry, ModXMLRPCRequestHandler
+from koji.plugin import readonly
+
+
+class DummyExports(object):
+
+    def __init__(self):
+        self.connections = []
+
+    @readonly
+    def getFoo(self, foo, event=None):
+        self.connections.append(kojixmlrpc.context.cnx)
+        return foo
+
+    @readonly
+    def listFoo(self, n):
+        # like the results of QueryProcessor.iterate, read while the response is sent
+        try:
+            for i in range(n):
+                self.connections.append(kojixmlrpc.context.cnx)
+                yield i
+        finally:
+            self.connections.append(kojixmlrpc.context.cnx)
+
+    @readonly
+    def getBroken(self):
+        raise Exception('failed')
+
+    def setFoo(self, foo):
+        self.connections.append(kojixmlrpc.context.cnx)
+        kojixmlrpc.context.commit_pending = True
+
+
+class TestReplicaRouting(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojixmlrpc.context').start()
+        self.context.commit_pending = False
+        self.context.streamed_results = False
+        self.context.opts = {'DBReplicaMaxLag': 30}
+        del self.context.replica
+        self.primary = self.context.cnx
+        self.replica = mock.MagicMock()
+        self.cursor = self.replica.cursor.return_value
+        self.cursor.fetchone.return_value = (0, 100)
+        self.connectReplica = mock.patch('koji.db.connectReplica',
+                                         return_value=self.replica).start()
+        self.registry = HandlerRegistry()
+        self.exports = DummyExports()
+        self.registry.register_instance(self.exports)
+        self.handler = ModXMLRPCRequestHandler(self.registry)
+        self.handler.check_session = mock.MagicMock()
+        self.handler.enforce_lockout = mock.MagicMock()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_routing(self):
+        self.handler._dispatch('getFoo', [1])
+        self.handler._dispatch('getFoo', [1, 100])
+        self.handler._dispatch('setFoo', [1])
+        # the request wrote to the primary, it must see its own changes now
+        self.handler._dispatch('getFoo', [1])
+        self.assertEqual(self.exports.connections,
+                         [self.replica, self.replica, self.primary, self.primary])
+        self.assertIs(self.context.cnx, self.primary)
+        # lag is only checked once per request
+        self.connectReplica.assert_called_once()
+
+    def test_event_guard(self):
+        self.handler._dispatch('getFoo', [1, 101])
+        self.handler._dispatch('getFoo', [1, {'event': 101, '__starstar': True}])
+        self.handler._dispatch('getFoo', [1, {'event': 100, '__starstar': True}])
+        self.assertEqual(self.exports.connections,
+                         [self.primary, self.primary, self.replica])
+
+    def test_lag(self):
+        self.cursor.fetchone.return_value = (31.5, 100)
+        self.handler._dispatch('getFoo', [1])
+        self.assertEqual(self.exports.connections, [self.primary])
+        self.replica.close.assert_called_once()
+        self.assertIsNone(self.context.replica)
+
+    def test_replica_unavailable(self):
+        self.connectReplica.side_effect = Exception('connection refused')
+        self.handler._dispatch('getFoo', [1])
+        self.assertEqual(self.exports.connections, [self.primary])
+
+    def test_not_configured(self):
+        self.connectReplica.return_value = None
+        self.handler._dispatch('getFoo', [1])
+        self.assertEqual(self.exports.connections, [self.primary])
+
+    def test_error(self):
+        with self.assertRaises(Exception):
+            self.handler._dispatch('getBroken', [])
+        self.replica.rollback.assert_called_once()
+        self.assertIs(self.context.cnx, self.primary)
+
+    def test_generator(self):
+        result = self.handler._dispatch('listFoo', [2])
+        self.assertEqual(self.exports.connections, [])
+        self.assertIs(self.context.cnx, self.primary)
+        self.assertEqual(list(result), [0, 1])
+        self.assertEqual(self.exports.connections, [self.replica] * 3)
+        self.assertIs(self.context.cnx, self.primary)
+        # not read to the end
+        self.exports.connections = []
+        result = self.handler._dispatch('listFoo', [2])
+        next(result)
+        result.close()
+        self.assertEqual(self.exports.connections, [self.replica] * 2)
+        self.assertIs(self.context.cnx, self.primary)
+
+    def test_streamed_error(self):
+        self.context.opts['ReadOnlyMultiCall'] = True
+        calls = [{'methodName': 'listFoo', 'params': [2]},
+                 {'methodName': 'getBroken', 'params': []}]
+        rv = self.handler.multiCall(calls)
+        self.assertEqual(rv[1]['faultString'], 'failed')
+        # the replica cursor of the first result is kept
+        self.replica.rollback.assert_not_called()
+        self.assertEqual(self.cursor.execute.call_args[0][0],
+                         'ROLLBACK TO SAVEPOINT read_only_call')
+        self.assertEqual(list(rv[0][0]), [0, 1])
+
+    def test_multicall(self):
+        # read-only multicalls have no savepoints, which would count as writes
+        self.context.opts['ReadOnlyMultiCall'] = True
+        calls = [{'methodName': 'getFoo', 'params': [1]},
+                 {'methodName': 'getFoo', 'params': [2, 101]},
+                 {'methodName': 'getFoo', 'params': [3, 100]}]
+        self.assertEqual(self.handler.multiCall(calls), [[1], [2], [3]])
+        self.assertEqual(self.exports.connections,
+                         [self.replica, self.primary, self.replica])
@@ -0,0 +1,142 @@
+import mock
+import unittest
+
+import kojihub
+
+
+QP = kojihub.QueryProcessor
+
+
+class TestScheduleTasks(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojihub.context').start()
+        self.context.opts = {'TaskScheduler': True, 'TaskSchedulerInterval': 1,
+                             'TaskSchedulerBatch': 100}
+        self._singleValue = mock.patch('kojihub._singleValue', return_value=True).start()
+        self._fetchMulti = mock.patch('kojihub._fetchMulti').start()
+        self.get_ready_hosts = mock.patch('kojihub.get_ready_hosts').start()
+        self.Task = mock.patch('kojihub.Task').start()
+        self.QueryProcessor = mock.patch('kojihub.QueryProcessor',
+                                         side_effect=self.getQuery).start()
+        self.queries = []
+        self.hosts = [
+            {'id': 1, 'channels': [1], 'arches': 'x86_64', 'capacity': 2.0, 'task_load': 0.0},
+            {'id': 2, 'channels': [1], 'arches': 'x86_64', 'capacity': 4.0, 'task_load': 1.0},
+        ]
+        self.get_ready_hosts.return_value = self.hosts
+        self.tasks = [
+            {'id': 10, 'channel_id': 1, 'arch': 'x86_64', 'weight': 1.0},
+            {'id': 11, 'channel_id': 1, 'arch': 'noarch', 'weight': 1.0},
+            {'id': 12, 'channel_id': 2, 'arch': 'x86_64', 'weight': 1.0},
+        ]
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def getQuery(self, *args, **kwargs):
+        query = QP(*args, **kwargs)
+        query.execute = mock.MagicMock(return_value=self.tasks)
+        self.queries.append(query)
+        return query
+
+    def test_schedule(self):
+        # stale assigned task, then assigned load per host
+        self._fetchMulti.side_effect = [[(5,)], [(2, 1.5)]]
+        self.assertEqual(kojihub.schedule_tasks(), [(10, 1), (11, 2)])
+
+        self.assertEqual(self._singleValue.call_args[0][1], {'key': kojihub.SCHEDULER_LOCK})
+        self.Task.assert_any_call(5)
+        self.Task.return_value.free.assert_called_once_with()
+        self.assertEqual(self.Task.return_value.assign.call_args_list,
+                         [mock.call(1), mock.call(2)])
+        self.assertEqual(len(self.queries), 1)
+        query = self.queries[0]
+        self.assertEqual(query.tables, ['task'])
+        self.assertEqual(query.clauses, ['state = %(FREE)i'])
+        self.assertEqual(query.opts['limit'], 100)
+
+    def test_locked(self):
+        self._singleValue.return_value = False
+        self.assertEqual(kojihub.schedule_tasks(), [])
+        self._fetchMulti.assert_not_called()
+        self.get_ready_hosts.assert_not_called()
+        self.Task.assert_not_called()
+
+    def test_no_hosts(self):
+        self._fetchMulti.return_value = []
+        self.get_ready_hosts.return_value = []
+        self.assertEqual(kojihub.schedule_tasks(), [])
+        self.assertEqual(self.queries, [])
+
+
+class TestGetLoadDataScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojihub.context').start()
+        self.context.opts = {'TaskScheduler': True, 'TaskSchedulerInterval': 60}
+        self.schedule_tasks = mock.patch('kojihub.schedule_tasks').start()
+        self.get_ready_hosts = mock.patch('kojihub.get_ready_hosts').start()
+        self.get_active_tasks = mock.patch('kojihub.get_active_tasks').start()
+        self.time = mock.patch('time.time').start()
+        self.time.return_value = 1000.0
+        mock.patch('kojihub._schedule_ts', new=[0]).start()
+        self.host = kojihub.Host.__new__(kojihub.Host)
+        self.host.id = 2
+        self.get_ready_hosts.return_value = [{'id': 1}, {'id': 2}]
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_scheduler(self):
+        self.assertEqual(self.host.getLoadData(),
+                         [[{'id': 2}], self.get_active_tasks.return_value])
+        self.get_active_tasks.assert_called_once_with({'id': 2}, assigned_only=True)
+        self.schedule_tasks.assert_called_once_with()
+
+        # only once per interval
+        self.time.return_value = 1030.0
+        self.host.getLoadData()
+        self.schedule_tasks.assert_called_once_with()
+        self.time.return_value = 1060.0
+        self.host.getLoadData()
+        self.assertEqual(self.schedule_tasks.call_count, 2)
+
+    def test_not_ready(self):
+        self.host.id = 3
+        self.assertEqual(self.host.getLoadData(), [[], []])
+        self.get_active_tasks.assert_not_called()
+
+    def test_default(self):
+        self.context.opts = {}
+        self.assertEqual(self.host.getLoadData(),
+                         [self.get_ready_hosts.return_value,
+                          self.get_active_tasks.return_value])
+        self.get_active_tasks.assert_called_once_with({'id': 2})
+        self.schedule_tasks.assert_not_called()
+
+
+class TestGetReadyHosts(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojihub.context').start()
+        self.cursor = self.context.cnx.cursor.return_value
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_channels(self):
+        self.cursor.fetchall.side_effect = [
+            [(1, 'host1', 'x86_64', 0.0, 2.0), (2, 'host2', 'x86_64', 1.0, 4.0)],
+            [(1, 1), (1, 3)],
+        ]
+        hosts = kojihub.get_ready_hosts()
+        self.assertEqual([(h['id'], h['channels']) for h in hosts], [(1, [1, 3]), (2, [])])
+        # one query for the channels of all hosts
+        self.assertEqual(self.cursor.execute.call_count, 2)
+        self.assertEqual(self.cursor.execute.call_args[0][1], {'host_ids': [1, 2]})
+
+    def test_none(self):
+        self.cursor.fetchall.return_value = []
+        self.assertEqual(kojihub.get_ready_hosts(), [])
+        self.cursor.execute.assert_called_once()
@@ -0,0 +1,95 @@
+import mock
+import unittest
+
+import koji
+import kojixmlrpc
+from kojixmlrpc import ModXMLRPCRequestHandler, StreamedResponse
+
+
+class TestStreamedResponse(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojixmlrpc.context').start()
+        self.context.commit_pending = False
+        self.context.opts = {'ResponseChunkSize': 1000, 'MemoryWarnThreshold': 5000}
+        self.get_memory_usage = mock.patch('kojixmlrpc.get_memory_usage',
+                                           return_value=0).start()
+        self.h = ModXMLRPCRequestHandler(mock.MagicMock())
+        self.h.logger = mock.MagicMock()
+        self.consumed = []
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def rows(self, count, fail=None):
+        for n in range(count):
+            if n == fail:
+                raise koji.GenericError('query failed')
+            self.consumed.append(n)
+            yield {'id': n, 'name': 'x' * 100}
+
+    def wrap(self, result):
+        return self.h._wrap_handler(lambda environ: result, {})
+
+    def test_small(self):
+        head, rest = self.wrap([1, 2, 3])
+        self.assertIsNone(rest)
+        self.assertEqual(koji.xmlrpcplus.loads(b''.join(head))[0][0], [1, 2, 3])
+
+    def test_stream(self):
+        head, rest = self.wrap({'rows': self.rows(1000)})
+        self.assertEqual(len(head), 2)
+        self.assertLess(len(self.consumed), 100)
+
+        response = StreamedResponse(self.h, head, rest, 0, 0)
+        data = b''.join(response)
+        response.close()
+        self.assertEqual(len(self.consumed), 1000)
+        result = koji.xmlrpcplus.loads(data)[0][0]
+        self.assertEqual(len(result['rows']), 1000)
+        self.context.cnx.rollback.assert_not_called()
+        self.context.cnx.close.assert_called_once()
+        self.context._threadclear.assert_called_once()
+        self.h.logger.debug.assert_called_once_with(
+            "Returning %d bytes after %f seconds", len(data), mock.ANY)
+
+    def test_not_streamed(self):
+        self.context.commit_pending = True
+        head, rest = self.wrap(self.rows(1000))
+        self.assertIsNone(rest)
+        self.assertEqual(len(self.consumed), 1000)
+
+        self.context.commit_pending = False
+        self.context.opts['ResponseChunkSize'] = 0
+        head, rest = self.wrap(self.rows(10))
+        self.assertIsNone(rest)
+        self.assertEqual(len(head), 1)
+
+    def test_early_error(self):
+        head, rest = self.wrap(self.rows(1000, fail=3))
+        self.assertIsNone(rest)
+        self.assertTrue(self.h.traceback)
+        with self.assertRaises(koji.xmlrpcplus.Fault) as cm:
+            koji.xmlrpcplus.loads(b''.join(head))
+        self.assertEqual(cm.exception.faultString, 'query failed')
+
+    def test_late_error(self):
+        head, rest = self.wrap(self.rows(1000, fail=500))
+        response = StreamedResponse(self.h, head, rest, 0, 0)
+        data = b''.join(response)
+        response.close()
+        self.assertTrue(self.h.traceback)
+        self.assertNotIn(b'</methodResponse>', data)
+        self.context.cnx.rollback.assert_called_once()
+        self.context._threadclear.assert_called_once()
+
+    def test_aborted(self):
+        head, rest = self.wrap(self.rows(1000))
+        response = StreamedResponse(self.h, head, rest, 0, 0)
+        next(iter(response))
+        response.close()
+        # the rest is dropped
+        self.assertLess(len(self.consumed), 100)
+        self.h.logger.debug.assert_not_called()
+        self.context.cnx.close.assert_called_once()
+        self.context._threadclear.assert_called_once()
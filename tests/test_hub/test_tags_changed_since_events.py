@@ -0,0 +1,48 @@
+import mock
+import unittest
+
+import koji
+import kojihub
+
+
+class TestTagsChangedSinceEvents(unittest.TestCase):
+
+    def setUp(self):
+        self._fetchMulti = mock.patch('kojihub._fetchMulti').start()
+        # tag_id, last change
+        self._fetchMulti.return_value = [(1, 110), (2, 150), (4, 200)]
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_changes(self):
+        checks = [
+            ('repo1', 100, [1, 3]),
+            ('repo2', 110, [1, 3]),
+            ('repo3', 120, [3, 2]),
+            ('repo4', 150, [2]),
+            ('repo5', 90, [3]),
+            ('repo6', 199, [5, 4]),
+        ]
+        self.assertEqual(kojihub.tags_changed_since_events(checks),
+                         ['repo1', 'repo3', 'repo6'])
+
+        # a single query for all checks
+        self._fetchMulti.assert_called_once()
+        query, values = self._fetchMulti.call_args[0]
+        self.assertEqual(values['event'], 90)
+        self.assertEqual(sorted(values['tags']), [1, 2, 3, 4, 5])
+        self.assertEqual(query.count('UNION ALL'), len(kojihub.TAG_VERSIONED_TABLES))
+        for table in kojihub.TAG_VERSIONED_TABLES + ('tag_updates',):
+            self.assertIn('FROM %s\n' % table, query)
+        self.assertIn('GROUP BY tag_id', query)
+
+    def test_empty(self):
+        self.assertEqual(kojihub.tags_changed_since_events([]), [])
+        self.assertEqual(kojihub.tags_changed_since_events([(1, 100, [])]), [])
+        self._fetchMulti.assert_not_called()
+
+    def test_bad_event(self):
+        with self.assertRaises(koji.ParameterError):
+            kojihub.tags_changed_since_events([(1, '100', [1])])
+        self._fetchMulti.assert_not_called()
@@ -0,0 +1,88 @@
+import json
+import mock
+import unittest
+
+import koji
+import kojihub
+
+
+class TestTaskNotify(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojihub.context').start()
+        self._dml = mock.patch('kojihub._dml').start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_notify(self):
+        self.context.opts = {'TaskEvents': True}
+        kojihub.Task(42).notify()
+        self._dml.assert_called_once()
+        query, values = self._dml.call_args[0]
+        self.assertIn('pg_notify(%(channel)s', query)
+        self.assertEqual(values, {'channel': kojihub.TASK_EVENTS_CHANNEL, 'id': 42})
+
+    def test_disabled(self):
+        self.context.opts = {'TaskEvents': False}
+        kojihub.Task(42).notify()
+        self._dml.assert_not_called()
+
+
+class TestWaitForTaskEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojihub.context').start()
+        self.context.opts = {'TaskEvents': True, 'TaskEventsMaxWait': 60}
+        self.listener = mock.patch('kojihub._task_listener').start()
+        self.listener.position.return_value = 10
+        self.exports = kojihub.HostExports()
+        self.Host = mock.patch('kojihub.Host').start()
+        self.Host.return_value.id = 1
+        self.connect = mock.patch('koji.db.connect').start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def event(self, task_id, state, host_id, parent=None, parent_host=None):
+        return json.dumps({'id': task_id, 'state': koji.TASK_STATES[state], 'host_id': host_id,
+                           'parent': parent, 'parent_host': parent_host})
+
+    def test_wait(self):
+        payload = self.event(5, 'CLOSED', 2, 4, 1)
+        cnx = self.context.cnx
+
+        def wait(*args):
+            # no connection is held while waiting
+            cnx.commit.assert_called_once()
+            cnx.close.assert_called_once()
+            self.connect.assert_not_called()
+            return [None, payload]
+        self.listener.wait.side_effect = wait
+        self.assertEqual(self.exports.waitForTaskEvents(120), [json.loads(payload)])
+
+        self.Host.return_value.verify.assert_called_once()
+        self.listener.start.assert_called_once()
+        self.assertIs(self.context.cnx, self.connect.return_value)
+        since, timeout, match = self.listener.wait.call_args[0]
+        self.assertEqual(since, 10)
+        # limited by TaskEventsMaxWait
+        self.assertEqual(timeout, 60)
+
+        # own tasks, except opening them
+        self.assertTrue(match(self.event(5, 'CANCELED', 1)))
+        self.assertTrue(match(self.event(5, 'ASSIGNED', 1)))
+        self.assertTrue(match(self.event(5, 'CLOSED', 1, 4, 2)))
+        self.assertFalse(match(self.event(5, 'OPEN', 1)))
+        # finished subtasks of own tasks
+        self.assertTrue(match(self.event(5, 'FAILED', 2, 4, 1)))
+        self.assertFalse(match(self.event(5, 'OPEN', 2, 4, 1)))
+        # others
+        self.assertFalse(match(self.event(5, 'CLOSED', 2, 4, 3)))
+        self.assertFalse(match(self.event(5, 'FREE', None)))
+
+    def test_disabled(self):
+        self.context.opts['TaskEvents'] = False
+        with self.assertRaises(koji.ActionNotAllowed):
+            self.exports.waitForTaskEvents(10)
+        self.listener.wait.assert_not_called()
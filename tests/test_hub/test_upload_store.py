@@ -0,0 +1,132 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+import mock
+import unittest
+
+import koji
+import kojihub
+
+
+class TestUploadStore(unittest.TestCase):
+
+    def setUp(self):
+        self.topdir = tempfile.mkdtemp()
+        mock.patch('koji.pathinfo._topdir', new=self.topdir).start()
+        self.context = mock.patch('kojihub.context').start()
+        self.context.opts = {'UploadDedup': True}
+        self.context.session.assertLogin = mock.MagicMock()
+        self.context.session.user_id = 1
+        self.udir = os.path.join(self.topdir, 'work', 'target')
+        os.makedirs(self.udir)
+        self.write('.user', b'1')
+        self.store = kojihub.UploadStore()
+        mock.patch('kojihub.upload_store', new=self.store).start()
+        self.exports = kojihub.RootExports()
+        self.data = os.urandom(100000)
+        self.sha256 = hashlib.sha256(self.data).hexdigest()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        shutil.rmtree(self.topdir)
+
+    def write(self, name, data):
+        fn = os.path.join(self.udir, name)
+        with open(fn, 'wb') as fo:
+            fo.write(data)
+        return fn
+
+    def read(self, name):
+        with open(os.path.join(self.udir, name), 'rb') as fo:
+            return fo.read()
+
+    def test_store_and_link(self):
+        fn = self.write('orig', self.data)
+        self.assertTrue(self.exports.storeUpload('target', 'orig', self.sha256))
+        stored = self.store.path(self.sha256)
+        self.assertTrue(os.path.samefile(fn, stored))
+
+        self.assertTrue(self.exports.linkUpload('target', 'copy', 100000, self.sha256))
+        self.assertTrue(os.path.samefile(fn, os.path.join(self.udir, 'copy')))
+        self.assertEqual(self.exports.getUploadStoreStats(),
+                         {'links': 1, 'misses': 0, 'stored': 1, 'bytes_avoided': 100000})
+
+    def test_link_miss(self):
+        self.assertFalse(self.exports.linkUpload('target', 'copy', 100000, self.sha256))
+        fn = self.write('orig', self.data)
+        self.exports.storeUpload('target', 'orig', self.sha256)
+        # wrong size
+        self.assertFalse(self.exports.linkUpload('target', 'copy', 1000, self.sha256))
+        # the stored copy is the last one
+        os.unlink(fn)
+        self.assertFalse(self.exports.linkUpload('target', 'copy', 100000, self.sha256))
+        self.assertFalse(os.path.exists(self.store.path(self.sha256)))
+        self.assertFalse(os.path.exists(os.path.join(self.udir, 'copy')))
+        self.assertEqual(self.store.get_stats()['misses'], 3)
+
+    def test_link_exists(self):
+        self.write('orig', self.data)
+        self.exports.storeUpload('target', 'orig', self.sha256)
+        self.write('copy', b'partial')
+        with self.assertRaises(koji.GenericError):
+            self.exports.linkUpload('target', 'copy', 100000, self.sha256)
+        self.assertTrue(self.exports.linkUpload('target', 'copy', 100000, self.sha256,
+                                                overwrite=True))
+        self.assertEqual(self.read('copy'), self.data)
+
+    def test_store_wrong_checksum(self):
+        self.write('orig', self.data)
+        with self.assertRaises(koji.GenericError):
+            self.exports.storeUpload('target', 'orig', hashlib.sha256(b'other').hexdigest())
+        self.assertFalse(os.path.exists(self.store.path(self.sha256)))
+        with self.assertRaises(koji.GenericError):
+            self.exports.storeUpload('target', 'orig', '../../etc/passwd')
+
+    def test_store_not_owner(self):
+        self.write('orig', self.data)
+        # another user's upload
+        self.context.session.user_id = 2
+        with self.assertRaises(koji.GenericError):
+            self.exports.storeUpload('target', 'orig', self.sha256)
+        # not an upload, e.g. task output
+        self.context.session.user_id = 1
+        odir = os.path.join(self.topdir, 'work', 'other')
+        os.makedirs(odir)
+        with open(os.path.join(odir, 'orig'), 'wb') as fo:
+            fo.write(self.data)
+        with self.assertRaises(koji.GenericError):
+            self.exports.storeUpload('other', 'orig', self.sha256)
+        self.assertFalse(os.path.exists(self.store.path(self.sha256)))
+        # neither creates the directory
+        with self.assertRaises(koji.GenericError):
+            self.exports.storeUpload('missing', 'orig', self.sha256)
+        self.assertFalse(os.path.exists(os.path.join(self.topdir, 'work', 'missing')))
+
+    def test_disabled(self):
+        self.context.opts = {'UploadDedup': False}
+        self.write('orig', self.data)
+        self.assertFalse(self.exports.storeUpload('target', 'orig', self.sha256))
+        self.assertFalse(self.exports.linkUpload('target', 'copy', 100000, self.sha256))
+        self.assertFalse(os.path.exists(self.store.path(self.sha256)))
+
+    def test_unshare_upload(self):
+        fn = self.write('orig', self.data)
+        self.exports.storeUpload('target', 'orig', self.sha256)
+        kojihub.unshare_upload(fn)
+        self.assertFalse(os.path.samefile(fn, self.store.path(self.sha256)))
+        self.assertEqual(self.read('orig'), self.data)
+        self.assertEqual(sorted(os.listdir(self.udir)), ['.user', 'orig'])
+        # not shared anymore
+        st = os.stat(fn)
+        kojihub.unshare_upload(fn)
+        self.assertEqual(os.stat(fn).st_ino, st.st_ino)
+
+    def test_unshare_upload_remove(self):
+        fn = self.write('orig', self.data)
+        self.exports.storeUpload('target', 'orig', self.sha256)
+        kojihub.unshare_upload(fn, copy=False)
+        self.assertFalse(os.path.exists(fn))
+        with open(self.store.path(self.sha256), 'rb') as fo:
+            self.assertEqual(fo.read(), self.data)
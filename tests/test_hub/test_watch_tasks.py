@@ -0,0 +1,119 @@
+import json
+import mock
+import unittest
+import xmlrpc.client
+
+import koji
+import kojihub
+
+
+class TestWatchTasks(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojihub.context').start()
+        self.context.opts = {'TaskEvents': True, 'TaskEventsMaxWait': 60}
+        self.listener = mock.patch('kojihub._task_listener').start()
+        self.listener.position.return_value = 10
+        self._get_watched_tasks = mock.patch('kojihub._get_watched_tasks').start()
+        self._get_watched_tasks.return_value = ([{'id': 1}], 'token1')
+        self.connect = mock.patch('koji.db.connect').start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_current(self):
+        self.assertEqual(kojihub.watch_tasks(['1']),
+                         {'token': 'token1', 'tasks': [{'id': 1}]})
+        self._get_watched_tasks.assert_called_once_with([1], request=True)
+        self.listener.wait.assert_not_called()
+
+    def test_changed(self):
+        self.assertEqual(kojihub.watch_tasks([1], 'token0')['token'], 'token1')
+        self._get_watched_tasks.assert_called_once_with([1], request=False)
+        self.listener.wait.assert_not_called()
+        self.context.cnx.commit.assert_not_called()
+        self.context.cnx.close.assert_not_called()
+
+    def test_wait(self):
+        self._get_watched_tasks.side_effect = [([{'id': 1}], 'token1'),
+                                               ([{'id': 1}, {'id': 2}], 'token2')]
+        cnx = self.context.cnx
+
+        def wait(*args):
+            # the connection is given back while waiting
+            cnx.commit.assert_called_once()
+            cnx.close.assert_called_once()
+            self.connect.assert_not_called()
+            return ['event']
+        self.listener.wait.side_effect = wait
+        rv = kojihub.watch_tasks([1], 'token1', 120)
+        self.assertEqual(rv, {'token': 'token2', 'tasks': [{'id': 1}, {'id': 2}]})
+        self.assertIs(self.context.cnx, self.connect.return_value)
+        since, timeout, match = self.listener.wait.call_args[0]
+        self.assertEqual(since, 10)
+        self.assertEqual(timeout, 60)
+        self.assertTrue(match(json.dumps({'id': 1, 'parent': None})))
+        self.assertTrue(match(json.dumps({'id': 2, 'parent': 1})))
+        self.assertFalse(match(json.dumps({'id': 3, 'parent': 2})))
+
+    def test_timeout(self):
+        self.listener.wait.return_value = []
+        rv = kojihub.watch_tasks([1], 'token1', 5)
+        self.assertEqual(rv['token'], 'token1')
+        self._get_watched_tasks.assert_called_once()
+
+        self.listener.wait.reset_mock()
+        kojihub.watch_tasks([1], 'token1', 0)
+        self.listener.wait.assert_not_called()
+
+    def test_errors(self):
+        with self.assertRaises(koji.ParameterError):
+            kojihub.watch_tasks([])
+        self.context.opts['TaskEvents'] = False
+        with self.assertRaises(koji.ActionNotAllowed):
+            kojihub.watch_tasks([1])
+        self._get_watched_tasks.assert_not_called()
+
+
+class TestGetWatchedTasks(unittest.TestCase):
+
+    def setUp(self):
+        self.QueryProcessor = mock.patch('kojihub.QueryProcessor',
+                                         side_effect=self.getQuery).start()
+        self.queries = []
+        self.results = []
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def getQuery(self, *args, **kwargs):
+        query = mock.MagicMock()
+        query.kwargs = kwargs
+        query.execute.return_value = self.results.pop(0)
+        self.queries.append(query)
+        return query
+
+    def test_tasks(self):
+        request = xmlrpc.client.dumps((1, 'arg'), methodname='someMethod')
+        self.results = [[{'id': 1, 'state': 1}, {'id': 2, 'state': 0}],
+                        [{'id': 2, 'request': request}]]
+        tasks, token = kojihub._get_watched_tasks([1])
+        self.assertEqual(tasks, [{'id': 1, 'state': 1},
+                                 {'id': 2, 'state': 0, 'request': (1, 'arg')}])
+        self.assertEqual(self.queries[0].kwargs['values'], {'task_ids': [1]})
+        # only the new child needs a request
+        self.assertEqual(self.queries[1].kwargs['values'], {'new_ids': [2]})
+
+        # the token only depends on the states
+        self.results = [[{'id': 1, 'state': 1, 'owner': 2}, {'id': 2, 'state': 0}],
+                        [{'id': 2, 'request': request}]]
+        self.assertEqual(kojihub._get_watched_tasks([1])[1], token)
+        self.results = [[{'id': 1, 'state': 1}, {'id': 2, 'state': 1}],
+                        [{'id': 2, 'request': request}]]
+        self.assertNotEqual(kojihub._get_watched_tasks([1])[1], token)
+
+    def test_no_requests(self):
+        self.results = [[{'id': 1, 'state': 1}]]
+        tasks, token = kojihub._get_watched_tasks([1])
+        self.assertEqual(tasks, [{'id': 1, 'state': 1}])
+        self.assertEqual(len(self.queries), 1)
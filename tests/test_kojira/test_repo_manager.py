@@ -98,6 +98,32 @@ class RepoManagerTest(unittest.TestCase):
         self.assertEqual(self.mgr.regenRepos.call_count, 11)
         subsession.logout.assert_called_once()
 
+    def test_check_current_repos(self):
+        repos = []
+        for repo_id in range(1, 5):
+            repo = mock.MagicMock()
+            repo.repo_id = repo_id
+            repo.event_id = 100 + repo_id
+            repo.taglist = [repo_id, 10]
+            repo.current = True
+            repo.expire_ts = None
+            repos.append(repo)
+        self.mgr.reposToCheck = mock.MagicMock(return_value=repos)
+        self.mgr.logger = mock.MagicMock()
+        self.session.tagsChangedSinceEvents.return_value = [2, 4]
+
+        self.mgr.checkCurrentRepos()
+
+        # one call for all repos
+        self.session.tagsChangedSinceEvents.assert_called_once()
+        checks = self.session.tagsChangedSinceEvents.call_args[0][0]
+        self.assertEqual(sorted(checks), [(1, 101, [1, 10]), (2, 102, [2, 10]),
+                                          (3, 103, [3, 10]), (4, 104, [4, 10])])
+        self.session.tagChangedSinceEvent.assert_not_called()
+        self.assertEqual([r.current for r in repos], [True, False, True, False])
+        self.assertIsNone(repos[0].expire_ts)
+        self.assertIsNotNone(repos[1].expire_ts)
+
     def test_set_tag_score(self):
         self.mgr.tagUseStats = mock.MagicMock()
         self.mgr.tagUseStats.return_value = {
@@ -207,3 +207,126 @@ class TestAuthSession(unittest.TestCase):
 
         cursor.fetchone.return_value = None
         self.assertEqual(koji.auth.get_user_data(1), None)
+
+
+class FakeSessionCursor(object):
+    """Emulates the queries of Session.__init__ on a single session row"""
+
+    def __init__(self, callnum=None, update_age=0):
+        self.callnum = callnum
+        self.update_age = update_age
+        self.queries = []
+        self.written = 0
+        self.rowcount = -1
+        self.row = None
+
+    def execute(self, q, values):
+        self.queries.append(q)
+        self.rowcount = -1
+        if q.strip().startswith('SELECT') and 'FROM sessions' in q and 'key' in q:
+            self.row = [koji.AUTHTYPE_NORMAL, self.callnum, False, False, None, 'start_time',
+                        'start_ts', 'update_time', 'update_ts', 1]
+        elif 'FROM users' in q:
+            self.row = ['name', koji.USER_STATUS['NORMAL'], koji.USERTYPES['NORMAL']]
+        elif 'SET update_time' in q:
+            self.rowcount = 1
+            if 'update_time <' in q and self.update_age < values['interval']:
+                self.rowcount = 0
+            if self.rowcount:
+                self.update_age = 0
+        elif 'SET callnum' in q:
+            self.rowcount = 1
+            if self.callnum is not None:
+                if '<=' in q:
+                    self.rowcount = int(self.callnum <= values['callnum'])
+                elif '<' in q:
+                    self.rowcount = int(self.callnum < values['callnum'])
+            if self.rowcount:
+                self.callnum = values['callnum']
+        else:
+            self.row = None
+        if self.rowcount > 0:
+            self.written += 1
+
+    def fetchone(self):
+        return self.row
+
+
+class TestLazySessionUpdate(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('koji.auth.context').start()
+        self.context.opts = {'SessionUpdateInterval': 60, 'CheckClientIP': True}
+        self.context.method = 'getTaskInfo'
+        self.cursor = FakeSessionCursor()
+        self.context.cnx.cursor.return_value = self.cursor
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def call(self, callnum, lazy=True):
+        args = {'session-id': ['123'], 'session-key': ['xyz'], 'callnum': [str(callnum)]}
+        if lazy:
+            args['lazy-update'] = ['1']
+        return koji.auth.Session(args=args, hostip='remote-addr')
+
+    def test_no_lock(self):
+        self.call(1)
+        self.assertNotIn('FOR UPDATE', self.cursor.queries[0])
+        self.call(2, lazy=False)
+        self.assertIn('FOR UPDATE', self.cursor.queries[-5])
+
+        # not allowed by the hub
+        self.context.opts['SessionUpdateInterval'] = 0
+        self.call(3)
+        self.assertIn('FOR UPDATE', self.cursor.queries[-5])
+
+    def test_writes_per_request(self):
+        # a builder polling the hub: 100 calls within the update interval
+        self.cursor.update_age = 3600
+        for callnum in range(100):
+            self.call(callnum, lazy=False)
+        full_writes = self.cursor.written
+        full_commits = self.context.cnx.commit.call_count
+
+        self.cursor.written = 0
+        self.context.cnx.commit.reset_mock()
+        self.cursor.update_age = 3600
+        for callnum in range(100, 200):
+            self.call(callnum)
+        # only the first call refreshes update_time, every call still records callnum
+        self.assertEqual(full_commits, 100)
+        self.assertEqual(self.context.cnx.commit.call_count, 1)
+        self.assertEqual(full_writes, 200)
+        self.assertEqual(self.cursor.written, 101)
+
+        self.cursor.update_age = 61
+        self.call(200)
+        self.assertEqual(self.context.cnx.commit.call_count, 2)
+
+    def test_callnum_sequence(self):
+        self.cursor.callnum = 10
+        with self.assertRaises(koji.SequenceError):
+            self.call(9)
+        # retry of the last call
+        with self.assertRaises(koji.RetryError):
+            self.call(10)
+        self.context.method = 'host.updateHost'
+        self.call(10)
+        self.context.method = 'getTaskInfo'
+        self.call(11)
+        self.assertEqual(self.cursor.callnum, 11)
+
+    def test_concurrent_callnum(self):
+        # a concurrent call updated callnum after we read it
+        self.cursor.callnum = 10
+        orig_execute = self.cursor.execute
+
+        def execute(q, values):
+            if 'SET callnum' in q:
+                self.cursor.callnum = 12
+            orig_execute(q, values)
+
+        self.cursor.execute = execute
+        with self.assertRaises(koji.SequenceError):
+            self.call(11)
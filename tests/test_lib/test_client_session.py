@@ -1,7 +1,13 @@
 from __future__ import absolute_import
+import hashlib
 import mock
+import os
+import shutil
 import six
+import tempfile
+import threading
 import weakref
+import zlib
 import unittest
 
 import koji
@@ -209,3 +215,624 @@ class TestMultiCall(unittest.TestCase):
 
         # This should not raise an exception
         koji.MultiCallHack(weakref.ref(self.ksession))
+
+
+class TestIterMethod(unittest.TestCase):
+
+    def setUp(self):
+        self.ksession = koji.ClientSession('http://koji.example.com/kojihub')
+        self.ksession.logout = mock.MagicMock()
+        self.ksession.rsession = mock.MagicMock()
+        self.response = self.ksession.rsession.post.return_value
+        self.read = []
+
+    def tearDown(self):
+        del self.ksession
+
+    def respond(self, data):
+        data = koji.xmlrpcplus.dumps(data, methodresponse=1).encode()
+
+        def iter_content(size):
+            for i in range(0, len(data), 100):
+                self.read.append(i)
+                yield data[i:i + 100]
+        self.response.iter_content.side_effect = iter_content
+
+    def test_list(self):
+        rpms = [{'id': n, 'name': 'rpm%i' % n} for n in range(100)]
+        self.respond((rpms,))
+        items = self.ksession.iterMethod('listRPMs', buildID=1)
+        self.assertEqual(next(items), ((), rpms[0]))
+        # only a part of the response was read
+        self.assertLess(len(self.read), 5)
+        self.assertEqual(list(items), [((), r) for r in rpms[1:]])
+        self.response.close.assert_called_once()
+        args, kwargs = self.ksession.rsession.post.call_args
+        params, method = koji.xmlrpcplus.loads(kwargs['data'])
+        self.assertEqual(method, 'listRPMs')
+        self.assertEqual(params, ({'buildID': 1, '__starstar': True},))
+
+    def test_nested(self):
+        self.respond(([[{'id': 1}, {'id': 2}], [{'id': 3}]],))
+        self.assertEqual(list(self.ksession.iterMethod('listTaggedRPMS', 'tag')),
+                         [((0,), {'id': 1}), ((0,), {'id': 2}), ((1,), {'id': 3})])
+        self.respond(({'tag_listing': [{'id': 1}], 'tag_config': [], 'count': 1},))
+        self.assertEqual(sorted(self.ksession.iterMethod('queryHistory')),
+                         [(('count',), 1), (('tag_listing',), {'id': 1})])
+
+    def test_fault(self):
+        self.respond(Fault(1000, 'Invalid method: listFoo'))
+        with self.assertRaises(koji.GenericError) as cm:
+            list(self.ksession.iterMethod('listFoo'))
+        self.assertEqual(cm.exception.args[0], 'Invalid method: listFoo')
+        self.response.close.assert_called_once()
+
+    def test_multicall(self):
+        self.ksession.multicall = True
+        with self.assertRaises(koji.GenericError):
+            list(self.ksession.iterMethod('listRPMs'))
+        self.ksession.rsession.post.assert_not_called()
+
+
+class TestJSONTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.ksession = koji.ClientSession('http://koji.example.com/kojihub')
+        self.ksession.logout = mock.MagicMock()
+        self.ksession.rsession = mock.MagicMock()
+
+    def tearDown(self):
+        del self.ksession
+
+    def respond(self, data, content_type):
+        response = mock.MagicMock()
+        response.headers = {'Content-Type': content_type}
+        response.iter_content.return_value = [data]
+        self.ksession.rsession.post.return_value = response
+
+    def sent(self):
+        kwargs = self.ksession.rsession.post.call_args[1]
+        return kwargs['headers'], kwargs['data']
+
+    def test_negotiate(self):
+        self.respond(koji.jsonplus.dumps_response({'id': 1}), 'application/json')
+        self.assertEqual(self.ksession.getBuild('foo-1-1', strict=True), {'id': 1})
+        headers, data = self.sent()
+        # the first call is xmlrpc
+        self.assertEqual(headers['Content-Type'], 'text/xml')
+        self.assertEqual(headers['Accept'], 'application/json, text/xml')
+        self.assertEqual(koji.xmlrpcplus.loads(data),
+                         (('foo-1-1', {'strict': True, '__starstar': True}), 'getBuild'))
+        self.assertTrue(self.ksession.json_transport)
+
+        self.ksession.getBuild('foo-1-1', strict=True)
+        headers, data = self.sent()
+        self.assertEqual(headers['Content-Type'], 'application/json')
+        self.assertEqual(koji.jsonplus.loads_request(data),
+                         (('foo-1-1', {'strict': True, '__starstar': True}), 'getBuild'))
+
+    def test_old_hub(self):
+        self.respond(koji.xmlrpcplus.dumps(({'id': 1},), methodresponse=1).encode(), 'text/xml')
+        self.assertEqual(self.ksession.getBuild('foo-1-1'), {'id': 1})
+        self.ksession.getBuild('foo-1-1')
+        headers, data = self.sent()
+        self.assertEqual(headers['Content-Type'], 'text/xml')
+        self.assertFalse(self.ksession.json_transport)
+
+    def test_disabled(self):
+        self.ksession.opts['use_json'] = False
+        self.respond(koji.xmlrpcplus.dumps((1,), methodresponse=1).encode(), 'text/xml')
+        self.ksession.getLastEvent()
+        headers, data = self.sent()
+        self.assertNotIn('Accept', headers)
+
+    def test_fault(self):
+        self.ksession.json_transport = True
+        self.respond(koji.jsonplus.dumps_response(Fault(1000, 'Invalid method: foo')),
+                     'application/json')
+        with self.assertRaises(koji.GenericError) as cm:
+            self.ksession.foo()
+        self.assertEqual(cm.exception.args[0], 'Invalid method: foo')
+
+    def test_multicall(self):
+        self.ksession.json_transport = True
+        result = [[{'id': 1}], {'faultCode': 1000, 'faultString': 'Invalid method: foo'}]
+        self.respond(koji.jsonplus.dumps_response(result), 'application/json')
+        self.ksession.multicall = True
+        self.ksession.getBuild(1, strict=True)
+        self.ksession.foo()
+        self.assertEqual(self.ksession.multiCall(), result)
+        headers, data = self.sent()
+        params, method = koji.jsonplus.loads_request(data)
+        self.assertEqual(method, 'multiCall')
+        self.assertEqual(params[0][0], {'methodName': 'getBuild',
+                                        'params': [1, {'strict': True, '__starstar': True}]})
+
+    def test_iter_method(self):
+        self.ksession.json_transport = True
+        self.respond(koji.xmlrpcplus.dumps(([1, 2],), methodresponse=1).encode(), 'text/xml')
+        self.assertEqual(list(self.ksession.iterMethod('foo')), [((), 1), ((), 2)])
+        headers, data = self.sent()
+        # xmlrpc response only
+        self.assertNotIn('Accept', headers)
+
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        self.ksession = koji.ClientSession('http://koji.example.com/kojihub',
+                                           {'use_json': False})
+        self.ksession.logout = mock.MagicMock()
+        self.ksession.rsession = mock.MagicMock()
+        self.respond({'Accept-Encoding': 'gzip'})
+
+    def tearDown(self):
+        del self.ksession
+
+    def respond(self, headers):
+        response = mock.MagicMock()
+        response.headers = dict(headers, **{'Content-Type': 'text/xml'})
+        response.iter_content.return_value = [
+            koji.xmlrpcplus.dumps((1,), methodresponse=1).encode()]
+        self.ksession.rsession.post.return_value = response
+
+    def sent(self):
+        kwargs = self.ksession.rsession.post.call_args[1]
+        return kwargs['headers'], kwargs['data']
+
+    def test_compress(self):
+        self.ksession.getLastEvent()
+        headers, data = self.sent()
+        # the hub has not advertised gzip yet
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(self.ksession.request_encoding, 'gzip')
+
+        self.ksession.getBuild('x' * 5000)
+        headers, data = self.sent()
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Content-Length'], str(len(data)))
+        self.assertEqual(koji.xmlrpcplus.loads(zlib.decompress(data, 31)),
+                         (('x' * 5000,), 'getBuild'))
+
+        # small calls are sent as they are
+        self.ksession.getBuild('x')
+        headers, data = self.sent()
+        self.assertNotIn('Content-Encoding', headers)
+
+    def test_old_hub(self):
+        self.respond({})
+        self.ksession.getLastEvent()
+        self.ksession.getBuild('x' * 5000)
+        headers, data = self.sent()
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertIsNone(self.ksession.request_encoding)
+
+    def test_disabled(self):
+        self.ksession.opts['compression'] = False
+        self.ksession.getLastEvent()
+        self.ksession.getBuild('x' * 5000)
+        headers, data = self.sent()
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(headers['Accept-Encoding'], 'identity')
+
+
+class TestParallelUpload(unittest.TestCase):
+
+    def setUp(self):
+        self.ksession = koji.ClientSession('http://koji.example.com/kojihub')
+        self.ksession.logged_in = True
+        self.ksession.sinfo = {}
+        self.ksession.callnum = 1
+        self.ksession.retries = 1
+        self.ksession.logout = mock.MagicMock()
+        self.ksession._callMethod = mock.MagicMock(side_effect=self.hub)
+        self.workers = []
+        self.ksession._worker_session = mock.MagicMock(side_effect=self.worker_session)
+        self.uploaded = bytearray()
+        self.parallel = True
+        self.offsets = []
+        self.lock = threading.Lock()
+        self.tempdir = tempfile.mkdtemp()
+        self.data = os.urandom(10000)
+        self.fn = os.path.join(self.tempdir, 'file')
+        with open(self.fn, 'wb') as fo:
+            fo.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        del self.ksession
+
+    def worker_session(self):
+        worker = mock.MagicMock()
+        worker.retries = 1
+        worker._callMethod.side_effect = self.hub
+        self.workers.append(worker)
+        return worker
+
+    def hub(self, name, args, kwargs):
+        if name == 'checkUpload':
+            return {'size': len(self.uploaded),
+                    'hexdigest': koji.util.adler32_constructor(
+                        bytes(self.uploaded)).hexdigest()}
+        chunk, offset, path, fn = args
+        if offset == 0:
+            self.assertFalse(self.uploaded)
+        with self.lock:
+            self.offsets.append(offset)
+            if len(self.uploaded) < offset + len(chunk):
+                self.uploaded.extend(b'\0' * (offset + len(chunk) - len(self.uploaded)))
+            self.uploaded[offset:offset + len(chunk)] = chunk
+        ret = {'size': len(chunk),
+               'hexdigest': koji.util.adler32_constructor(chunk).hexdigest()}
+        if self.parallel and kwargs.get('parallel'):
+            ret['parallel'] = True
+        return ret
+
+    def test_parallel(self):
+        callback = mock.MagicMock()
+        self.ksession.fastUpload(self.fn, 'target', blocksize=1000, workers=3,
+                                 callback=callback)
+        self.assertEqual(bytes(self.uploaded), self.data)
+        # first chunk alone, then the others in any order
+        self.assertEqual(self.offsets[0], 0)
+        self.assertEqual(sorted(self.offsets), list(range(0, 10000, 1000)))
+        self.assertEqual(len(self.workers), 2)
+        for worker in self.workers:
+            worker._close_worker.assert_called_once_with()
+        # the whole file was verified
+        self.ksession._callMethod.assert_called_with('checkUpload', ('target', 'file'),
+                                                     {'verify': 'adler32'})
+        self.assertEqual(callback.call_args[0][:2], (10000, 10000))
+
+    def test_old_hub(self):
+        self.parallel = False
+        self.ksession.fastUpload(self.fn, 'target', blocksize=1000, workers=3)
+        self.assertEqual(bytes(self.uploaded), self.data)
+        self.assertEqual(self.offsets, list(range(0, 10000, 1000)))
+        self.ksession._worker_session.assert_not_called()
+
+    def test_small_file(self):
+        self.ksession.fastUpload(self.fn, 'target', blocksize=20000, workers=3)
+        self.assertEqual(bytes(self.uploaded), self.data)
+        self.ksession._worker_session.assert_not_called()
+
+    def test_chunk_error(self):
+        def hub(name, args, kwargs):
+            if args[1] == 5000:
+                raise koji.GenericError('upload failed')
+            return self.hub(name, args, kwargs)
+        self.ksession._callMethod.side_effect = hub
+        self.ksession._worker_session.side_effect = None
+        worker = mock.MagicMock(retries=1)
+        worker._callMethod.side_effect = hub
+        self.ksession._worker_session.return_value = worker
+        with self.assertRaises(koji.GenericError):
+            self.ksession.fastUpload(self.fn, 'target', blocksize=1000, workers=2)
+        worker._close_worker.assert_called_once_with()
+
+    def test_callback_error(self):
+        # the first chunk is uploaded before the workers start
+        callback = mock.MagicMock(side_effect=[None, None, ValueError('callback failed')])
+        with self.assertRaises(ValueError):
+            self.ksession.fastUpload(self.fn, 'target', blocksize=100, workers=3,
+                                     callback=callback)
+        for worker in self.workers:
+            worker._close_worker.assert_called_once_with()
+
+
+class TestResumeUpload(unittest.TestCase):
+
+    def setUp(self):
+        self.ksession = koji.ClientSession('http://koji.example.com/kojihub')
+        self.ksession.logged_in = True
+        self.ksession.retries = 1
+        self.ksession.logout = mock.MagicMock()
+        self.ksession._callMethod = mock.MagicMock(side_effect=self.hub)
+        self.ksession._worker_session = mock.MagicMock(side_effect=self.worker_session)
+        self.lock = threading.Lock()
+        self.offsets = []
+        self.tempdir = tempfile.mkdtemp()
+        self.data = os.urandom(10000)
+        self.fn = os.path.join(self.tempdir, 'file')
+        with open(self.fn, 'wb') as fo:
+            fo.write(self.data)
+        # an interrupted upload
+        self.uploaded = bytearray(self.data[:3500])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        del self.ksession
+
+    def worker_session(self):
+        worker = mock.MagicMock(retries=1)
+        worker._callMethod.side_effect = self.hub
+        return worker
+
+    def hub(self, name, args, kwargs):
+        if name == 'checkUploadBlocks':
+            if self.uploaded is None:
+                return None
+            blocksize = args[2]
+            data = bytes(self.uploaded)
+            return {'size': len(data),
+                    'blocks': [hashlib.sha256(data[i:i + blocksize]).hexdigest()
+                               for i in range(0, len(data), blocksize)]}
+        elif name == 'checkUpload':
+            return {'size': len(self.uploaded),
+                    'hexdigest': koji.util.adler32_constructor(
+                        bytes(self.uploaded)).hexdigest()}
+        chunk, offset, path, fn = args
+        with self.lock:
+            self.offsets.append(offset)
+            if self.uploaded is None:
+                self.uploaded = bytearray()
+            elif not kwargs.get('parallel'):
+                if offset == 0 and not kwargs.get('overwrite'):
+                    raise koji.GenericError('upload path exists')
+                del self.uploaded[offset:]
+            if len(self.uploaded) < offset + len(chunk):
+                self.uploaded.extend(b'\0' * (offset + len(chunk) - len(self.uploaded)))
+            self.uploaded[offset:offset + len(chunk)] = chunk
+        return {'size': len(chunk),
+                'hexdigest': koji.util.adler32_constructor(chunk).hexdigest()}
+
+    def test_resume(self):
+        callback = mock.MagicMock()
+        self.ksession.fastUpload(self.fn, 'target', blocksize=1000, resume=True,
+                                 callback=callback)
+        self.assertEqual(bytes(self.uploaded), self.data)
+        # the complete blocks were kept
+        self.assertEqual(self.offsets, list(range(3000, 10000, 1000)))
+        self.assertEqual(callback.call_args_list[1][0][:2], (3000, 10000))
+        self.ksession._callMethod.assert_called_with('checkUpload', ('target', 'file'),
+                                                     {'verify': 'adler32'})
+
+    def test_resume_parallel(self):
+        self.ksession.fastUpload(self.fn, 'target', blocksize=1000, resume=True, workers=3)
+        self.assertEqual(bytes(self.uploaded), self.data)
+        self.assertEqual(self.offsets[0], 3000)
+        self.assertEqual(sorted(self.offsets), list(range(3000, 10000, 1000)))
+
+    def test_resume_changed_file(self):
+        # a longer upload of another file is truncated
+        self.uploaded = bytearray(self.data[:2000] + os.urandom(12000))
+        self.ksession.fastUpload(self.fn, 'target', blocksize=1000, resume=True)
+        self.assertEqual(bytes(self.uploaded), self.data)
+        self.assertEqual(self.offsets, list(range(2000, 10000, 1000)))
+
+    def test_resume_mismatch(self):
+        self.uploaded = bytearray(os.urandom(3500))
+        self.ksession.fastUpload(self.fn, 'target', blocksize=1000, resume=True)
+        self.assertEqual(bytes(self.uploaded), self.data)
+        self.assertEqual(self.offsets, list(range(0, 10000, 1000)))
+
+    def test_resume_complete(self):
+        self.uploaded = bytearray(self.data)
+        self.ksession.fastUpload(self.fn, 'target', blocksize=1000, resume=True)
+        self.assertEqual(bytes(self.uploaded), self.data)
+        # only an empty chunk
+        self.assertEqual(self.offsets, [10000])
+
+    def test_nothing_to_resume(self):
+        self.uploaded = None
+        self.ksession.fastUpload(self.fn, 'target', blocksize=1000, resume=True)
+        self.assertEqual(bytes(self.uploaded), self.data)
+        self.assertEqual(self.offsets, list(range(0, 10000, 1000)))
+
+    def test_old_hub(self):
+        def hub(name, args, kwargs):
+            if name == 'checkUploadBlocks':
+                raise koji.GenericError('Invalid method: checkUploadBlocks')
+            return self.hub(name, args, kwargs)
+        self.ksession._callMethod.side_effect = hub
+        self.uploaded = None
+        self.ksession.fastUpload(self.fn, 'target', blocksize=1000, resume=True)
+        self.assertEqual(bytes(self.uploaded), self.data)
+
+    def test_resume_option(self):
+        self.ksession.opts['upload_resume'] = True
+        self.ksession.fastUpload(self.fn, 'target', blocksize=1000)
+        self.assertEqual(self.offsets[0], 3000)
+
+
+class TestUploadDedup(unittest.TestCase):
+
+    def setUp(self):
+        self.ksession = koji.ClientSession('http://koji.example.com/kojihub')
+        self.ksession.logged_in = True
+        self.ksession.retries = 1
+        self.ksession.logout = mock.MagicMock()
+        self.ksession._callMethod = mock.MagicMock(side_effect=self.hub)
+        self.tempdir = tempfile.mkdtemp()
+        self.data = os.urandom(10000)
+        self.sha256 = hashlib.sha256(self.data).hexdigest()
+        self.fn = os.path.join(self.tempdir, 'file')
+        with open(self.fn, 'wb') as fo:
+            fo.write(self.data)
+        self.stored = {}
+        self.uploaded = bytearray()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        del self.ksession
+
+    def hub(self, name, args, kwargs):
+        if name == 'linkUpload':
+            path, fn, size, sha256 = args
+            if self.stored.get(sha256) == int(size):
+                self.uploaded[:] = self.data
+                return True
+            return False
+        elif name == 'storeUpload':
+            path, fn, sha256 = args
+            self.assertEqual(hashlib.sha256(bytes(self.uploaded)).hexdigest(), sha256)
+            self.stored[sha256] = len(self.uploaded)
+            return True
+        elif name == 'checkUpload':
+            return {'size': len(self.uploaded)}
+        chunk, offset, path, fn = args
+        self.uploaded[offset:] = chunk
+        return {'size': len(chunk),
+                'hexdigest': koji.util.adler32_constructor(chunk).hexdigest()}
+
+    def rawUploads(self):
+        return [c for c in self.ksession._callMethod.call_args_list if c[0][0] == 'rawUpload']
+
+    def test_dedup(self):
+        self.ksession.fastUpload(self.fn, 'target', blocksize=1000, dedup=True)
+        self.assertEqual(bytes(self.uploaded), self.data)
+        self.assertEqual(len(self.rawUploads()), 10)
+        self.assertEqual(self.stored, {self.sha256: 10000})
+
+        self.uploaded = bytearray()
+        self.ksession._callMethod.reset_mock()
+        callback = mock.MagicMock()
+        self.ksession.fastUpload(self.fn, 'target', blocksize=1000, dedup=True,
+                                 callback=callback, volume='vol')
+        self.assertEqual(bytes(self.uploaded), self.data)
+        self.assertEqual(self.rawUploads(), [])
+        self.ksession._callMethod.assert_called_once_with(
+            'linkUpload', ('target', 'file', '10000', self.sha256),
+            {'overwrite': False, 'volume': 'vol'})
+        self.assertEqual(callback.call_args[0][:3], (10000, 10000, 10000))
+
+    def test_small_file(self):
+        self.ksession.fastUpload(self.fn, 'target', blocksize=20000, dedup=True)
+        self.assertEqual(bytes(self.uploaded), self.data)
+        self.assertEqual(self.stored, {})
+
+    def test_dedup_option(self):
+        self.ksession.fastUpload(self.fn, 'target', blocksize=1000)
+        self.assertEqual(self.stored, {})
+        self.ksession.opts['upload_dedup'] = True
+        self.ksession.fastUpload(self.fn, 'target', blocksize=1000)
+        self.assertEqual(self.stored, {self.sha256: 10000})
+
+    def test_old_hub(self):
+        def hub(name, args, kwargs):
+            if name in ('linkUpload', 'storeUpload'):
+                raise koji.GenericError('Invalid method: %s' % name)
+            return self.hub(name, args, kwargs)
+        self.ksession._callMethod.side_effect = hub
+        self.ksession.fastUpload(self.fn, 'target', blocksize=1000, dedup=True)
+        self.assertEqual(bytes(self.uploaded), self.data)
+
+    def test_link_error(self):
+        def hub(name, args, kwargs):
+            if name == 'linkUpload':
+                raise koji.GenericError('upload path exists')
+            return self.hub(name, args, kwargs)
+        self.ksession._callMethod.side_effect = hub
+        with self.assertRaises(koji.GenericError):
+            self.ksession.fastUpload(self.fn, 'target', blocksize=1000, dedup=True)
+        self.assertEqual(self.rawUploads(), [])
+
+
+class TestTaskOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.ksession = koji.ClientSession('http://koji.example.com/kojihub')
+        self.ksession.logout = mock.MagicMock()
+        self.ksession.rsession = mock.MagicMock()
+        self.ksession._callMethod = mock.MagicMock()
+        self.response = self.ksession.rsession.get.return_value
+        self.response.status_code = 206
+        self.response.headers = {'Content-Type': 'application/octet-stream'}
+        self.data = b'0123456789' * 100
+
+    def tearDown(self):
+        del self.ksession
+
+    def respond(self, data):
+        self.response.iter_content.side_effect = \
+            lambda size: [data[i:i + size] for i in range(0, len(data), size)]
+
+    def sent(self):
+        args, kwargs = self.ksession.rsession.get.call_args
+        return args[0], kwargs['headers'].get('Range')
+
+    def test_download(self):
+        self.respond(self.data[10:30])
+        self.assertEqual(self.ksession.downloadTaskOutput(1, 'build.log', 10, 20),
+                         self.data[10:30])
+        url, byterange = self.sent()
+        self.assertEqual(url, 'http://koji.example.com/kojihub?taskID=1&filename=build.log')
+        self.assertEqual(byterange, 'bytes=10-29')
+        self.response.close.assert_called_once()
+        self.ksession._callMethod.assert_not_called()
+
+    def test_ranges(self):
+        self.respond(self.data)
+        self.ksession.downloadTaskOutput(1, 'build.log')
+        self.assertEqual(self.sent()[1], None)
+        self.ksession.downloadTaskOutput(1, 'build.log', offset=10, volume='vol')
+        url, byterange = self.sent()
+        self.assertEqual(byterange, 'bytes=10-')
+        self.assertIn('volume=vol', url)
+        self.assertEqual(self.ksession.downloadTaskOutput(1, 'build.log', offset=-100, size=5),
+                         self.data[:5])
+        self.assertEqual(self.sent()[1], 'bytes=-100')
+
+    def test_session_args(self):
+        self.ksession.setSession({'session-id': 1, 'session-key': 'abc'})
+        self.respond(self.data)
+        self.ksession.downloadTaskOutput(1, 'build.log')
+        # downloads do not use a callnum
+        self.assertEqual(self.sent()[0], 'http://koji.example.com/kojihub'
+                         '?taskID=1&filename=build.log&session-id=1&session-key=abc')
+        self.assertEqual(self.ksession.callnum, 0)
+
+    def test_iter(self):
+        self.respond(self.data)
+        chunks = list(self.ksession.iterTaskOutput(1, 'build.log', blocksize=300))
+        self.assertEqual([len(c) for c in chunks], [300, 300, 300, 100])
+        self.assertEqual(b''.join(chunks), self.data)
+        self.ksession.rsession.get.assert_called_once()
+
+    def test_empty(self):
+        self.assertEqual(self.ksession.downloadTaskOutput(1, 'build.log', size=0), b'')
+        self.ksession.rsession.get.assert_not_called()
+        self.response.status_code = 416
+        self.assertEqual(self.ksession.downloadTaskOutput(1, 'build.log', offset=2000), b'')
+        self.response.close.assert_called_once()
+
+    def test_fault(self):
+        self.response.status_code = 400
+        self.response.headers = {'Content-Type': 'text/xml'}
+        self.response.iter_content.return_value = [koji.xmlrpcplus.dumps(
+            Fault(1000, 'no file "x.log" output by task 1')).encode()]
+        with self.assertRaises(koji.GenericError) as cm:
+            self.ksession.downloadTaskOutput(1, 'x.log')
+        self.assertEqual(cm.exception.args[0], 'no file "x.log" output by task 1')
+        self.assertTrue(self.ksession.get_task_output)
+
+    def test_old_hub(self):
+        self.response.status_code = 405
+        self.ksession._callMethod.return_value = koji.util.base64encode(b'abc')
+        self.assertEqual(self.ksession.downloadTaskOutput(1, 'build.log', volume='vol'), b'abc')
+        self.assertFalse(self.ksession.get_task_output)
+        self.ksession._callMethod.assert_called_once_with(
+            'downloadTaskOutput', (1, 'build.log'), {'offset': 0, 'size': -1, 'volume': 'vol'})
+        # no further GET requests
+        self.ksession.downloadTaskOutput(1, 'build.log')
+        self.ksession.rsession.get.assert_called_once()
+
+    def test_iter_old_hub(self):
+        self.ksession.get_task_output = False
+        data = self.data[:250]
+
+        def call(name, args, kwargs):
+            offset, size = kwargs['offset'], kwargs['size']
+            return koji.util.base64encode(data[offset:offset + size])
+        self.ksession._callMethod.side_effect = call
+        chunks = list(self.ksession.iterTaskOutput(1, 'build.log', 10, blocksize=100))
+        self.assertEqual(b''.join(chunks), data[10:])
+        self.assertEqual(self.ksession._callMethod.call_count, 4)
+        # relative to the end of the file
+        self.ksession._callMethod.reset_mock()
+        self.ksession._callMethod.side_effect = \
+            lambda name, args, kwargs: koji.util.base64encode(data[-50:][:kwargs['size']])
+        chunks = list(self.ksession.iterTaskOutput(1, 'build.log', -50, blocksize=100))
+        self.assertEqual(b''.join(chunks), data[-50:])
+        self.ksession._callMethod.assert_called_once_with(
+            'downloadTaskOutput', (1, 'build.log'), {'offset': -50, 'size': 50})
@@ -0,0 +1,66 @@
+from __future__ import absolute_import
+
+import io
+import unittest
+import zlib
+
+import mock
+
+from koji import compression
+
+
+class TestCompression(unittest.TestCase):
+
+    def test_choose_encoding(self):
+        with mock.patch('koji.compression.zstandard', new=None):
+            checks = [
+                (None, None),
+                ('', None),
+                ('identity', None),
+                ('gzip, deflate', 'gzip'),
+                ('deflate, GZIP;q=0.5', 'gzip'),
+                ('gzip;q=0', None),
+                ('*', 'gzip'),
+                ('*, gzip;q=0', None),
+                ('zstd', None),
+                ('gzip;q=bad', None),
+            ]
+            for accept, expect in checks:
+                self.assertEqual(compression.choose_encoding(accept), expect, accept)
+
+    def test_choose_zstd(self):
+        with mock.patch('koji.compression.zstandard', create=True):
+            self.assertEqual(compression.supported_encodings(), ['zstd', 'gzip'])
+            self.assertEqual(compression.choose_encoding('gzip, zstd'), 'zstd')
+            self.assertEqual(compression.choose_encoding('gzip, zstd;q=0'), 'gzip')
+
+    def test_gzip(self):
+        data = b'<value><int>1</int></value>' * 10000
+        compressed = compression.compress(data, 'gzip')
+        self.assertLess(len(compressed), len(data) // 10)
+        self.assertEqual(zlib.decompress(compressed, 31), data)
+
+        chunks = [data[i:i + 1000] for i in range(0, len(data), 1000)]
+        compressed = b''.join(compression.iter_compress(iter(chunks), 'gzip'))
+        self.assertEqual(zlib.decompress(compressed, 31), data)
+
+    def test_decompress_stream(self):
+        data = b'0' * 10000000
+        stream = io.BytesIO(compression.compress(data, 'gzip'))
+        reader = compression.decompress_stream(stream, 'gzip')
+        out = []
+        while True:
+            chunk = reader.read(8192)
+            if not chunk:
+                break
+            # reads are bounded, however well the data compresses
+            self.assertLessEqual(len(chunk), 8192)
+            out.append(chunk)
+        self.assertEqual(b''.join(out), data)
+
+    def test_unsupported(self):
+        with mock.patch('koji.compression.zstandard', new=None):
+            with self.assertRaises(ValueError):
+                compression.compress(b'data', 'zstd')
+            with self.assertRaises(ValueError):
+                compression.decompress_stream(io.BytesIO(), 'br')
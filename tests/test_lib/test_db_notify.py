@@ -0,0 +1,58 @@
+import threading
+import unittest
+
+import mock
+
+import koji.db
+
+
+class TestNotifyListener(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = koji.db.NotifyListener('test_channel', backlog=5)
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_wait(self):
+        self.listener._add(['a', 'b'])
+        pos = self.listener.position()
+        self.assertEqual(pos, 2)
+        self.listener._add(['c', 'd'])
+        self.assertEqual(self.listener.wait(pos, 1), ['c', 'd'])
+        self.assertEqual(self.listener.wait(pos, 1, match=lambda p: p == 'd'), ['d'])
+        self.assertEqual(self.listener.wait(0, 1), ['a', 'b', 'c', 'd'])
+        # resets always match
+        self.listener._add([None])
+        self.assertEqual(self.listener.wait(4, 1, match=lambda p: False), [None])
+
+    def test_timeout(self):
+        self.listener._add(['a'])
+        self.assertEqual(self.listener.wait(1, 0.01), [])
+        self.assertEqual(self.listener.wait(0, 0.01, match=lambda p: False), [])
+
+    def test_overflow(self):
+        self.listener._add(['a', 'b', 'c', 'd', 'e', 'f', 'g'])
+        self.assertEqual(self.listener.wait(1, 1), [None])
+        self.assertEqual(self.listener.wait(2, 1), ['c', 'd', 'e', 'f', 'g'])
+
+    def test_wakeup(self):
+        pos = self.listener.position()
+        timer = threading.Timer(0.05, self.listener._add, [['x', 'y']])
+        timer.start()
+        self.assertEqual(self.listener.wait(pos, 10, match=lambda p: p == 'y'), ['y'])
+        timer.join()
+
+    def test_listen(self):
+        conn = mock.MagicMock()
+        notify = mock.MagicMock(payload='hello')
+        conn.notifies = [notify]
+        mock.patch('koji.db._connect', return_value=conn).start()
+        # stop the loop after the first poll
+        select = mock.patch('select.select', side_effect=[None, SystemExit]).start()
+        with self.assertRaises(SystemExit):
+            self.listener._run()
+        conn.cursor.return_value.execute.assert_called_once_with('LISTEN test_channel')
+        self.assertTrue(conn.autocommit)
+        self.assertEqual(select.call_count, 2)
+        self.assertEqual(self.listener.wait(0, 0), [None, 'hello'])
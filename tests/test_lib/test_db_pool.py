@@ -0,0 +1,140 @@
+import threading
+import unittest
+
+import mock
+import psycopg2
+
+import koji.db
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.connect = mock.patch('psycopg2.connect', side_effect=self.new_conn).start()
+        self.time = mock.patch('time.time', return_value=1000).start()
+        self.conns = []
+
+    def tearDown(self):
+        koji.db.configurePool()
+        mock.patch.stopall()
+
+    def new_conn(self, **kwargs):
+        conn = mock.MagicMock()
+        conn.closed = 0
+        self.conns.append(conn)
+        return conn
+
+    def test_reuse(self):
+        pool = koji.db.ConnectionPool(max_size=2)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        self.assertIs(pool.checkout(), conn)
+        self.assertEqual(self.connect.call_count, 1)
+        # health check on checkout
+        conn.cursor.return_value.execute.assert_called_with('BEGIN')
+        conn.rollback.assert_called_once()
+        stats = pool.getStats()
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['busy'], 1)
+        self.assertEqual(stats['idle'], 0)
+
+    def test_broken(self):
+        pool = koji.db.ConnectionPool(max_size=2)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        conn.cursor.return_value.execute.side_effect = psycopg2.OperationalError
+        conn2 = pool.checkout()
+        self.assertIsNot(conn2, conn)
+        conn.close.assert_called_once()
+        self.assertEqual(pool.getStats()['failed_checks'], 1)
+
+        # broken on checkin
+        pool.checkin(conn2, broken=True)
+        conn2.close.assert_called_once()
+        self.assertEqual(pool.getStats()['idle'], 0)
+
+    def test_max_age(self):
+        pool = koji.db.ConnectionPool(max_size=2, max_age=100, max_idle=1000)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        self.time.return_value = 1050
+        conn = pool.checkout()
+        self.time.return_value = 1101
+        pool.checkin(conn)
+        conn.close.assert_called_once()
+        self.assertIsNot(pool.checkout(), conn)
+        self.assertEqual(self.connect.call_count, 2)
+
+    def test_idle_reaping(self):
+        pool = koji.db.ConnectionPool(min_size=1, max_size=3, max_age=1000, max_idle=10)
+        conns = [pool.checkout() for i in range(3)]
+        for conn in conns:
+            pool.checkin(conn)
+        self.assertEqual(pool.getStats()['idle'], 3)
+        self.time.return_value = 1011
+        conn = pool.checkout()
+        # only min_size idle connections are kept, the most recently used one
+        self.assertIs(conn, conns[2])
+        self.assertEqual(pool.getStats()['closed'], 2)
+        pool.checkin(conn)
+        self.time.return_value = 1030
+        self.assertIs(pool.checkout(), conn)
+
+    def test_wait(self):
+        pool = koji.db.ConnectionPool(max_size=1, timeout=30)
+        conn = pool.checkout()
+        got = []
+
+        def waiter():
+            got.append(pool.checkout())
+
+        thread = threading.Thread(target=waiter)
+        with mock.patch.object(pool.cond, 'wait', side_effect=lambda t: pool.cond.release() or
+                               pool.cond.acquire()):
+            thread.start()
+            while not pool.getStats()['waits']:
+                pass
+            pool.checkin(conn)
+            thread.join()
+        self.assertEqual(got, [conn])
+        self.assertEqual(pool.getStats()['waits'], 1)
+
+    def test_timeout(self):
+        pool = koji.db.ConnectionPool(max_size=1, timeout=30)
+        pool.checkout()
+
+        def wait(timeout):
+            self.assertEqual(timeout, 30)
+            self.time.return_value += timeout
+
+        with mock.patch.object(pool.cond, 'wait', side_effect=wait):
+            with self.assertRaises(Exception):
+                pool.checkout()
+        stats = pool.getStats()
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertEqual(stats['waits'], 1)
+
+    def test_connect_failure(self):
+        pool = koji.db.ConnectionPool(max_size=1)
+        self.connect.side_effect = psycopg2.OperationalError
+        with self.assertRaises(psycopg2.OperationalError):
+            pool.checkout()
+        self.connect.side_effect = self.new_conn
+        # the slot was released
+        pool.checkout()
+
+    def test_wrapper(self):
+        koji.db.configurePool(max_size=2)
+        cnx = koji.db.connect()
+        conn = self.conns[0]
+        self.assertEqual(koji.db.getPoolStats()['busy'], 1)
+        cnx.close()
+        conn.cursor.return_value.execute.assert_called_with('ROLLBACK')
+        self.assertEqual(koji.db.getPoolStats()['idle'], 1)
+        with self.assertRaises(Exception):
+            cnx.cursor()
+
+        koji.db.configurePool()
+        conn.close.assert_called_once()
+        self.assertIsNone(koji.db.getPoolStats())
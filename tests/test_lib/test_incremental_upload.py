@@ -0,0 +1,44 @@
+from __future__ import absolute_import
+import io
+
+import mock
+import unittest
+
+import koji
+from koji.daemon import incremental_upload
+
+
+class TestIncrementalUpload(unittest.TestCase):
+
+    def setUp(self):
+        self.session = mock.MagicMock()
+        self.session.opts = {'use_fast_upload': True}
+        self.session.rawUpload.side_effect = self.rawUpload
+        self.data = b'x' * 200000
+
+    def rawUpload(self, contents, offset, path, fname, overwrite=False):
+        return {'hexdigest': koji.util.adler32_constructor(contents).hexdigest()}
+
+    def offsets(self):
+        return [c[0][1] for c in self.session.rawUpload.call_args_list]
+
+    def test_default_blocksize(self):
+        incremental_upload(self.session, 'build.log', io.BytesIO(self.data), 'tasks/1')
+        self.assertEqual(self.offsets(), [0, 65536, 131072, 196608])
+
+    def test_blocksize_option(self):
+        self.session.opts['upload_blocksize'] = 100000
+        incremental_upload(self.session, 'build.log', io.BytesIO(self.data), 'tasks/1')
+        self.assertEqual(self.offsets(), [0, 100000])
+
+    def test_blocksize(self):
+        incremental_upload(self.session, 'build.log', io.BytesIO(self.data), 'tasks/1',
+                           blocksize=150000)
+        self.assertEqual(self.offsets(), [0, 150000])
+
+    def test_legacy_upload(self):
+        self.session.opts = {}
+        incremental_upload(self.session, 'build.log', io.BytesIO(self.data), 'tasks/1',
+                           blocksize=150000)
+        self.assertEqual([c[0][4] for c in self.session.uploadFile.call_args_list],
+                         [0, 150000])
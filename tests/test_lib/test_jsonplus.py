@@ -0,0 +1,112 @@
+from __future__ import absolute_import
+import datetime
+import json
+import unittest
+
+from six.moves import xmlrpc_client
+
+from koji import jsonplus
+from koji.xmlrpcplus import Fault
+
+
+class TestJSON(unittest.TestCase):
+
+    standard_data = [
+        "Hello World",
+        5,
+        5.5,
+        None,
+        True,
+        False,
+        u'Hævē s°mə ŭnıčođė',
+        [1],
+        {"a": 1},
+        {"a": ["b", 1, 2, None], "b": {"c": 1}},
+        2 ** 63 - 1,
+    ]
+
+    def test_request(self):
+        for value in self.standard_data:
+            params = (value, {'opt': value, '__starstar': True})
+            data = jsonplus.dumps_request('someMethod', params)
+            self.assertEqual(jsonplus.loads_request(data), (params, 'someMethod'))
+
+    def test_response(self):
+        for value in self.standard_data:
+            data = jsonplus.dumps_response(value)
+            self.assertEqual(jsonplus.loads_response(data), value)
+        # tuples and generators become lists
+        data = jsonplus.dumps_response(((1, 2), (x for x in range(3))))
+        self.assertEqual(jsonplus.loads_response(data), [[1, 2], [0, 1, 2]])
+
+    def test_types(self):
+        value = {'dt': xmlrpc_client.DateTime('20240102T03:04:05'),
+                 'bin': xmlrpc_client.Binary(b'\0\1\2'),
+                 'datetime': datetime.datetime(2024, 1, 2, 3, 4, 5)}
+        result = jsonplus.loads_response(jsonplus.dumps_response(value))
+        self.assertIsInstance(result['dt'], xmlrpc_client.DateTime)
+        self.assertEqual(result['dt'].value, '20240102T03:04:05')
+        self.assertEqual(result['datetime'].value, '20240102T03:04:05')
+        self.assertEqual(result['bin'].data, b'\0\1\2')
+
+        def default(value):
+            if isinstance(value, datetime.datetime):
+                return value.isoformat(' ')
+            return NotImplemented
+        result = jsonplus.loads_response(jsonplus.dumps_response(value, default=default))
+        self.assertEqual(result['datetime'], '2024-01-02 03:04:05')
+        self.assertEqual(result['bin'].data, b'\0\1\2')
+
+        with self.assertRaises(TypeError):
+            jsonplus.dumps_response(object())
+
+    def test_bytes(self):
+        # e.g. binary rpm header fields
+        value = {'a': b'\x00\x01', 'b': bytearray(b'\xff')}
+        result = jsonplus.loads_response(jsonplus.dumps_response(value))
+        self.assertIsInstance(result['a'], xmlrpc_client.Binary)
+        self.assertEqual(result['a'].data, b'\x00\x01')
+        self.assertEqual(result['b'].data, b'\xff')
+        data = b''.join(jsonplus.iterdumps({'a': (b'\x00' for i in range(2))}))
+        self.assertEqual([v.data for v in jsonplus.loads_response(data)['a']],
+                         [b'\x00', b'\x00'])
+
+    def test_fault(self):
+        data = jsonplus.dumps_response(Fault(1000, 'Invalid method: foo'))
+        with self.assertRaises(Fault) as cm:
+            jsonplus.loads_response(data)
+        self.assertEqual(cm.exception.faultCode, 1000)
+        self.assertEqual(cm.exception.faultString, 'Invalid method: foo')
+        self.assertEqual(b''.join(jsonplus.iterdumps(Fault(1, 'x'))),
+                         jsonplus.dumps_response(Fault(1, 'x')))
+
+    def test_iterdumps(self):
+        def gen(n):
+            for i in range(n):
+                yield {'id': i, 'nested': (str(j) for j in range(i % 3))}
+        values = [
+            lambda: [],
+            lambda: 5,
+            lambda: [gen(0)],
+            lambda: {'a': gen(100), 'b': [gen(3), "\0text\0"]},
+        ]
+        for value in values:
+            chunks = list(jsonplus.iterdumps(value(), chunksize=50))
+            for chunk in chunks[:-1]:
+                self.assertGreaterEqual(len(chunk), 50)
+            expect = json.loads(jsonplus.dumps_response(value()).decode())
+            self.assertEqual(json.loads(b''.join(chunks).decode()), expect)
+
+    def test_iterdumps_lazy(self):
+        consumed = []
+
+        def gen():
+            for n in range(1000):
+                consumed.append(n)
+                yield {'n': n, 'data': 'x' * 100}
+        chunks = jsonplus.iterdumps({'data': gen()}, chunksize=1000)
+        data = next(chunks)
+        self.assertLess(len(consumed), 20)
+        data += b''.join(chunks)
+        self.assertEqual(len(consumed), 1000)
+        self.assertEqual(len(json.loads(data.decode())['result']['data']), 1000)
@@ -0,0 +1,162 @@
+from __future__ import absolute_import
+import os
+import shutil
+import sys
+import tempfile
+
+import mock
+import unittest
+
+import koji
+import koji.daemon
+from koji.daemon import LogTailer, log_output
+
+
+class TestLogTailer(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.session = mock.MagicMock()
+        self.session.opts = {'use_fast_upload': True}
+        self.session.rawUpload.side_effect = self.rawUpload
+        self.uploaded = bytearray()
+        self.incremental_upload = mock.patch('koji.daemon.incremental_upload',
+                                             wraps=koji.daemon.incremental_upload).start()
+        self.time = mock.patch('time.time', return_value=1000.0).start()
+        self.fn = os.path.join(self.tempdir, 'build.log')
+        self.fd = open(self.fn, 'w+b')
+
+    def tearDown(self):
+        self.fd.close()
+        mock.patch.stopall()
+        shutil.rmtree(self.tempdir)
+
+    def rawUpload(self, contents, offset, path, fname, overwrite=False):
+        self.uploaded[offset:] = contents
+        return {'hexdigest': koji.util.adler32_constructor(contents).hexdigest()}
+
+    def write(self, data):
+        with open(self.fn, 'ab') as fo:
+            fo.write(data)
+
+    def tailer(self, **kw):
+        tailer = LogTailer(self.session, 'tasks/1', os.getpid(), **kw)
+        self.addCleanup(tailer.close)
+        return tailer
+
+    def test_coalesce(self):
+        tailer = self.tailer(min_size=100, max_delay=1)
+        self.write(b'a')
+        tailer.upload('build.log', self.fd)
+        # first data is sent right away
+        self.assertEqual(bytes(self.uploaded), b'a')
+        self.write(b'b')
+        tailer.upload('build.log', self.fd)
+        self.assertEqual(bytes(self.uploaded), b'a')
+        self.assertEqual(tailer.pending, set(['build.log']))
+        self.time.return_value = 1001.0
+        tailer.upload('build.log', self.fd)
+        self.assertEqual(bytes(self.uploaded), b'ab')
+        self.assertEqual(tailer.pending, set())
+
+    def test_min_size(self):
+        tailer = self.tailer(min_size=100, max_delay=1)
+        self.write(b'a')
+        tailer.upload('build.log', self.fd)
+        self.write(b'b' * 100)
+        tailer.upload('build.log', self.fd)
+        self.assertEqual(bytes(self.uploaded), b'a' + b'b' * 100)
+
+    def test_final(self):
+        tailer = self.tailer(min_size=100, max_delay=1)
+        self.write(b'a')
+        tailer.upload('build.log', self.fd)
+        self.write(b'b')
+        tailer.upload('build.log', self.fd, final=True)
+        self.assertEqual(bytes(self.uploaded), b'ab')
+
+    def test_blocksize(self):
+        tailer = self.tailer(blocksize=4)
+        self.write(b'abcdefghij')
+        tailer.upload('build.log', self.fd)
+        self.assertEqual(bytes(self.uploaded), b'abcdefghij')
+        self.assertEqual([c[0][1] for c in self.session.rawUpload.call_args_list], [0, 4, 8])
+
+    def test_nothing_new(self):
+        tailer = self.tailer()
+        tailer.upload('build.log', self.fd)
+        tailer.upload('build.log', None)
+        self.incremental_upload.assert_not_called()
+
+    def test_pending_timeout(self):
+        tailer = self.tailer(max_delay=1)
+        tailer.started = True
+        tailer.pending.add('build.log')
+        tailer.last_upload['build.log'] = 999.5
+        with mock.patch('select.select') as select:
+            with mock.patch('os.waitpid', return_value=(0, 0)):
+                self.assertFalse(tailer.wait())
+        # only the process is watched until then
+        self.assertEqual(select.call_args[0][0], [tailer.pidfd])
+        self.assertEqual(select.call_args[0][3], 0.5)
+
+    def test_idle(self):
+        tailer = self.tailer()
+        tailer.started = True
+        with mock.patch('select.select') as select:
+            with mock.patch('os.waitpid', return_value=(123, 256)):
+                self.assertTrue(tailer.wait())
+        self.assertEqual(tailer.status, 256)
+        self.assertEqual(select.call_args[0][0], [tailer.pidfd, tailer.inotify.fd])
+        self.assertIsNone(select.call_args[0][3])
+
+    def test_polling(self):
+        with mock.patch('koji.daemon._Inotify', side_effect=OSError('no inotify')):
+            tailer = self.tailer(poll_interval=3)
+        tailer.started = True
+        with mock.patch('select.select') as select:
+            with mock.patch('os.waitpid', return_value=(0, 0)):
+                tailer.wait()
+        self.assertEqual(select.call_args[0][3], 3)
+
+    def test_watch_missing_dir(self):
+        tailer = self.tailer(poll_interval=3)
+        resultdir = os.path.join(self.tempdir, 'result')
+        tailer.watch(resultdir)
+        self.assertEqual(tailer.unwatched, [resultdir])
+        os.mkdir(resultdir)
+        tailer.started = True
+        with mock.patch('select.select') as select:
+            with mock.patch('os.waitpid', return_value=(0, 0)):
+                tailer.wait()
+        # polls until the directory exists
+        self.assertEqual(select.call_args[0][3], 3)
+        self.assertEqual(tailer.unwatched, [])
+
+
+class TestLogOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.session = mock.MagicMock()
+        self.session.opts = {'use_fast_upload': True}
+        self.session.rawUpload.side_effect = self.rawUpload
+        self.uploaded = bytearray()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def rawUpload(self, contents, offset, path, fname, overwrite=False):
+        self.uploaded[offset:] = contents
+        return {'hexdigest': koji.util.adler32_constructor(contents).hexdigest()}
+
+    def test_log_output(self):
+        outfile = os.path.join(self.tempdir, 'out.log')
+        script = 'import sys; print("hello"); sys.stdout.flush(); sys.exit(3)'
+        status = log_output(self.session, sys.executable, [sys.executable, '-c', script],
+                            outfile, 'tasks/1')
+        self.assertEqual(os.WEXITSTATUS(status), 3)
+        with open(outfile, 'rb') as fo:
+            data = fo.read()
+        self.assertTrue(data.endswith(b'hello\n'))
+        self.assertEqual(bytes(self.uploaded), data)
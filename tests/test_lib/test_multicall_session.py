@@ -1,4 +1,7 @@
 import mock
+import random
+import threading
+import time
 import unittest
 
 import koji
@@ -50,3 +53,103 @@ class TestNewMultiCall(unittest.TestCase):
                 self.assertEqual(call['methodName'], "echo")
                 self.assertEqual(call['params'], (i,))
                 i += 1
+
+
+class TestParallelMultiCall(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self._callMethod = mock.patch('koji.ClientSession._callMethod',
+                                      side_effect=self.multicall).start()
+        self.logout = mock.patch('koji.ClientSession.logout', autospec=True).start()
+        # only count explicit logouts
+        mock.patch('koji.ClientSession.__del__').start()
+        self.session = koji.ClientSession('FAKE_URL')
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def closed(self):
+        sessions = set(c[0][0] for c in self.logout.call_args_list)
+        sessions.discard(self.session)
+        return sessions
+
+    def multicall(self, name, args, kwargs):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        # let the batches finish out of order
+        time.sleep(random.random() * 0.01)
+        with self.lock:
+            self.running -= 1
+        results = []
+        for call in args[0]:
+            if call['params'][0] == 'fail':
+                results.append({'faultCode': 1000, 'faultString': 'failed'})
+            else:
+                results.append([call['params'][0]])
+        return results
+
+    def test_order(self):
+        with self.session.multicall(batch=10, workers=4) as m:
+            ret = [m.echo(i) for i in range(200)]
+        self.assertEqual([r.result for r in ret], list(range(200)))
+        self.assertEqual(self._callMethod.call_count, 20)
+        self.assertGreater(self.max_running, 1)
+        self.assertLessEqual(self.max_running, 4)
+        # the extra worker sessions are closed
+        self.assertEqual(len(self.closed()), 3)
+
+    def test_results(self):
+        m = self.session.multicall(workers=3)
+        for i in range(10):
+            m.echo(i)
+        self.assertEqual(m.call_all(), [[i] for i in range(10)])
+        # calls are split among the workers
+        self.assertEqual(self._callMethod.call_count, 3)
+
+    def test_max_workers(self):
+        m = self.session.multicall(batch=1, workers=100)
+        for i in range(100):
+            m.echo(i)
+        m.call_all()
+        self.assertLessEqual(self.max_running, koji.MULTICALL_MAX_WORKERS)
+        self.assertEqual(len(self.closed()), koji.MULTICALL_MAX_WORKERS - 1)
+
+    def test_strict(self):
+        m = self.session.multicall(batch=5, workers=4, strict=True)
+        for i in range(50):
+            m.echo(i)
+        m.echo('fail')
+        m.echo(99)
+        with self.assertRaises(koji.GenericError):
+            m.call_all()
+        # all batches ran
+        self.assertEqual(self._callMethod.call_count, 11)
+
+    def test_error(self):
+        self._callMethod.side_effect = koji.GenericError('connection failed')
+        m = self.session.multicall(batch=5, workers=4)
+        calls = [m.echo(i) for i in range(50)]
+        with self.assertRaises(koji.GenericError):
+            m.call_all()
+        # workers stop after an error
+        self.assertLessEqual(self._callMethod.call_count, 4)
+        with self.assertRaises(koji.MultiCallNotReady):
+            calls[-1].result
+
+    def test_subsessions(self):
+        self.session.setSession({'session-id': 1, 'session-key': 'key'})
+        subsessions = [mock.MagicMock() for i in range(3)]
+        for sub in subsessions:
+            sub._callMethod.side_effect = self.multicall
+        self.session.subsession = mock.MagicMock(side_effect=subsessions)
+        with self.session.multicall(batch=10, workers=4) as m:
+            ret = [m.echo(i) for i in range(100)]
+        self.assertEqual([r.result for r in ret], list(range(100)))
+        self.assertEqual(self.session.subsession.call_count, 3)
+        for sub in subsessions:
+            sub._callMethod.assert_called()
+            sub._close_worker.assert_called_once_with()
@@ -0,0 +1,47 @@
+from __future__ import absolute_import
+
+import unittest
+
+import koji.scheduler
+
+
+class TestAssignTasks(unittest.TestCase):
+
+    def host(self, host_id, channels=(1,), arches='x86_64', capacity=4.0, task_load=0.0):
+        return {'id': host_id, 'channels': list(channels), 'arches': arches,
+                'capacity': capacity, 'task_load': task_load}
+
+    def task(self, task_id, channel_id=1, arch='x86_64', weight=1.0):
+        return {'id': task_id, 'channel_id': channel_id, 'arch': arch, 'weight': weight}
+
+    def test_host_bins(self):
+        host = self.host(1, channels=[1, 2], arches='x86_64 i386')
+        self.assertEqual(koji.scheduler.host_bins(host),
+                         set(['1:x86_64', '1:i386', '1:noarch',
+                              '2:x86_64', '2:i386', '2:noarch']))
+        self.assertEqual(koji.scheduler.host_bins(self.host(1, channels=[])), set())
+
+    def test_most_available(self):
+        hosts = [self.host(1, task_load=2.0), self.host(2, capacity=8.0, task_load=5.0),
+                 self.host(3, task_load=1.0)]
+        tasks = [self.task(10, weight=2.0), self.task(11), self.task(12), self.task(13)]
+        # ties go to the first host
+        self.assertEqual(koji.scheduler.assign_tasks(hosts, tasks),
+                         [(10, 2), (11, 3), (12, 1), (13, 3)])
+        # the input is not modified
+        self.assertEqual(hosts[0]['task_load'], 2.0)
+
+    def test_bins(self):
+        hosts = [self.host(1, arches='aarch64'), self.host(2, channels=[2])]
+        tasks = [self.task(10), self.task(11, arch='aarch64'), self.task(12, channel_id=2),
+                 self.task(13, arch='noarch'), self.task(14, channel_id=3)]
+        self.assertEqual(koji.scheduler.assign_tasks(hosts, tasks),
+                         [(11, 1), (12, 2), (13, 1)])
+
+    def test_full(self):
+        hosts = [self.host(1, capacity=2.0, task_load=1.5)]
+        tasks = [self.task(10, weight=3.0), self.task(11, weight=0.2), self.task(12, weight=0.2)]
+        # a host below capacity can take a task above its free capacity, as
+        # builders do on their own
+        self.assertEqual(koji.scheduler.assign_tasks(hosts, tasks), [(10, 1)])
+        self.assertEqual(koji.scheduler.assign_tasks([], tasks), [])
@@ -68,6 +68,71 @@ class TestDump(unittest.TestCase):
         self.assertEqual(params, expect)
         self.assertEqual(method, None)
 
+    def test_iterdumps(self):
+        data = [(v, v) for v in self.standard_data]
+        data.append(({"a": self.gendata(), "b": [self.gendata()]},
+                     {"a": list(self.gendata()), "b": [list(self.gendata())]}))
+        for value, expect in data:
+            chunks = list(xmlrpcplus.iterdumps((value,), chunksize=50))
+            for chunk in chunks[:-1]:
+                self.assertGreaterEqual(len(chunk), 50)
+            enc = xmlrpcplus.dumps((expect,), methodresponse=1)
+            self.assertEqual(b''.join(chunks), enc.encode('utf-8'))
+
+    def test_iterdumps_lazy(self):
+        consumed = []
+
+        def gen():
+            for n in range(1000):
+                consumed.append(n)
+                yield {'n': n, 'data': 'x' * 100}
+        chunks = xmlrpcplus.iterdumps(({'data': gen()},), chunksize=1000)
+        next(chunks)
+        # only the items in the first chunk were read
+        self.assertLess(len(consumed), 10)
+        enc = next(chunks) + b''.join(chunks)
+        self.assertEqual(len(consumed), 1000)
+        self.assertIn(b'<name>n</name>', enc)
+
+    def test_iterdumps_fault(self):
+        fault = xmlrpcplus.Fault(1001, "some useless error")
+        enc = b''.join(xmlrpcplus.iterdumps(fault))
+        self.assertEqual(enc, xmlrpcplus.dumps(fault).encode('utf-8'))
+        with self.assertRaises(ValueError):
+            list(xmlrpcplus.iterdumps((1, 2)))
+
+    def iterparse(self, data):
+        u = xmlrpcplus.IterUnmarshaller()
+        p = xmlrpc_client.ExpatParser(u)
+        items = []
+        # feed in small pieces
+        for i in range(0, len(data), 10):
+            p.feed(data[i:i + 10])
+            items.extend(u.items)
+            del u.items[:]
+        p.close()
+        u.close()
+        return items + u.items
+
+    def test_iter_unmarshaller(self):
+        checks = [
+            ([1, "a", None], [((), 1), ((), "a"), ((), None)]),
+            (5, [((), 5)]),
+            ([], []),
+            ([[{"a": [1, 2]}], [3]], [((0,), {"a": [1, 2]}), ((1,), 3)]),
+            ({"t1": [{"a": 1}], "t2": [], "n": "x", "s": {"b": [2]}},
+             [(("t1",), {"a": 1}), (("n",), "x"), (("s", "b"), 2)]),
+        ]
+        for value, expect in checks:
+            enc = xmlrpcplus.dumps((value,), methodresponse=1).encode()
+            self.assertEqual(self.iterparse(enc), expect)
+
+    def test_iter_unmarshaller_fault(self):
+        enc = xmlrpcplus.dumps(xmlrpcplus.Fault(1001, "some useless error")).encode()
+        with self.assertRaises(xmlrpc_client.Fault) as cm:
+            self.iterparse(enc)
+        self.assertEqual(cm.exception.faultCode, 1001)
+
     long_data = [
             2 ** 63 - 1,
             -(2 ** 63),
@@ -856,21 +856,10 @@ def getfile(environ, taskID, name, volume='DEFAULT', offset=None, size=None):
 
 
 def _chunk_file(server, environ, taskID, name, offset, size, volume):
-    remaining = size
-    while True:
-        if remaining <= 0:
-            break
-        chunk_size = 1048576
-        if remaining < chunk_size:
-            chunk_size = remaining
-        content = server.downloadTaskOutput(taskID, name,
-                                            offset=offset, size=chunk_size, volume=volume)
-        if not content:
-            break
+    # hubs with support send the file in a single request
+    for content in server.iterTaskOutput(taskID, name, offset=offset, size=size,
+                                         volume=volume, blocksize=1048576):
         yield content
-        content_length = len(content)
-        offset += content_length
-        remaining -= content_length
 
 
 def tags(environ, start=None, order=None, childID=None):